@@ -1,23 +1,41 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 import os
-import pandas as pd
 import torch
 import pretty_midi
 import random
 import sys
 import uuid
+import base64
 import traceback
 import multiprocessing 
+import queue
 import time
+import shutil
+import glob
+import hmac
+import logging
+import socket
+import threading
 from pathlib import Path
 
 # -----------------------------------------------------
 # 1. 음악 생성 모듈 임포트
 # -----------------------------------------------------
 try:
-    from load_model import load_model 
-    from generate import generate_until_seconds, tokens_to_midi
-    from midi2wav import midi_to_wav
+    from load_model import load_inference_model
+    from generate import stream_until_seconds
+    from engine import GenerationEngine
+    from worker_pool import WorkerPool, worker_slot
+    from streaming import SegmentRenderer
+    from synth import get_synth
+    from result_cache import ResultCache, checkpoint_hash
+    from job_store import open_job_store, DEFAULT_URL as DEFAULT_JOB_STORE_URL
+    from sketch_csv import parse_sketch_csv, check_size, SketchCSVError, SketchCSVTooLarge
+    from features_to_prefix import sketch_to_prefix, build_prefix_tokens, FeatureAccumulator, all_prefixes
+    from prefix_cache import PrefixStateCache
+    from profiling import JobProfiler, sampled
+    import metrics
+    from metrics import JOB_STAGE_SECONDS, JOBS
 except ImportError as e:
     print(f"FATAL: Failed to import model modules: {e}")
     sys.exit(1)
@@ -32,13 +50,73 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
 # 모델 경로 설정
-DATA_JSONL = "./melody_tok.jsonl"
 VOCAB_JSON = "./melody_voc.json"
 CKPT_PATH = "./melModel_tf.pt" 
 
 # Deadlock 방지를 위해 CPU 사용을 강제합니다.
 DEVICE = "cpu" 
 SEED = 42
+TEMPERATURE = 1.0
+TOP_P = 0.95
+# 문법(BAR → POS → NOTE → DUR → VEL)에 맞는 토큰만 샘플링
+CONSTRAINED_DECODING = True
+# block_size를 넘는 긴 곡도 prefix + 최근 토큰 윈도우로 일정한 속도로 생성
+# (max_steps는 목표 마디 수에서 계산)
+LONG_FORM = True
+
+# Worker 풀 설정 (환경 변수로 조정 가능)
+NUM_WORKERS = int(os.environ.get("MUSICGEN_WORKERS", 2))        # 모델을 들고 있는 worker 프로세스 수
+MAX_BACKLOG = int(os.environ.get("MUSICGEN_MAX_BACKLOG", 32))   # 대기 가능한 job 수, 초과 시 429
+ENGINE_BATCH = int(os.environ.get("MUSICGEN_ENGINE_BATCH", 4))  # worker 하나가 동시에 디코딩하는 job 수
+# worker 하나가 동시에 맡는 job 수: batch보다 많으면 나머지는 엔진에서 대기
+# (엔진이 마디 경계마다 새 job의 1차 음악을 최종 렌더링보다 먼저 진행, engine.py)
+ENGINE_JOBS = int(os.environ.get("MUSICGEN_ENGINE_JOBS", 2 * ENGINE_BATCH))
+# 'pool': 이 서버가 띄우는 worker 풀 / 'celery': Celery 큐로 보내고 별도의 celery worker가 처리 (tasks.py)
+TASK_BACKEND = os.environ.get("MUSICGEN_TASK_BACKEND", "pool")
+
+# 생성된 마디가 이 개수가 되면 1차 음악(1st)으로 먼저 공개
+PREVIEW_BARS = 4
+
+# prefix별 모델 KV 상태 캐시 (worker마다, 0이면 사용 안 함)
+PREFIX_CACHE_ENTRIES = int(os.environ.get("MUSICGEN_PREFIX_CACHE", 256))
+# worker 시작 시 가능한 모든 prefix(all_prefixes) 상태를 미리 계산
+PREWARM_PREFIXES = os.environ.get("MUSICGEN_PREWARM_PREFIXES", "1") == "1"
+
+# 생성 결과 캐시 (같은 prefix/seed/샘플링 설정이면 같은 곡이 나오므로 재사용)
+CACHE_FOLDER = os.environ.get("MUSICGEN_CACHE_DIR", "cache")
+CACHE_MAX_BYTES = int(os.environ.get("MUSICGEN_CACHE_MAX_MB", 512)) * 1024 * 1024
+CACHE_MAX_ENTRIES = int(os.environ.get("MUSICGEN_CACHE_MAX_ENTRIES", 2000))
+result_cache = ResultCache(CACHE_FOLDER, CACHE_MAX_BYTES, CACHE_MAX_ENTRIES)
+
+# Job 상태 저장소: 'sqlite:///경로'(여러 프로세스 공유, 재시작 후에도 유지) 또는 'memory'
+# ('memory'는 이 프로세스 안에서만 보이므로 worker 풀(MUSICGEN_WORKERS > 0) / celery와 함께 쓸 수 없음)
+JOB_STORE_URL = os.environ.get("MUSICGEN_JOB_STORE", DEFAULT_JOB_STORE_URL)
+# 끝난 job은 이 시간이 지나면 상태와 WAV 파일을 함께 삭제
+JOB_TTL_SEC = int(os.environ.get("MUSICGEN_JOB_TTL", 24 * 3600))
+# 끝나지 않은 job이 이 시간 동안 바뀌지 않으면 failed (다른 머신의 서버 / celery worker가 남긴 job)
+JOB_STALE_SEC = int(os.environ.get("MUSICGEN_JOB_STALE", 3600))
+JOB_CLEANUP_INTERVAL = 60
+# 이 서버 프로세스가 worker 풀로 처리하는 job의 owner (재시작 후 이전 프로세스의 job을 찾는 데 사용)
+JOB_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# 라이브 세션(VR에서 stroke를 조금씩 전송): 서버 프로세스 메모리에 보관
+SESSION_TTL_SEC = int(os.environ.get("MUSICGEN_SESSION_TTL", 3600))  # 마지막 요청 후 이 시간이 지나면 삭제
+MAX_SESSIONS = int(os.environ.get("MUSICGEN_MAX_SESSIONS", 1000))   # 동시 세션 수, 초과 시 429
+TARGET_SEC = 20.0
+
+# 프로파일링(profiling.py): 'X-Profile: <PROFILE_TOKEN>' 헤더를 보낸 요청 또는 PROFILE_SAMPLE_RATE 비율의 job
+# (프로파일링 job은 결과 캐시 / batch 엔진 없이 단독 생성하므로 헤더는 토큰을 아는 요청만, 토큰이 없으면 헤더 무시)
+# 결과(torch / Python folded stack, chrome trace)는 PROFILE_FOLDER에 최근 PROFILE_KEEP개만 보관
+PROFILE_FOLDER = os.environ.get("MUSICGEN_PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_RATE = float(os.environ.get("MUSICGEN_PROFILE_SAMPLE", 0.0))
+PROFILE_TOKEN = os.environ.get("MUSICGEN_PROFILE_TOKEN", "")
+PROFILE_INTERVAL_MS = float(os.environ.get("MUSICGEN_PROFILE_INTERVAL_MS", 5))
+PROFILE_KEEP = int(os.environ.get("MUSICGEN_PROFILE_KEEP", 20))
+PROFILE_MAX_BYTES = int(os.environ.get("MUSICGEN_PROFILE_MAX_MB", 200)) * 1024 * 1024
+
+# 로그 레벨 (DEBUG면 생성된 토큰 전체를 출력)
+LOG_LEVEL = os.environ.get("MUSICGEN_LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 random.seed(SEED)
 torch.manual_seed(SEED)
@@ -51,17 +129,24 @@ class Cfg:
         self.num_layers = 8
         self.ffn_hidden_size = 4 * self.hidden_size
         self.dropout = 0.1
+        # 추론 가중치: fp32(기본) / int8 / bf16 (quantize.py로 정확도 확인 후 선택)
+        # int8 / bf16은 opt-in: fp32와 결과가 조금 다르고, 같은 prefix / seed라도 batch 엔진에서 함께 생성된
+        # job에 따라 곡이 달라짐 (재현 불가, 결과 캐시는 처음 만들어진 곡을 재사용)
+        self.quant = os.environ.get("MUSICGEN_QUANT", "fp32")
 
 cfg = Cfg()
 
 # 전역 변수 초기 선언
 model = None
-dataset = None
+vocab = None
+engine = None
+prefix_states = None
+worker_pool = None
 SF2_PATH = "TimGM6mb.sf2" 
 
 app = Flask(__name__)
 
-# job_status_db는 초기화 함수를 통해 전역으로 할당됩니다.
+# job_status_db(job_store)는 초기화 함수를 통해 전역으로 할당됩니다.
 job_status_db = None 
 
 
@@ -70,188 +155,650 @@ job_status_db = None
 # -----------------------------------------------------
 def load_generator_model():
     """Worker 프로세스에서 모델을 로드하여 전역 변수에 할당합니다."""
-    global model, dataset
+    global model, vocab
     
     if model is not None:
-        return model, dataset
+        return model, vocab
 
     try:
         print(f"Worker: Attempting to load model from {CKPT_PATH} to {DEVICE}...")
-        model, dataset = load_model(CKPT_PATH, DATA_JSONL, VOCAB_JSON, cfg, DEVICE)
+        start = time.perf_counter()
+        model, vocab = load_inference_model(CKPT_PATH, VOCAB_JSON, cfg, DEVICE)
+        JOB_STAGE_SECONDS.observe(time.perf_counter() - start, "model_load")
         print("Worker: Model loaded successfully.")
-        return model, dataset
+        return model, vocab
     except Exception as e:
         print(f"Worker: FATAL Model Load Error: {e}")
         model = None 
-        dataset = None
+        vocab = None
         raise
 
+def require_shared_job_store():
+    """worker 프로세스(풀 / celery)가 job 상태를 쓰는 구성에서 'memory' 저장소 거부"""
+    if JOB_STORE_URL == 'memory':
+        raise ValueError("MUSICGEN_JOB_STORE=memory is not shared with worker processes "
+                         "(MUSICGEN_WORKERS > 0 or MUSICGEN_TASK_BACKEND=celery), use sqlite:///<path>")
+
 def initialize_job_db():
     """메인 프로세스에서 Job DB를 초기화하고 전역 변수에 할당합니다."""
     global job_status_db
-    manager = multiprocessing.Manager()
-    job_status_db = manager.dict() 
-    print("Job status database initialized.")
+    job_status_db = open_job_store(JOB_STORE_URL)
+    print(f"Job status database initialized ({JOB_STORE_URL}).")
+
+def _owner_alive(owner):
+    # 같은 머신의 서버 프로세스만 확인 가능, 다른 머신은 JOB_STALE_SEC로만 정리
+    host, pid, _ = owner.rsplit(':', 2)
+    if owner == JOB_OWNER or host != socket.gethostname():
+        return True
+    if int(pid) == os.getpid():
+        return False # 같은 pid로 다시 뜬 이전 실행 (컨테이너 재시작 등)
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def fail_abandoned_jobs():
+    """
+    재시작 / 죽은 서버가 남긴 끝나지 않은 job → failed (클라이언트가 계속 폴링하지 않도록, 이후 TTL로 삭제)
+    - owner(서버 프로세스)가 이 머신에서 더 이상 실행 중이 아닌 job
+    - JOB_STALE_SEC 동안 바뀌지 않은 job
+    """
+    failed = []
+    error = 'Generation failed: job was interrupted (server restarted or stopped)'
+    for owner in job_status_db.owners():
+        if not _owner_alive(owner):
+            failed += job_status_db.fail_unfinished(owner=owner, error=error)
+    failed += job_status_db.fail_unfinished(older_than=time.time() - JOB_STALE_SEC, error=error)
+    if failed:
+        print(f"Marked {len(failed)} interrupted jobs as failed.")
+    return len(failed)
+
+def cleanup_expired_jobs():
+    """중단된 job 정리 후 TTL이 지난 완료/실패 job의 상태와 music 폴더의 WAV 파일 삭제"""
+    fail_abandoned_jobs()
+    expired = job_status_db.purge_finished(time.time() - JOB_TTL_SEC)
+    for job_id, _ in expired:
+        for path in glob.glob(os.path.join(OUTPUT_FOLDER, f"*-{job_id}_*.wav")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    if expired:
+        print(f"Cleaned up {len(expired)} expired jobs.")
+    return len(expired)
+
+def _cleanup_loop():
+    while True:
+        time.sleep(JOB_CLEANUP_INTERVAL)
+        try:
+            cleanup_expired_jobs()
+        except Exception:
+            traceback.print_exc()
+
+def init_worker(shared_db, shared_metrics=None, batch_engine=True):
+    """Worker 프로세스 시작 시 한 번만 실행: 모델 로드 + 배치 생성 엔진 + 신스 준비
+    batch_engine=False: task를 하나씩 처리하는 worker(tasks.py)는 엔진 없이 직접 생성"""
+    global job_status_db, engine, prefix_states
+    job_status_db = shared_db
+    # 이 worker의 지표를 메인 프로세스의 /metrics에서 합산하도록 공유 저장소에 연결
+    # (풀 worker는 번호별 row, 죽어서 다시 띄운 worker는 이전 row를 이어서 사용)
+    slot = worker_slot()
+    metrics.attach(shared_metrics, row=None if slot is None else slot + 1)
+    # worker 여러 개가 CPU 코어를 나눠 쓰도록 torch 스레드 수 제한
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // max(1, NUM_WORKERS)))
+    load_generator_model()
+    if PREFIX_CACHE_ENTRIES > 0:
+        prefix_states = PrefixStateCache(model, vocab.PAD_ID, PREFIX_CACHE_ENTRIES)
+        if PREWARM_PREFIXES:
+            prefixes = [[vocab.stoi[t] for t in p] for p in all_prefixes(vocab.vocab)]
+            print(f"Worker: prefix states pre-warmed {prefix_states.warm(prefixes[:PREFIX_CACHE_ENTRIES])}")
+    if batch_engine:
+        engine = GenerationEngine(model, vocab, max_batch=ENGINE_BATCH, prefix_cache=prefix_states,
+                                  preview_bars=PREVIEW_BARS).start()
+    # SoundFont도 worker마다 한 번만 로드해 두고 재사용
+    # (pyfluidsynth / libfluidsynth가 없으면 렌더링마다 fluidsynth CLI 프로세스 실행, /metrics의 musicgen_synth_workers)
+    synth_mode = 'in_process' if get_synth(SF2_PATH) is not None else 'cli'
+    metrics.SYNTH_WORKERS.set(1, synth_mode)
+    print(f"Worker: audio synthesis path: {synth_mode}")
+
+def run_worker_job(job):
+    """Worker 풀에서 job 하나 처리"""
+    job_id, output_name, prefix_tokens, target_sec, cache_key, submitted_at, profile = job
+    JOB_STAGE_SECONDS.observe(max(0.0, time.time() - submitted_at), "queue_wait")
+    process_music_generation(job_id, output_name, prefix_tokens, target_sec, job_status_db,
+                             cache_key=cache_key, profile=profile)
+
+def worker_lost(job):
+    """Worker 프로세스가 죽어서 끝내지 못한 job → failed (메인 프로세스의 worker 풀 monitor에서 호출)"""
+    job_id = job[0]
+    if job_status_db.transition(job_id, 'failed', error='Generation failed: worker process exited'):
+        JOBS.inc('failed')
+        print(f"[{job_id}] worker process exited, job failed")
+
+def stream_tokens(prefix_tokens, target_sec, batched=True, resumed=False, on_eta=None, **kwargs):
+    # 마디 단위로 토큰 조각을 yield
+    # 엔진이 있으면 같은 worker의 다른 job과 batch로 묶어서 생성 (batched=False면 이 스레드에서 단독 생성)
+    # resumed=True: 생성하던 곡의 토큰 전체가 prefix → prefix 상태 캐시에 넣지 않음
+    # on_eta(sec): 1차 음악까지 남은 예상 시간 (엔진에서 생성할 때만)
+    if engine is not None and batched and not resumed:
+        return engine.stream(prefix_tokens, target_sec, on_eta=on_eta, **kwargs)
+    return stream_until_seconds(model, vocab, prefix_tokens=prefix_tokens, target_sec=target_sec,
+                                prefix_cache=None if resumed else prefix_states, **kwargs)
 
 
 # ==========================================================
 # 비동기 작업자 함수
 # ==========================================================
-def process_music_generation(job_id, safe_filename, prefix_tokens, target_sec, shared_db):
-    """모델 연산을 독립된 프로세스에서 실행하여 교착 상태를 방지합니다."""
-    global model, dataset, SF2_PATH
-    
-    # 프로세스 내 모델 지연 로드 시도
+def _model_ready(job_id, shared_db):
+    """프로세스 내 모델 지연 로드 시도, 실패하면 job을 failed로 남기고 False"""
     try:
         load_generator_model()
-        if model is None or dataset is None:
+        if model is None or vocab is None:
              raise Exception("Model object is None after attempting load.")
+        return True
     except Exception as e:
         # 이 Worker 프로세스가 실패해도 shared_db에 상태를 남깁니다.
-        shared_db[job_id] = {'status': 'failed', 'error': f'Worker Model Setup Failed: {str(e)}'}
-        return 
+        shared_db.transition(job_id, 'failed', error=f'Worker Model Setup Failed: {str(e)}')
+        JOBS.inc('failed')
+        return False
+
+def process_music_generation(job_id, output_name, prefix_tokens, target_sec, shared_db, cache_key=None,
+                             profile=False):
+    """Worker 프로세스에서 모델 연산을 실행합니다."""
+    if not _model_ready(job_id, shared_db):
+        return
+
+    print(f"[{job_id}] Starting music generation (Target: {target_sec}s)...")
 
-    print(f"[{job_id}] 1. Starting 1st music generation...")
-    
-    # ----------------------------------------------------------------------------------
-    # 1. 1차 음악 생성
-    # ----------------------------------------------------------------------------------
     try:
-        target_sec_1st = 2.0 
-        g = torch.Generator(device=DEVICE).manual_seed(SEED)
-        
-        print(f"[{job_id}] 1.1. Generating tokens (2s)...")
-        generated_tokens = generate_until_seconds(
-            model, dataset, prefix_tokens=prefix_tokens, target_sec=target_sec_1st, 
-            temperature=1.0, top_p=0.95, generator=g
-        )
-        
-        output_wav_filename_1st = f'{safe_filename}_1st.wav'
-        output_midi_path_1st = os.path.join(OUTPUT_FOLDER, f'{safe_filename}_temp_1st.mid')
-        output_wav_path_1st = os.path.join(OUTPUT_FOLDER, output_wav_filename_1st)
-        
-        tokens_to_midi(generated_tokens, output_midi_path_1st)
-        midi_to_wav(output_midi_path_1st, output_wav_path_1st, SF2_PATH)
-        os.remove(output_midi_path_1st)
-        
-        # URL 생성 시 localhost 사용
-        music_url_1st = f'http://localhost:5000/music/{output_wav_filename_1st}'
-        
-        # 상태 업데이트: 1차 음악 완료
-        shared_db[job_id]['status'] = '1st_ready'
-        shared_db[job_id]['music_url_1st'] = music_url_1st
-        print(f"[{job_id}] 1st music ready. Status updated.")
+        extra = {}
+        g = _new_generator()
+        renderer = _new_renderer(output_name, prefix_tokens)
+        if profile:
+            # 프로파일링 job은 batch 엔진 대신 이 스레드에서 직접 생성 (다른 job의 연산이 섞이지 않도록)
+            profiler = JobProfiler(PROFILE_FOLDER, job_id, interval=PROFILE_INTERVAL_MS / 1000,
+                                   keep=PROFILE_KEEP, max_bytes=PROFILE_MAX_BYTES)
+            with profiler:
+                output_wav_filename_final = _generate_and_render(
+                    job_id, renderer, prefix_tokens, target_sec, shared_db, g, batched=not profiler.enabled)
+            if profiler.path is not None:
+                # 결과 폴더 이름 (background 저장이 끝나면 PROFILE_FOLDER 아래에 생김)
+                extra['profile'] = os.path.basename(profiler.path)
+        else:
+            output_wav_filename_final = _generate_and_render(
+                job_id, renderer, prefix_tokens, target_sec, shared_db, g)
+
+        _complete_job(job_id, renderer, output_wav_filename_final, shared_db, cache_key, **extra)
 
     except Exception as e:
-        print("-------------------------------------------------------")
-        print(f"[{job_id}] CRITICAL: 1ST MUSIC GENERATION FAILED")
-        traceback.print_exc()
-        print("-------------------------------------------------------")
-        shared_db[job_id] = {'status': 'failed', 'error': f'1st Gen failed: {str(e)}'}
-        return 
+        _fail_job(job_id, e, shared_db)
+
+
+def process_preview(job_id, output_name, prefix_tokens, target_sec, shared_db, cache_key=None):
+    """
+    1차 task(tasks.py): 1차 음악까지만 생성해 공개하고, 이어서 생성할 상태(JSON)를 반환
+    곡이 1차 음악 길이 안에 끝났거나 실패하면 job을 마무리하고 None 반환
+    """
+    if not _model_ready(job_id, shared_db):
+        return None
+
+    print(f"[{job_id}] Starting preview generation (Target: {target_sec}s)...")
 
+    try:
+        g = _new_generator()
+        renderer = _new_renderer(output_name, prefix_tokens)
+        output_wav_filename_final = _generate_and_render(job_id, renderer, prefix_tokens, target_sec,
+                                                         shared_db, g, preview_only=True)
+        if output_wav_filename_final is None:
+            # stream 조각은 마디를 끝낸 BAR 직전까지 → BAR까지 샘플링한 generator 상태와 함께 넘김
+            return {'tokens': renderer.tokens + ['BAR'],
+                    'rng': base64.b64encode(g.get_state().numpy().tobytes()).decode('ascii'),
+                    'renderer': renderer.state()}
+        _complete_job(job_id, renderer, output_wav_filename_final, shared_db, cache_key)
+
+    except Exception as e:
+        _fail_job(job_id, e, shared_db)
+    return None
+
+
+def process_final(job_id, output_name, target_sec, resume, shared_db, cache_key=None):
+    """최종 task(tasks.py): process_preview가 넘긴 상태에서 이어서 생성해 최종 음악까지 완료"""
+    if not _model_ready(job_id, shared_db):
+        return
+
+    print(f"[{job_id}] Resuming generation after preview...")
+
+    try:
+        g = _new_generator()
+        g.set_state(torch.frombuffer(bytearray(base64.b64decode(resume['rng'])), dtype=torch.uint8))
+        renderer = _new_renderer(output_name, resume['tokens']).restore(resume['renderer'])
+        output_wav_filename_final = _generate_and_render(job_id, renderer, resume['tokens'], target_sec,
+                                                         shared_db, g, resumed=True)
+        _complete_job(job_id, renderer, output_wav_filename_final, shared_db, cache_key)
+
+    except Exception as e:
+        _fail_job(job_id, e, shared_db)
+
+
+def _new_generator():
+    # job마다 같은 seed → 같은 prefix면 같은 곡 (결과 캐시의 전제)
+    return torch.Generator(device=DEVICE).manual_seed(SEED + 1)
+
+def _new_renderer(output_name, prefix_tokens):
+    return SegmentRenderer(OUTPUT_FOLDER, output_name, SF2_PATH, prefix_tokens, preview_bars=PREVIEW_BARS)
+
+def _complete_job(job_id, renderer, output_wav_filename_final, shared_db, cache_key=None, **extra):
+    # 상태 업데이트: 최종 음악 완료
+    shared_db.transition(job_id, 'completed',
+               music_url_1st=_music_url(renderer.preview_file),
+               music_url=_music_url(output_wav_filename_final),
+               segments=[_segment_info(s) for s in renderer.segments], **extra)
+    print(f"[{job_id}] ✅ Final music completed. Status updated.")
+    JOBS.inc('completed')
+
+    if cache_key is not None:
+        _store_result(cache_key, renderer, output_wav_filename_final)
+
+def _fail_job(job_id, e, shared_db):
+    print("-------------------------------------------------------")
+    print(f"[{job_id}] CRITICAL: MUSIC GENERATION FAILED")
+    traceback.print_exc()
+    print("-------------------------------------------------------")
+    shared_db.transition(job_id, 'failed', error=f'Generation failed: {str(e)}')
+    JOBS.inc('failed')
+
+
+def _generate_and_render(job_id, renderer, prefix_tokens, target_sec, shared_db, generator, batched=True,
+                         preview_only=False, resumed=False):
+    """
+    생성 + segment 렌더링, 최종 WAV 파일 이름 반환
+    preview_only=True: 1차 음악을 공개하면 그 마디에서 멈추고 None 반환 (곡이 더 짧으면 끝까지)
+    resumed=True: prefix_tokens / renderer / generator가 멈췄던 곳의 상태 (process_final)
+    """
     # ----------------------------------------------------------------------------------
-    # 2. 최종 음악 생성
+    # 한 번의 생성으로 마디가 완성될 때마다 segment를 렌더링
+    # 1차 음악(1st)은 최종 음악의 앞부분 (예전처럼 다른 seed로 따로 생성하지 않음)
     # ----------------------------------------------------------------------------------
-    print(f"[{job_id}] 2. Starting final music generation (Target: {target_sec}s)...")
+    preview_sent = renderer.preview_file is not None
+    job_start = time.perf_counter()
+
+    # 도중에 멈추려면 이 스레드에서 생성 (엔진은 멈춘 뒤에도 generator를 계속 사용)
+    def report_eta(sec):
+        # 상태 조회에서 1차 음악까지 남은 예상 시간 확인 (다른 job의 1차 작업이 많을수록 길어짐)
+        shared_db.update(job_id, eta_first_audio_sec=round(sec, 1))
+
+    chunks = stream_tokens(prefix_tokens, target_sec, batched=batched and not preview_only, resumed=resumed,
+                           on_eta=None if preview_sent else report_eta, temperature=TEMPERATURE, top_p=TOP_P, constrained=CONSTRAINED_DECODING,
+                           long_form=LONG_FORM, max_steps=None, generator=generator)
+    for chunk in chunks:
+        decoded_sec = time.perf_counter() - job_start
+        seg = renderer.add(chunk)
+        if seg is None:
+            continue
+
+        segments = [_segment_info(s) for s in renderer.segments]
+        if renderer.preview_file is not None and not preview_sent:
+            JOB_STAGE_SECONDS.observe(decoded_sec, 'first_pass')
+            # 상태 업데이트: 1차 음악 완료
+            shared_db.transition(job_id, '1st_ready', segments=segments, eta_first_audio_sec=0,
+                                 music_url_1st=_music_url(renderer.preview_file))
+            print(f"[{job_id}] 1st music ready. Status updated.")
+            preview_sent = True
+            if preview_only:
+                chunks.close()
+                return None
+        else:
+            shared_db.update(job_id, segments=segments)
+
+    decoded_sec = time.perf_counter() - job_start
+    JOB_STAGE_SECONDS.observe(decoded_sec, 'final_decode')
+    if not preview_sent:
+        # preview 길이보다 짧은 곡은 최종 곡이 곧 1차 음악
+        JOB_STAGE_SECONDS.observe(decoded_sec, 'first_pass')
+
+    output_wav_filename_final = f'{renderer.name}_final.wav'
+    renderer.finish(output_wav_filename_final)
+    JOB_STAGE_SECONDS.observe(renderer.midi_sec, 'midi')
+    JOB_STAGE_SECONDS.observe(renderer.synth_sec, 'synth')
+    JOB_STAGE_SECONDS.observe(renderer.write_sec, 'write')
+    JOB_STAGE_SECONDS.observe(time.perf_counter() - job_start, 'total')
+    return output_wav_filename_final
+
+
+def _music_url(filename):
+    # URL 생성 시 localhost 사용
+    return f'http://localhost:5000/music/{filename}'
+
+def _segment_info(seg):
+    return {'url': _music_url(seg['file']), 'start_sec': seg['start_sec'], 'duration_sec': seg['duration_sec']}
+
+
+# ==========================================================
+# 생성 결과 캐시
+# ==========================================================
+def _result_cache_key(prefix_tokens, target_sec):
+    """체크포인트가 없으면 캐시를 사용하지 않음 (None)"""
+    try:
+        model_hash = checkpoint_hash(CKPT_PATH)
+    except OSError:
+        return None
+    return ResultCache.make_key(prefix_tokens, target_sec, SEED + 1, TEMPERATURE, TOP_P, model_hash,
+                                preview_bars=PREVIEW_BARS, sf2=os.path.basename(SF2_PATH),
+                                constrained=CONSTRAINED_DECODING, long_form=LONG_FORM, quant=cfg.quant)
+
+def _store_result(cache_key, renderer, final_filename):
+    """생성이 끝난 곡(토큰 + preview/최종/segment WAV)을 캐시에 저장, 실패해도 job에는 영향 없음"""
     try:
-        # time.sleep(1) 
-
-        g = torch.Generator(device=DEVICE).manual_seed(SEED + 1)
-        generated_tokens_final = generate_until_seconds(
-            model, dataset, prefix_tokens=prefix_tokens, target_sec=target_sec, 
-            temperature=1.0, top_p=0.95, generator=g
-        )
-
-        output_wav_filename_final = f'{safe_filename}_final.wav'
-        output_midi_path_final = os.path.join(OUTPUT_FOLDER, f'{safe_filename}_temp_final.mid')
-        output_wav_path_final = os.path.join(OUTPUT_FOLDER, output_wav_filename_final)
-        
-        tokens_to_midi(generated_tokens_final, output_midi_path_final)
-        midi_to_wav(output_midi_path_final, output_wav_path_final, SF2_PATH)
-        os.remove(output_midi_path_final)
-
-        # URL 생성 시 localhost 사용
-        music_url_final = f'http://localhost:5000/music/{output_wav_filename_final}'
-        
-        # 상태 업데이트: 최종 음악 완료
-        shared_db[job_id]['status'] = 'completed'
-        shared_db[job_id]['music_url'] = music_url_final
-        print(f"[{job_id}] ✅ Final music completed. Status updated.")
-        
+        files = {'1st': os.path.join(OUTPUT_FOLDER, renderer.preview_file),
+                 'final': os.path.join(OUTPUT_FOLDER, final_filename)}
+        for i, seg in enumerate(renderer.segments):
+            files[f'seg{i:03d}'] = os.path.join(OUTPUT_FOLDER, seg['file'])
+        segments = [{'name': f'seg{i:03d}', 'start_sec': s['start_sec'], 'duration_sec': s['duration_sec']}
+                    for i, s in enumerate(renderer.segments)]
+        result_cache.put(cache_key, renderer.tokens, files, segments=segments)
     except Exception as e:
-        print("-------------------------------------------------------")
-        print(f"[{job_id}] CRITICAL: FINAL MUSIC GENERATION FAILED")
-        traceback.print_exc()
-        print("-------------------------------------------------------")
-        shared_db[job_id]['status'] = 'failed' 
-        shared_db[job_id]['error'] = f'Final Gen failed: {str(e)}'
+        print(f"Result cache store failed: {e}")
+
+def _link_or_copy(src, dst):
+    # 같은 파일 시스템이면 hard link로 복사 없이 공개
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def _serve_cached(job_id, output_name, hit):
+    """캐시 적중: 저장된 WAV를 music 폴더로 꺼내고 job을 바로 완료 상태로 등록"""
+    files = hit['files']
+    final_filename = f'{output_name}_final.wav'
+    preview_filename = f'{output_name}_1st.wav'
+    _link_or_copy(files['final'], os.path.join(OUTPUT_FOLDER, final_filename))
+    _link_or_copy(files['1st'], os.path.join(OUTPUT_FOLDER, preview_filename))
+
+    segments = []
+    for i, seg in enumerate(hit.get('segments', [])):
+        seg_file = f'{output_name}_seg{i:03d}.wav'
+        _link_or_copy(files[seg['name']], os.path.join(OUTPUT_FOLDER, seg_file))
+        segments.append(_segment_info({'file': seg_file, 'start_sec': seg['start_sec'],
+                                       'duration_sec': seg['duration_sec']}))
+
+    job_status_db.create(job_id, status='completed', message='Served from cache.',
+                         music_url_1st=_music_url(preview_filename),
+                         music_url=_music_url(final_filename),
+                         segments=segments, cached=True)
 
 
 # ==========================================================
-# Flask 엔드포인트
+# 요청 처리 공통 로직 (Flask / aiohttp 서버(server.py) 공용)
+# 반환값: (응답 dict, HTTP status)
 # ==========================================================
 
-@app.route('/api/upload_data', methods=['POST'])
-def upload_data():
-    global job_status_db, model, dataset
-    
-    # 모델 로드 상태 확인 (503 응답)
-    if model is None or dataset is None:
-        return jsonify({'error': 'Music generation model is not loaded.'}), 503
-        
-    filename = request.headers.get('X-File-Name')
-    if not filename:
-        return jsonify({'error': 'File name (X-File-Name header) is missing.'}), 400
+def check_upload_size(content_length):
+    """body를 읽기 전에 Content-Length만으로 너무 큰 업로드를 거름 (통과하면 None)"""
+    try:
+        check_size(content_length)
+    except SketchCSVTooLarge as e:
+        return {'error': str(e)}, 413
+    return None
+
+def wants_profile(header_value):
+    """X-Profile 요청 헤더 값 → 이 요청의 job을 프로파일링할지 (MUSICGEN_PROFILE_TOKEN과 같을 때만)"""
+    if not PROFILE_TOKEN or not header_value:
+        return False
+    return hmac.compare_digest(str(header_value).strip().encode(), PROFILE_TOKEN.encode())
+
+def _start_job(name, prefix_tokens, target_sec, profile=False):
+    """prefix로 생성 job을 시작 (캐시에 있으면 바로 완료)"""
+    job_id = str(uuid.uuid4())
+    # 같은 이름의 파일이 동시에 올라와도 결과 WAV가 겹치지 않도록 job_id를 붙임
+    output_name = f"{name}-{job_id}"
+    profile = profile or sampled(PROFILE_SAMPLE_RATE)
+
+    # 같은 조건으로 생성한 적이 있으면 worker 없이 바로 완료 (프로파일링 job은 항상 새로 생성)
+    cache_key = _result_cache_key(prefix_tokens, target_sec)
+    hit = result_cache.get(cache_key) if cache_key is not None and not profile else None
+    if hit is not None:
+        try:
+            _serve_cached(job_id, output_name, hit)
+            JOBS.inc('cached')
+            return {
+                'job_id': job_id,
+                'status': 'completed',
+                'message': 'Served from cache.'
+            }, 200
+        except OSError as e:
+            # 캐시 항목이 도중에 삭제된 경우 등은 새로 생성
+            print(f"Result cache read failed: {e}")
+
+    # 모델을 로드한 worker가 하나도 없으면 503 응답
+    if worker_pool is None or worker_pool.ready_workers() == 0:
+        JOBS.inc('rejected')
+        return {'error': 'Music generation model is not loaded.'}, 503
+
+    # 초기 상태 설정 (공유 job 저장소)
+    # worker 풀의 job은 이 프로세스가 끝나면 처리할 곳이 없으므로 owner를 기록 (celery job은 broker에 남음)
+    owner = None if TASK_BACKEND == 'celery' else JOB_OWNER
+    job_status_db.create(job_id, owner=owner, status='in_progress', message='Starting generation...')
     
-    file_data = request.data 
+    # Worker 풀 큐로 작업 전달 (큐가 가득 차면 429)
+    try:
+        worker_pool.submit((job_id, output_name, prefix_tokens, target_sec, cache_key, time.time(), profile))
+    except queue.Full:
+        job_status_db.delete(job_id)
+        JOBS.inc('rejected')
+        return {'error': 'Server is busy. Please retry later.'}, 429
+
+    # Job ID를 즉시 반환하여 클라이언트가 폴링을 시작하게 함
+    return {
+        'job_id': job_id, 
+        'status': 'started',
+        'message': 'Job started successfully. Polling required.'
+    }, 200
+
+def _parse_upload(file_data):
+    """(SketchTable, None) 또는 (None, 에러 응답)"""
     if not file_data:
-        return jsonify({'error': 'No data in request body'}), 400
+        return None, ({'error': 'No data in request body'}, 400)
+    try:
+        return parse_sketch_csv(file_data), None
+    except SketchCSVTooLarge as e:
+        return None, ({'error': str(e)}, 413)
+    except SketchCSVError as e:
+        return None, ({'error': f'CSV or file handling failed: {str(e)}'}, 400)
+
+def start_generation(filename, file_data, profile=False):
+    """업로드된 스케치 CSV로 생성 job을 시작 (profile=True면 이 job을 프로파일링)"""
+    if not filename:
+        return {'error': 'File name (X-File-Name header) is missing.'}, 400
 
-    job_id = str(uuid.uuid4())
+    # CSV 읽기 (임시 파일 / DataFrame 없이 요청 body에서 바로 필요한 열만)
+    sketch, error = _parse_upload(file_data)
+    if error is not None:
+        return error
+
+    # 스케치 → 조건 prefix (키 / 모드 / BPM / 음역 / 리듬 / 밀도 / 채도)
+    prefix_tokens = build_prefix_tokens(sketch_to_prefix(sketch))
     safe_filename = filename.split('.')[0].replace(' ', '_')
+    return _start_job(safe_filename, prefix_tokens, TARGET_SEC, profile=profile)
 
-    # 2. 파일 저장 및 CSV 읽기 (동기적으로 처리)
-    file_path = os.path.join(UPLOAD_FOLDER, f"{safe_filename}-{job_id}.csv")
-    try:
-        with open(file_path, 'wb') as f:
-            f.write(file_data)
-        df = pd.read_csv(file_path) 
-        os.remove(file_path)
-    except Exception as e:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        return jsonify({'error': f'CSV or file handling failed: {str(e)}'}), 400
-    
-    prefix_tokens = ["KEY_7", "MODE_MAJ", "BPM_120", "REG_MID", "RHY_2", "DENS_1", "CHR_1", "BAR", "POS_0"]
-    target_sec = 20.0 
 
-    # 초기 상태 설정 (공유 딕셔너리)
-    job_status_db[job_id] = {'status': 'in_progress', 'message': 'Starting generation...'}
+# ----- 라이브 세션: stroke를 조금씩 보내고, prefix가 바뀔 때만 다시 생성 -----
+
+class _Session:
+    def __init__(self):
+        self.acc = FeatureAccumulator()
+        self.lock = threading.Lock()
+        self.last_access = time.time()
+        self.job_id = None
+
+_sessions = {} # session_id → _Session
+_sessions_lock = threading.Lock()
+
+def _purge_sessions():
+    expired = time.time() - SESSION_TTL_SEC
+    for sid in [sid for sid, sess in _sessions.items() if sess.last_access < expired]:
+        del _sessions[sid]
+
+def create_session():
+    with _sessions_lock:
+        _purge_sessions()
+        if len(_sessions) >= MAX_SESSIONS:
+            return {'error': 'Too many live sessions. Please retry later.'}, 429
+        session_id = str(uuid.uuid4())
+        _sessions[session_id] = _Session()
+    return {'session_id': session_id}, 200
+
+def delete_session(session_id):
+    with _sessions_lock:
+        if _sessions.pop(session_id, None) is None:
+            return {'status': 'error', 'message': 'Session ID not found.'}, 404
+    return {'session_id': session_id, 'status': 'deleted'}, 200
+
+def add_session_strokes(session_id, file_data):
+    """
+    새 stroke 행(ExportCSV와 같은 형식, 헤더 포함)을 세션에 반영
+    양자화된 feature가 바뀌어 prefix가 달라졌을 때만 새 생성 job 시작
+    """
+    with _sessions_lock:
+        sess = _sessions.get(session_id)
+    if sess is None:
+        return {'status': 'error', 'message': 'Session ID not found.'}, 404
+
+    sketch, error = _parse_upload(file_data)
+    if error is not None:
+        return error
+
+    with sess.lock:
+        sess.last_access = time.time()
+        emitted = sess.acc.emitted
+        prefix_tokens = sess.acc.add_rows(sketch)
+        body = {'session_id': session_id, 'strokes': sess.acc.n_strokes,
+                'prefix': sess.acc.emitted, 'changed': prefix_tokens is not None}
+        if prefix_tokens is None:
+            body['job_id'] = sess.job_id
+            return body, 200
+
+        job, status = _start_job(f"session_{session_id[:8]}", prefix_tokens, TARGET_SEC)
+        if status != 200:
+            # job을 못 만들었으면 다음 요청에서 다시 시도하도록 되돌림
+            sess.acc.emitted = emitted
+            return job, status
+        sess.job_id = job['job_id']
+        body.update(job)
+        return body, 200
+
+def job_status(job_id):
+    status_info = job_status_db.get(job_id)
+
+    if status_info is None:
+        return {'status': 'error', 'message': 'Job ID not found.'}, 404
+
+    return status_info, 200
+
+def job_segments(job_id):
+    """지금까지 렌더링된 segment 목록 (순서대로 이어 재생하면 최종 음악과 같음)"""
+    status_info = job_status_db.get(job_id)
+
+    if status_info is None:
+        return {'status': 'error', 'message': 'Job ID not found.'}, 404
+
+    return {
+        'status': status_info.get('status'),
+        'segments': status_info.get('segments', []),
+        'done': status_info.get('status') in ('completed', 'failed'),
+    }, 200
+
+def metrics_text():
+    """Prometheus text format (/metrics): 모든 worker의 지표 합산 + 현재 풀 상태"""
+    if worker_pool is not None:
+        metrics.WORKERS_READY.set(worker_pool.ready_workers())
+        depth = worker_pool.backlog()
+        if depth is not None:
+            metrics.QUEUE_DEPTH.set(depth)
+    return metrics.render()
+
+def start_worker_tier():
+    """메인 프로세스에서 한 번: Job DB + 만료 job 정리 스레드 + 모델 worker 풀 (또는 Celery 큐) 시작"""
+    global worker_pool
+
+    if TASK_BACKEND == 'celery' or NUM_WORKERS > 0:
+        require_shared_job_store()
+    # Job DB 초기화 함수 호출
+    initialize_job_db()
+    cleanup_expired_jobs()
+    threading.Thread(target=_cleanup_loop, name="job-cleanup", daemon=True).start()
     
-    # multiprocessing.Process로 작업 시작
-    process = multiprocessing.Process(
-        target=process_music_generation, 
-        args=(job_id, safe_filename, prefix_tokens, target_sec, job_status_db)
-    )
-    process.start()
-
-    # 4. Job ID를 즉시 반환하여 클라이언트가 폴링을 시작하게 함
-    return jsonify({
-        'job_id': job_id, 
-        'status': 'started',
-        'message': 'Job started successfully. Polling required.'
-    }), 200
+    if TASK_BACKEND == 'celery':
+        # 모델은 celery worker가 로드 (다른 머신일 수도 있음), 이 프로세스는 큐에 넣기만 함
+        from tasks import CeleryQueue
+        worker_pool = CeleryQueue(max_backlog=MAX_BACKLOG).start()
+        print(f"Celery task queue: {worker_pool.ready_workers()} workers, backlog {MAX_BACKLOG}")
+        return
+
+    # worker 지표는 공유 메모리에 프로세스별로 기록 (메인 프로세스 + worker 수만큼 row)
+    shared_metrics = metrics.create_shared(NUM_WORKERS + 1)
+
+    # 모델은 worker 프로세스에서만 한 번씩 로드 (로드 실패 시 worker가 없으므로 503 응답)
+    worker_pool = WorkerPool(
+        init_worker, run_worker_job,
+        num_workers=NUM_WORKERS, max_backlog=MAX_BACKLOG,
+        threads_per_worker=ENGINE_JOBS, initargs=(job_status_db, shared_metrics), on_lost=worker_lost
+    ).start()
+    print(f"Worker pool started: {NUM_WORKERS} workers, backlog {MAX_BACKLOG}")
+
+
+# ==========================================================
+# Flask 엔드포인트 (개발용 서버, 운영은 server.py)
+# ==========================================================
+
+@app.route('/api/upload_data', methods=['POST'])
+def upload_data():
+    too_large = check_upload_size(request.content_length)
+    if too_large is not None:
+        body, status = too_large
+        return jsonify(body), status
+    body, status = start_generation(request.headers.get('X-File-Name'), request.data,
+                                    profile=wants_profile(request.headers.get('X-Profile')))
+    return jsonify(body), status
+
+@app.route('/api/session', methods=['POST'])
+def post_session():
+    body, status = create_session()
+    return jsonify(body), status
+
+@app.route('/api/session/<session_id>/strokes', methods=['POST'])
+def post_session_strokes(session_id):
+    too_large = check_upload_size(request.content_length)
+    if too_large is not None:
+        body, status = too_large
+        return jsonify(body), status
+    body, status = add_session_strokes(session_id, request.data)
+    return jsonify(body), status
+
+@app.route('/api/session/<session_id>', methods=['DELETE'])
+def remove_session(session_id):
+    body, status = delete_session(session_id)
+    return jsonify(body), status
 
 @app.route('/api/status/<job_id>', methods=['GET'])
 def get_job_status(job_id):
-    global job_status_db
-    status_info = job_status_db.get(job_id)
+    body, status = job_status(job_id)
+    return jsonify(body), status
 
-    if status_info is None:
-        return jsonify({'status': 'error', 'message': 'Job ID not found.'}), 404
 
-    return jsonify(status_info)
+@app.route('/api/segments/<job_id>', methods=['GET'])
+def get_job_segments(job_id):
+    body, status = job_segments(job_id)
+    return jsonify(body), status
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics_text(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/music/<path:filename>')
@@ -263,15 +810,7 @@ if __name__ == '__main__':
     # 멀티프로세싱 관리자 초기화
     multiprocessing.freeze_support() 
     
-    # Job DB 초기화 함수 호출
-    initialize_job_db()
-    
-    # 메인 프로세스에서 모델 로드 시도
-    try:
-        load_generator_model()
-    except Exception as e:
-        print(f"FATAL: Main process model load failed. Server will start with status 503. Error: {e}")
-        pass 
+    start_worker_tier()
     
     # Flask 서버 실행 (reloader 비활성화)
-    app.run(host='0.0.0.0', debug=True, use_reloader=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', debug=True, use_reloader=False)
@@ -0,0 +1,323 @@
+"""
+생성 파이프라인 단계별 벤치마크 (커밋 간 비교용 JSON 출력)
+- 모델 로드 / prefix 인코딩(CSV 파싱 → prefix → prefill) / batch 1·4·16 디코딩 tokens/s /
+  목표 길이 곡 생성 / tokens_to_midi / MIDI → WAV
+- --url을 주면 실행 중인 서버(app.py / server.py)에 N개 클라이언트가 동시에
+  /api/upload_data → completed 까지 반복하고 p50/p95/p99 지연 시간을 측정
+  (결과 캐시 적중을 빼려면 서버를 MUSICGEN_CACHE_MAX_ENTRIES=0 으로 실행)
+- 체크포인트가 없으면(또는 --random) 같은 Cfg 크기의 무작위 초기화 모델로 측정
+예:
+  python benchmark.py --out bench_before.json
+  python benchmark.py --url http://localhost:5000 -c 8 --out bench_after.json --compare bench_before.json
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import subprocess
+import time
+
+import torch
+
+from data import MelodyVocab
+from features_to_prefix import all_prefixes, build_prefix_tokens, sketch_to_prefix
+from generate import generate_until_seconds, tokens_to_midi_obj
+from load_model import _new_model, load_inference_model
+from prefix_cache import PrefixStateCache, prefill
+from quantize import quantize_model
+from sketch_csv import parse_sketch_csv
+from synth import midi_to_wav_bytes
+from train import Cfg
+
+
+def _ms(sec: float) -> float:
+    return round(sec * 1000, 3)
+
+
+def _percentiles(values):
+    # loadtest.py와 같은 nearest-rank 방식 (ms)
+    values = sorted(values)
+    pct = lambda p: _ms(values[min(len(values) - 1, int(p * len(values)))]) if values else None
+    return {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99)}
+
+
+def timed(fn, repeat: int = 20, warmup: int = 1) -> dict:
+    """fn()을 warmup 후 repeat번 실행한 시간 (ms)"""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {"repeat": repeat, "mean_ms": _ms(sum(times) / len(times)),
+            "p50_ms": _ms(times[len(times) // 2]), "min_ms": _ms(times[0])}
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ----- 단계별 측정 -----
+
+def bench_load(args, cfg):
+    """(model, vocab, 결과) - 체크포인트가 없으면 무작위 초기화 (같은 구조 / 양자화)"""
+    start = time.perf_counter()
+    if os.path.exists(args.ckpt) and not args.random:
+        model, vocab = load_inference_model(args.ckpt, args.voc, cfg, "cpu")
+        source = "checkpoint"
+    else:
+        torch.manual_seed(args.seed)
+        vocab = MelodyVocab(args.voc, cfg.block_size)
+        model = quantize_model(_new_model(vocab, cfg).eval(), cfg.quant)
+        source = "random"
+    elapsed = time.perf_counter() - start
+    return model, vocab, {"source": source, "quant": cfg.quant, "ms": _ms(elapsed)}
+
+
+def bench_prefix(model, vocab, csv_bytes, repeat: int):
+    """스케치 CSV → 조건 prefix 토큰 → 모델 KV 상태"""
+    result = {}
+    if csv_bytes is not None:
+        sketch = parse_sketch_csv(csv_bytes)
+        result["csv_rows"] = len(sketch)
+        result["parse_csv"] = timed(lambda: parse_sketch_csv(csv_bytes), repeat)
+        result["sketch_to_prefix"] = timed(lambda: build_prefix_tokens(sketch_to_prefix(sketch)), repeat)
+        prefix_tokens = build_prefix_tokens(sketch_to_prefix(sketch))
+    else:
+        prefix_tokens = all_prefixes(vocab.vocab)[0]
+    ids = [vocab.stoi[t] for t in prefix_tokens]
+
+    with torch.no_grad():
+        result["prefill"] = timed(lambda: prefill(model, ids, vocab.PAD_ID), repeat)
+        states = PrefixStateCache(model, vocab.PAD_ID)
+        states.warm([ids])
+        result["prefill_cached"] = timed(lambda: prefill(model, ids, vocab.PAD_ID, states), repeat)
+    return prefix_tokens, result
+
+
+@torch.no_grad()
+def bench_decode(model, vocab, batch: int, steps: int) -> dict:
+    """
+    KV cache로 batch개 row를 한 토큰씩 디코딩하는 모델 속도 (greedy, 문법/샘플링 제외)
+    row마다 다른 prefix (all_prefixes 순서대로)
+    """
+    prefixes = all_prefixes(vocab.vocab)
+    rows = [[vocab.stoi[t] for t in prefixes[i % len(prefixes)]] for i in range(batch)]
+    steps = max(1, min(steps, vocab.block_size - len(rows[0])))
+    x = torch.tensor(rows, dtype=torch.long)
+
+    cache = model.new_cache()
+    logits = model.forward_cached(x, cache, pad_id=vocab.PAD_ID)
+    start = time.perf_counter()
+    for _ in range(steps):
+        nid = logits[:, -1].argmax(-1, keepdim=True)
+        logits = model.forward_cached(nid, cache, pad_id=vocab.PAD_ID)
+    elapsed = time.perf_counter() - start
+    return {"batch": batch, "steps": steps, "tokens_per_sec": round(batch * steps / elapsed, 1),
+            "ms_per_step": _ms(elapsed / steps)}
+
+
+def bench_generate(model, vocab, prefix_tokens, target_sec: float, seed: int):
+    """app.py와 같은 설정(문법 제약 + long_form)으로 곡 하나 생성 → (토큰, 결과)"""
+    g = torch.Generator().manual_seed(seed)
+    start = time.perf_counter()
+    toks = generate_until_seconds(model, vocab, prefix_tokens, target_sec, temperature=1.0, top_p=0.95,
+                                  max_steps=None, generator=g, constrained=True, long_form=True)
+    elapsed = time.perf_counter() - start
+    new = len(toks) - len(prefix_tokens)
+    return toks, {"target_sec": target_sec, "tokens": new, "bars": toks.count("BAR"),
+                  "ms": _ms(elapsed), "tokens_per_sec": round(new / elapsed, 1)}
+
+
+def bench_midi(toks, repeat: int):
+    midi = tokens_to_midi_obj(toks)
+    result = timed(lambda: tokens_to_midi_obj(toks), repeat)
+    result["notes"] = sum(len(inst.notes) for inst in midi.instruments)
+    return midi, result
+
+
+def bench_wav(midi, sf2_path: str, repeat: int, sample_rate: int = 32000) -> dict:
+    # pyfluidsynth / fluidsynth CLI를 사용할 수 없는 환경이면 건너뜀
+    try:
+        wav = midi_to_wav_bytes(midi, sf2_path, sample_rate)
+    except Exception as e:
+        return {"skipped": f"{type(e).__name__}: {e}"}
+    result = timed(lambda: midi_to_wav_bytes(midi, sf2_path, sample_rate), repeat, warmup=0)
+    audio_sec = max(0, len(wav) - 44) / (4 * sample_rate) # 16bit stereo
+    result["audio_sec"] = round(audio_sec, 2)
+    result["realtime_factor"] = round(audio_sec / max(result["mean_ms"] / 1000, 1e-9), 1)
+    return result
+
+
+# ----- 서버 end-to-end: upload → 1st_ready → completed -----
+
+async def _client(session, base, bodies, n_jobs, poll, timeout, stats):
+    for i in range(n_jobs):
+        start = time.perf_counter()
+        try:
+            async with session.post(f"{base}/api/upload_data", data=bodies[i % len(bodies)],
+                                    headers={"X-File-Name": "benchmark.csv"}) as resp:
+                info = await resp.json()
+                if resp.status != 200:
+                    stats["errors"][resp.status] = stats["errors"].get(resp.status, 0) + 1
+                    continue
+            job_id = info["job_id"]
+            state = info.get("status")
+            first = None
+            while state not in ("completed", "failed"):
+                if time.perf_counter() - start > timeout:
+                    break
+                await asyncio.sleep(poll)
+                async with session.get(f"{base}/api/status/{job_id}") as resp:
+                    info = await resp.json()
+                state = info.get("status")
+                if state == "1st_ready" and first is None:
+                    first = time.perf_counter() - start
+        except Exception as e:
+            stats["errors"][type(e).__name__] = stats["errors"].get(type(e).__name__, 0) + 1
+            continue
+
+        elapsed = time.perf_counter() - start
+        if state == "completed":
+            stats["cached" if info.get("cached") else "generated"].append(elapsed)
+            stats["first"].append(first if first is not None else elapsed)
+        elif state == "failed":
+            stats["errors"]["failed"] = stats["errors"].get("failed", 0) + 1
+        else:
+            stats["errors"]["timeout"] = stats["errors"].get("timeout", 0) + 1
+
+
+async def bench_e2e(base, bodies, clients: int, jobs_per_client: int, poll: float, timeout: float) -> dict:
+    from aiohttp import ClientSession, TCPConnector
+
+    stats = {"generated": [], "cached": [], "first": [], "errors": {}}
+    async with ClientSession(connector=TCPConnector(limit=0)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[_client(session, base.rstrip("/"), bodies, jobs_per_client, poll, timeout, stats)
+                               for _ in range(clients)])
+        elapsed = time.perf_counter() - start
+
+    done = stats["generated"] + stats["cached"]
+    return {
+        "url": base,
+        "clients": clients,
+        "jobs": clients * jobs_per_client,
+        "completed": len(done),
+        "cached": len(stats["cached"]),
+        "errors": stats["errors"],
+        "jobs_per_min": round(len(done) * 60 / elapsed, 1),
+        "latency_ms": _percentiles(done),
+        "generated_latency_ms": _percentiles(stats["generated"]),
+        "first_ready_ms": _percentiles(stats["first"]),
+    }
+
+
+# ----- 결과 비교 -----
+
+def _flatten(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = v
+    return out
+
+
+def compare(base: dict, report: dict):
+    """두 결과의 같은 숫자 항목을 나란히 출력 (_ms는 작을수록, _per_sec / factor는 클수록 좋음)"""
+    old, new = _flatten(base.get("stages", {}), "stages."), _flatten(report.get("stages", {}), "stages.")
+    old.update(_flatten(base.get("e2e") or {}, "e2e."))
+    new.update(_flatten(report.get("e2e") or {}, "e2e."))
+    print(f"compare: {base.get('meta', {}).get('commit')} → {report['meta'].get('commit')}")
+    for key in sorted(old.keys() & new.keys()):
+        if old[key] == new[key] or not old[key]:
+            continue
+        print(f"  {key:55s} {old[key]:>12} → {new[key]:>12}  ({(new[key] - old[key]) / old[key]:+.1%})")
+
+
+def main(args):
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    cfg = Cfg(quant=args.quant)
+    csv_path = args.csv or next(iter(sorted(glob.glob("uploads/*.csv"))), None)
+    csv_bytes = None
+    if csv_path:
+        with open(csv_path, "rb") as f:
+            csv_bytes = f.read()
+
+    stages = {}
+    model, vocab, stages["load"] = bench_load(args, cfg)
+    prefix_tokens, stages["prefix"] = bench_prefix(model, vocab, csv_bytes, args.repeat)
+    stages["decode"] = {f"batch_{b}": bench_decode(model, vocab, b, args.steps) for b in args.batch}
+    toks, stages["generate"] = bench_generate(model, vocab, prefix_tokens, args.target_sec, args.seed)
+    midi, stages["tokens_to_midi"] = bench_midi(toks, args.repeat)
+    stages["midi_to_wav"] = bench_wav(midi, args.sf2, args.wav_repeat)
+
+    e2e = None
+    if args.url:
+        if csv_bytes is None:
+            raise SystemExit("--url needs a sketch CSV (--csv or uploads/*.csv)")
+        e2e = asyncio.run(bench_e2e(args.url, [csv_bytes], args.concurrency, args.jobs, args.poll, args.timeout))
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "threads": torch.get_num_threads(),
+            "cpu_count": os.cpu_count(),
+            "csv": csv_path,
+            "cfg": {k: v for k, v in vars(cfg).items() if k in
+                    ("block_size", "hidden_size", "num_heads", "num_layers", "quant")},
+        },
+        "stages": stages,
+        "e2e": e2e,
+    }
+    return report
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="생성 파이프라인 벤치마크")
+    ap.add_argument("--ckpt", default="./melModel_tf.pt")
+    ap.add_argument("--voc", default="./melody_voc.json")
+    ap.add_argument("--random", action="store_true", help="체크포인트가 있어도 무작위 초기화 모델 사용")
+    ap.add_argument("--quant", default=os.environ.get("MUSICGEN_QUANT", "fp32"), choices=("fp32", "int8", "bf16"))
+    ap.add_argument("--csv", default=None, help="스케치 CSV (기본: uploads/*.csv 중 첫 파일)")
+    ap.add_argument("--sf2", default="TimGM6mb.sf2")
+    ap.add_argument("--batch", type=int, nargs="+", default=[1, 4, 16])
+    ap.add_argument("--steps", type=int, default=256, help="디코딩 측정 스텝 수 (batch마다)")
+    ap.add_argument("--target-sec", type=float, default=20.0)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--wav-repeat", type=int, default=3)
+    ap.add_argument("--threads", type=int, default=None)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--url", default=None, help="실행 중인 서버 (예: http://localhost:5000)")
+    ap.add_argument("-c", "--concurrency", type=int, default=4, help="동시 클라이언트 수")
+    ap.add_argument("--jobs", type=int, default=3, help="클라이언트마다 보내는 업로드 수")
+    ap.add_argument("--poll", type=float, default=0.2, help="상태 조회 간격 (초)")
+    ap.add_argument("--timeout", type=float, default=300.0, help="job 하나의 최대 대기 시간 (초)")
+    ap.add_argument("--out", default=None, help="결과 JSON 저장 경로")
+    ap.add_argument("--compare", default=None, help="이전 결과 JSON과 비교")
+    args = ap.parse_args()
+
+    report = main(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), report)
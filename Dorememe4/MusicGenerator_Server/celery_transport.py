@@ -0,0 +1,42 @@
+"""
+파일 시스템 broker(celeryconfig.py 기본값)에서 큐 순서대로 가져오는 kombu transport
+- kombu 기본 transport는 worker가 받는 큐들을 번갈아 확인(FairCycle)하므로
+  final task가 쌓여 있으면 새 job의 preview task도 final과 한 번씩 번갈아 처리됨
+- 이 transport는 task를 가져올 때마다 transport option 'queue_order'의 앞 큐부터 확인
+  (preview 큐에 메시지가 있으면 항상 preview, 비어 있을 때만 final: redis의 queue_order_strategy=priority와 같음)
+- 'queue_order'에 없는 큐는 그 뒤에 (받기 시작한 순서대로)
+"""
+from queue import Empty
+
+from kombu.transport import filesystem
+
+
+class OrderedCycle:
+    """FairCycle 대신: 돌아가며 확인하지 않고 매번 order의 앞 큐부터 확인"""
+    def __init__(self, fun, resources, order=(), predicate=Exception):
+        self.fun = fun
+        self.resources = resources # channel의 _active_queues (consume / cancel 때 바뀜)
+        self.rank = {name: i for i, name in enumerate(order)}
+        self.predicate = predicate
+
+    def get(self, callback, **kwargs):
+        queues = sorted(self.resources, key=lambda q: self.rank.get(q, len(self.rank)))
+        for queue in queues:
+            try:
+                return self.fun(queue, callback, **kwargs)
+            except self.predicate:
+                pass
+        raise self.predicate()
+
+    def close(self):
+        pass
+
+
+class Channel(filesystem.Channel):
+    def _reset_cycle(self):
+        order = self.transport_options.get("queue_order", ())
+        self._cycle = OrderedCycle(self._get_and_deliver, self._active_queues, order, Empty)
+
+
+class Transport(filesystem.Transport):
+    Channel = Channel
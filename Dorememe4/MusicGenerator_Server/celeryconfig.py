@@ -1,7 +1,52 @@
-BROKER_URL = 'sqla+sqlite:///celery_broker.sqlite' 
-CELERY_RESULT_BACKEND = 'db+sqlite:///celery_results.sqlite'
+"""
+Celery 설정 (tasks.py)
+- broker: MUSICGEN_CELERY_BROKER, 기본은 외부 서비스 없이 쓰는 파일 시스템 broker (MUSICGEN_CELERY_DIR 폴더)
+  HTTP 서버와 worker가 같은 폴더를 보면 되므로 여러 머신이면 공유 폴더, 또는 redis:// / amqp://
+  SQLite: 'sqla+sqlite:///celery_broker.sqlite' (SQLAlchemy 필요)
+- preview 큐를 final 큐보다 먼저: 파일 시스템 broker(celery_transport.py)와 redis는 worker가 preview 큐가 빌 때만 final을 가져옴
+  그 밖의 broker(amqp / sqla)는 두 큐를 번갈아 가져오므로 '-Q musicgen.preview' worker를 따로 띄워야 함 (tasks.py)
+- job 상태 / 결과는 app의 job 저장소에 기록하므로 result backend는 사용하지 않음
+"""
+import os
 
-CELERY_ACCEPT_CONTENT = ['json']
-CELERY_TASK_SERIALIZER = 'json'
-CELERY_RESULT_SERIALIZER = 'json'
-CELERY_INCLUDE = ('app',)
+broker_url = os.environ.get("MUSICGEN_CELERY_BROKER", "filesystem://localhost//")
+broker_transport_options = {}
+broker_transport = None
+
+if broker_url.startswith("filesystem://"):
+    _root = os.environ.get("MUSICGEN_CELERY_DIR", "celery_data")
+    _messages = os.path.join(_root, "messages")
+    os.makedirs(_messages, exist_ok=True)
+    broker_transport_options = {
+        # 보내는 쪽(HTTP 서버)과 받는 쪽(worker)이 같은 폴더를 사용
+        "data_folder_in": _messages,
+        "data_folder_out": _messages,
+        "control_folder": os.path.join(_root, "control"),
+        # 폴더를 확인하는 간격 (기본 1초면 preview → final마다 최대 1초씩 늦어짐)
+        "polling_interval": 0.1,
+        # worker가 이 순서대로 확인 (preview 큐가 비어 있을 때만 final 큐)
+        "queue_order": ["musicgen.preview", "musicgen.final"],
+    }
+    # 문자열('celery_transport:Transport')은 celery 명령이 현재 폴더를 sys.path에서 뺀 뒤 import하므로 클래스로 지정
+    from celery_transport import Transport as broker_transport
+elif broker_url.startswith(("redis://", "rediss://")):
+    # worker에 지정한 큐 순서대로 (preview 큐가 비어 있을 때만 final 큐)
+    broker_transport_options = {"queue_order_strategy": "priority"}
+
+accept_content = ["json"]
+task_serializer = "json"
+include = ("tasks",)
+task_ignore_result = True
+
+# 큐: 1차 음악(preview)과 최종 음악(final) task를 따로 (tasks.py)
+task_default_queue = "musicgen.final"
+task_routes = {
+    "musicgen.generate_preview": {"queue": "musicgen.preview"},
+    "musicgen.generate_final": {"queue": "musicgen.final"},
+}
+
+# 모델 연산은 길기 때문에 worker 프로세스마다 task를 하나씩만 가져오고, 끝난 뒤 ack
+# (worker가 죽으면 다른 worker가 다시 실행)
+worker_prefetch_multiplier = 1
+task_acks_late = True
+task_reject_on_worker_lost = True
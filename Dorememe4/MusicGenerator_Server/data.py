@@ -1,15 +1,17 @@
 import json
+import numpy as np
 import torch
 from torch.utils.data import Dataset
 
-class MelodyDataset(Dataset):
-    def __init__(self, tok_path, voc_path, block_size=384, cut_at_eos=True, prefix_len=7):
-        # block_size: 한 샘플에서 x의 최대 길이(=모델 입력 길이)
-        # cut_at_eos: True일 경우 시퀀스를 EOS에서 잘라냄
-        # prefix_len: 보존할 토큰 개수(프리픽스)
+from token_corpus import TokenCorpus, is_corpus_file
+
+class MelodyVocab:
+    """
+    추론용 경량 vocab: melody_voc.json만 읽음 (코퍼스 로드/텐서화 없음)
+    generate_until_seconds에 MelodyDataset 대신 넘길 수 있음
+    """
+    def __init__(self, voc_path, block_size=384):
         self.block_size = block_size
-        self.prefix_len = prefix_len
-        take = block_size + 1 # # x = seq[:take-1] y = seq[1:take]
 
         with open(voc_path, "r", encoding="utf-8") as f:
             self.vocab = json.load(f)
@@ -20,6 +22,32 @@ class MelodyDataset(Dataset):
         self.PAD_ID = self.stoi.get("PAD", 0)
         self.EOS_ID = self.stoi.get("EOS", None)
 
+
+class MelodyDataset(Dataset):
+    def __init__(self, tok_path, voc_path, block_size=384, cut_at_eos=True, prefix_len=7):
+        # block_size: 한 샘플에서 x의 최대 길이(=모델 입력 길이)
+        # cut_at_eos: True일 경우 시퀀스를 EOS에서 잘라냄
+        # prefix_len: 보존할 토큰 개수(프리픽스)
+        self.block_size = block_size
+        self.prefix_len = prefix_len
+        take = block_size + 1 # # x = seq[:take-1] y = seq[1:take]
+
+        voc = MelodyVocab(voc_path, block_size)
+        self.vocab = voc.vocab
+        self.stoi = voc.stoi
+        self.itos = voc.itos
+        self.PAD_ID = voc.PAD_ID
+        self.EOS_ID = voc.EOS_ID
+
+        # 바이너리 코퍼스(token_corpus.py로 변환)면 memmap으로 열고 x/y는 __getitem__에서 만듦
+        # (미리 텐서로 만들지 않으므로 로드가 바로 끝나고 DataLoader worker끼리 메모리 공유)
+        self.cut_at_eos = cut_at_eos
+        self.corpus = None
+        if is_corpus_file(tok_path):
+            self.corpus = TokenCorpus(tok_path)
+            self.samples = None
+            return
+
         # 입력 시퀀스 ids를 EOS에서 잘라냄
         def slice_at_eos(ids):
             if not cut_at_eos or self.EOS_ID is None:
@@ -67,8 +95,41 @@ class MelodyDataset(Dataset):
                 ))
 
     def __len__(self):
+        if self.corpus is not None:
+            return len(self.corpus)
         return len(self.samples)
 
     def __getitem__(self, idx):
+        if self.corpus is not None:
+            ids = self._window(self.corpus[idx])
+            # x, y는 같은 버퍼의 view (복사 없음)
+            return torch.from_numpy(ids[:-1]), torch.from_numpy(ids[1:])
         x, y = self.samples[idx]
-        return x, y
\ No newline at end of file
+        return x, y
+
+    def _window(self, seq: np.ndarray) -> np.ndarray:
+        # jsonl 모드의 slice_at_eos + pad_or_trim과 같은 규칙 (길이 block_size + 1)
+        take = self.block_size + 1
+        seq = trim_sequence(seq, take, self.prefix_len, self.EOS_ID if self.cut_at_eos else None)
+        out = np.full(take, self.PAD_ID, dtype=np.int64)
+        out[:len(seq)] = seq
+        return out
+
+
+def trim_sequence(seq: np.ndarray, take: int, prefix_len: int, eos_id=None) -> np.ndarray:
+    """
+    MelodyDataset의 slice_at_eos + pad_or_trim에서 PAD만 뺀 것 (numpy, 길이 <= take)
+    - eos_id가 있으면 첫 EOS까지 (EOS 포함)
+    - take보다 길면 앞쪽 prefix_len개 + 뒤쪽 토큰
+    """
+    if eos_id is not None:
+        hits = np.flatnonzero(seq == eos_id)
+        if len(hits):
+            seq = seq[:hits[0] + 1]
+    if len(seq) <= take:
+        return seq
+    n_head = min(prefix_len, take)
+    keep = max(0, take - prefix_len)
+    if keep == 0:
+        return seq[:n_head]
+    return np.concatenate([seq[:n_head], seq[-keep:]])
@@ -0,0 +1,356 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from typing import List
+
+import torch
+
+from generate import DecodeState, sample_batch
+from metrics import DECODE_STEP_SECONDS, ENGINE_PREEMPTIONS
+from model import KVCache
+
+_NO_CHUNK = object()
+
+
+class _Job:
+    def __init__(self, prefix_tokens, target_sec, kwargs, on_bar=None):
+        self.prefix_tokens = prefix_tokens
+        self.target_sec = target_sec
+        self.kwargs = kwargs
+        self.on_bar = on_bar
+        self.future = Future()
+        self.state = None
+        self.seq = 0         # 엔진에 들어온 순서
+        self.bar_mark = 0    # 마지막 마디가 시작된 스텝
+        # batch에서 잠시 빠져 있는 동안 보관하는 이 row의 KV cache / 다음 토큰 logits
+        self.cache = None
+        self.logits = None
+        self.parked_at = None
+        # 1차 음악까지 남은 예상 시간(초)과 계산 시각, 1차 음악 이후에는 None
+        self.eta = None
+        self.eta_at = None
+
+
+class GenerationEngine:
+    """
+    동시에 들어온 생성 요청들을 하나의 [B, L] batch로 묶어 함께 디코딩
+    - 진행 중인 batch에 새 요청이 마디 경계마다 합류 (처음 요청은 max_wait초 동안 모아서 시작)
+    - 마디 단위 스케줄링: 어느 row든 마디를 끝내거나 생성이 끝나면 batch에 올릴 job(최대 max_batch개)을 다시 고름
+      1차 음악(preview_bars 마디)을 아직 만들지 못한 job이 항상 먼저, 같은 단계끼리는 먼저 들어온 순서
+      → batch가 차 있으면 최종 렌더링 중인 job을 잠시 빼고(KV cache 보관, 시간 안전 장치도 멈춤) 새 job을 올림
+      → 부하가 많아도 새 job의 1차 음악은 앞선 1차 작업만 기다림 (최종 곡은 그만큼 늦어짐)
+    - row마다 prefix 길이, 목표 마디 수(BPM), EOS 시점이 달라도 됨
+      (짧은 prefix는 PAD로 채우고 forward의 key_padding_mask 규칙으로 가림)
+    - row마다 자신의 generator로 샘플링하므로 결과는 generate_until_seconds 단독 실행과 같음
+    - 1차 음악까지의 예상 시간: 최근 스텝 시간 × 남은 1차 스텝 수 (앞선 1차 작업이 batch 자리를 비우는 순서로 계산)
+    """
+    def __init__(self, model, dataset, max_batch: int = 8, max_wait: float = 0.05, prefix_cache=None,
+                 preview_bars: int = 4):
+        self.model = model
+        self.dataset = dataset
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        # prefix_cache.PrefixStateCache: 처음 prefill에서 prefix별 KV 상태 재사용
+        self.prefix_cache = prefix_cache
+        self.preview_bars = preview_bars
+
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._seq = itertools.count()
+
+        # 엔진 스레드에서만 사용
+        self._jobs = []     # 엔진에 들어온 job (batch에 있거나 대기 중)
+        self._batch = []    # 지금 batch에 올라간 job (cache row 순서)
+        self._cache = None
+        self._logits = None # [B, V] batch row별 다음 토큰 logits
+        # 예상 시간 계산용 평균 (지수 이동 평균)
+        self._step_sec = None
+        self._bar_steps = 32.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="generation-engine", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, prefix_tokens: List[str], target_sec: float, on_bar=None, **kwargs) -> Future:
+        """
+        kwargs는 generate_until_seconds와 같음 (temperature, top_p, max_steps, generator ...)
+        on_bar(chunk): 마디가 완성될 때마다 엔진 스레드에서 호출 (stream_until_seconds와 같은 조각)
+        """
+        return self._submit(prefix_tokens, target_sec, kwargs, on_bar).future
+
+    def generate(self, prefix_tokens: List[str], target_sec: float, **kwargs) -> List[str]:
+        return self.submit(prefix_tokens, target_sec, **kwargs).result()
+
+    def stream(self, prefix_tokens: List[str], target_sec: float, on_eta=None, eta_interval: float = 1.0,
+               **kwargs):
+        """
+        stream_until_seconds와 같이 마디 단위 조각을 yield (다른 요청과 batch로 생성)
+        on_eta(sec): 1차 음악까지 남은 예상 시간, 1차 음악 전까지 최대 eta_interval초마다
+        (이 generator를 도는 스레드에서 호출하므로 조각 처리와 순서가 섞이지 않음)
+        """
+        chunks = queue.Queue()
+        job = self._submit(prefix_tokens, target_sec, kwargs, chunks.put)
+        job.future.add_done_callback(lambda f: chunks.put(None))
+        reported = None
+        while True:
+            try:
+                chunk = chunks.get(timeout=eta_interval if on_eta is not None else None)
+            except queue.Empty:
+                chunk = _NO_CHUNK
+            eta, eta_at = job.eta, job.eta_at
+            now = time.monotonic()
+            if on_eta is not None and eta is not None and (reported is None or now - reported >= eta_interval):
+                on_eta(max(0.0, eta - (now - eta_at)))
+                reported = now
+            if chunk is None:
+                break
+            if chunk is not _NO_CHUNK:
+                yield chunk
+        job.future.result() # 생성 중 예외가 있었으면 여기서 전달
+
+    def _submit(self, prefix_tokens, target_sec, kwargs, on_bar) -> _Job:
+        job = _Job(prefix_tokens, target_sec, kwargs, on_bar)
+        self._queue.put(job)
+        return job
+
+    # ----- 내부 루프 -----
+
+    def _loop(self):
+        self.model.eval()
+        dev = next(self.model.parameters()).device
+        block_size = self.dataset.block_size
+        while not self._stop.is_set():
+            try:
+                self._admit()
+                if not self._jobs:
+                    continue
+                self._schedule(dev, block_size)
+                # 다음 마디 경계(또는 끝난 job)까지 진행한 뒤 다시 스케줄링
+                while self._batch and not self._step(dev, block_size):
+                    pass
+            except Exception as e:
+                traceback.print_exc()
+                for job in self._jobs:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                self._jobs, self._batch = [], []
+                self._cache = self._logits = None
+
+    def _admit(self):
+        # 새 요청을 받음: 진행 중인 job이 없으면 첫 요청을 기다린 뒤 max_wait 동안 들어오는 요청을 같이 시작
+        idle = not self._jobs
+        try:
+            job = self._queue.get(timeout=0.1) if idle else self._queue.get_nowait()
+        except queue.Empty:
+            return
+
+        deadline = time.monotonic() + (self.max_wait if idle else 0)
+        while True:
+            if job.future.set_running_or_notify_cancel():
+                job.seq = next(self._seq)
+                self._jobs.append(job)
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0 and len(self._jobs) < self.max_batch:
+                    job = self._queue.get(timeout=remaining)
+                else:
+                    job = self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _first_pass(self, job) -> bool:
+        # 1차 음악이 아직 만들어지지 않은 job
+        # prefix 끝부분에 첫 마디를 여는 BAR가 있으므로 생성된 BAR가 preview_bars개가 되는 마디 조각에서 preview가 만들어짐
+        # (SegmentRenderer: 받은 조각의 BAR 수 = prefix의 BAR + 생성된 BAR - 방금 나온 BAR)
+        st = job.state
+        return st is None or st.bars - st.prefix_bars < self.preview_bars
+
+    def _priority(self, job):
+        return (0 if self._first_pass(job) else 1, job.seq)
+
+    @torch.no_grad()
+    def _schedule(self, dev, block_size):
+        ranked = sorted(self._jobs, key=self._priority)
+        want = ranked[:self.max_batch]
+        self._estimate(ranked)
+        if len(want) == len(self._batch) and all(job in self._batch for job in want):
+            return
+
+        now = time.time()
+        keep = []
+        for i, job in enumerate(self._batch):
+            if job in want:
+                keep.append(i)
+                continue
+            # 우선순위에 밀린 job은 이 row의 상태를 보관해 두고 batch에서 뺌
+            job.cache = self._cache.row(i)
+            job.logits = self._logits[i:i + 1]
+            job.parked_at = now
+            ENGINE_PREEMPTIONS.inc()
+
+        batch, caches, logits = [], [], []
+        if keep:
+            if len(keep) < len(self._batch):
+                rows = torch.tensor(keep, dtype=torch.long, device=dev)
+                self._cache.select(rows)
+                self._logits = self._logits.index_select(0, rows)
+            batch = [self._batch[i] for i in keep]
+            caches.append(self._cache)
+            logits.append(self._logits)
+
+        fresh = []
+        for job in want:
+            if job in batch:
+                continue
+            if job.state is None:
+                # 시간 안전 장치는 대기열이 아니라 실제 생성 시작부터 계산
+                job.state = DecodeState(self.dataset, job.prefix_tokens, job.target_sec, **job.kwargs)
+                fresh.append(job)
+                continue
+            # 쉬었던 시간은 안전 장치에서 제외
+            job.state.start_time += now - job.parked_at
+            caches.append(job.cache)
+            logits.append(job.logits)
+            batch.append(job)
+            job.cache = job.logits = None
+
+        if fresh:
+            seqs = [job.state.window(block_size) for job in fresh]
+            with DECODE_STEP_SECONDS.time("prefill"):
+                if self.prefix_cache is not None:
+                    cache, lg = self.prefix_cache.prefill_batch(seqs)
+                else:
+                    cache, lg = self._prefill(seqs, dev)
+            caches.append(cache)
+            logits.append(lg)
+            batch.extend(fresh)
+
+        self._batch = batch
+        self._cache = KVCache.concat(caches)
+        self._logits = logits[0] if len(logits) == 1 else torch.cat(logits, dim=0)
+
+    @torch.no_grad()
+    def _step(self, dev, block_size) -> bool:
+        """batch 전체를 한 토큰 진행, 마디가 끝났거나 생성이 끝난 row가 있으면 True"""
+        active = self._batch
+        step_start = time.perf_counter()
+        boundary = False
+        keep = []
+        next_ids = []
+        # 계속 진행하는 row들을 한 번에 샘플링
+        stepping = [i for i, job in enumerate(active) if job.state.begin_step()]
+        sampled = {}
+        if stepping:
+            start = time.perf_counter()
+            rows = self._logits if len(stepping) == len(active) else self._logits[stepping]
+            sampled = dict(zip(stepping, sample_batch(rows, [active[i].state for i in stepping])))
+            DECODE_STEP_SECONDS.observe(time.perf_counter() - start, "sampling")
+
+        for i, job in enumerate(active):
+            st = job.state
+            if i in sampled:
+                nid = sampled[i]
+                if not st.push(nid):
+                    if st.new_bar:
+                        boundary = True
+                        self._bar_done(job)
+                        if job.on_bar is not None:
+                            job.on_bar(st.take_bar())
+                    keep.append(i)
+                    next_ids.append(nid)
+                    continue
+            boundary = True
+            job.eta = None
+            toks = st.finish()
+            if job.on_bar is not None:
+                job.on_bar(st.take_rest())
+            job.future.set_result(toks)
+            self._jobs.remove(job)
+
+        # 끝난 row는 batch에서 제거
+        if len(keep) < len(active):
+            self._batch = [active[i] for i in keep]
+            if not keep:
+                self._cache = self._logits = None
+                return True
+            self._cache.select(torch.tensor(keep, dtype=torch.long, device=dev))
+
+        start = time.perf_counter()
+        if any(job.state.needs_window(block_size) for job in self._batch):
+            # block_size를 넘긴 row가 있으면 단독 실행과 같이 row별 윈도우로 캐시를 다시 채움
+            self._cache, self._logits = self._prefill([job.state.window(block_size) for job in self._batch], dev)
+            DECODE_STEP_SECONDS.observe(time.perf_counter() - start, "prefill")
+        else:
+            x = torch.tensor(next_ids, dtype=torch.long, device=dev).unsqueeze(1) # [B, 1]
+            timings = {}
+            self._logits = self.model.forward_cached(x, self._cache, pad_id=self.dataset.PAD_ID,
+                                                     timings=timings)[:, -1, :]
+            DECODE_STEP_SECONDS.observe(time.perf_counter() - start, "forward")
+            DECODE_STEP_SECONDS.observe(timings["attention"], "attention")
+
+        elapsed = time.perf_counter() - step_start
+        self._step_sec = elapsed if self._step_sec is None else 0.9 * self._step_sec + 0.1 * elapsed
+        return boundary
+
+    def _bar_done(self, job):
+        # 마디 하나에 걸린 스텝 수 평균 갱신 (첫 마디는 prefix 끝의 BAR에서 시작)
+        st = job.state
+        self._bar_steps = 0.9 * self._bar_steps + 0.1 * (st.steps - job.bar_mark)
+        job.bar_mark = st.steps
+        if not self._first_pass(job):
+            job.eta = None # 이 조각으로 1차 음악이 만들어짐
+
+    def _estimate(self, ranked):
+        """
+        1차 음악 전인 job마다 남은 예상 시간 갱신 (ranked: 우선순위 순서)
+        1차 작업들이 batch 자리(max_batch개)를 먼저 쓰고, 끝난 자리에 다음 job이 들어간다고 보고 계산
+        """
+        if self._step_sec is None:
+            return
+        now = time.monotonic()
+        slots = [0.0] * self.max_batch # 자리별로 비는 시점 (스텝 수)
+        for job in ranked:
+            if not self._first_pass(job):
+                break
+            st = job.state
+            remaining = self.preview_bars * self._bar_steps
+            if st is not None:
+                # 완성된 마디 = 생성된 BAR 수, 지금 마디에서 진행한 스텝은 뺌
+                done = st.bars - st.prefix_bars
+                remaining = (self.preview_bars - done) * self._bar_steps - (st.steps - job.bar_mark)
+            start = heapq.heappop(slots)
+            end = start + max(1.0, remaining)
+            heapq.heappush(slots, end)
+            job.eta = end * self._step_sec
+            job.eta_at = now
+
+    def _prefill(self, seqs, dev):
+        # 길이가 다른 시퀀스를 오른쪽 PAD로 맞춰 [B, L] batch 구성
+        PAD_ID = self.dataset.PAD_ID
+        B = len(seqs)
+        L = max(len(s) for s in seqs)
+
+        x = torch.full((B, L), PAD_ID, dtype=torch.long, device=dev)
+        for i, s in enumerate(seqs):
+            x[i, :len(s)] = torch.tensor(s, dtype=torch.long, device=dev)
+        lengths = torch.tensor([len(s) for s in seqs], dtype=torch.long, device=dev)
+
+        cache = self.model.new_cache()
+        logits = self.model.forward_cached(x, cache, pad_id=PAD_ID) # [B, L, V]
+        # 다음 토큰은 row별 실제 길이 위치부터 이어짐 (PAD 칸은 mask로 가려짐)
+        cache.next_pos = lengths
+        logits = logits[torch.arange(B, device=dev), lengths - 1] # [B, V]
+        return cache, logits
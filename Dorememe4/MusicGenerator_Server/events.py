@@ -0,0 +1,183 @@
+import asyncio
+import json
+import os
+
+from aiohttp import web
+
+from job_store import open_job_store, DEFAULT_URL as DEFAULT_JOB_STORE_URL, FINISHED
+
+HEARTBEAT_SEC = 15.0     # SSE 연결 유지용 주석 전송 간격
+LONG_POLL_MAX_SEC = 30.0 # long-poll 최대 대기 시간
+
+
+class _Watch:
+    def __init__(self, data, version):
+        self.data = data
+        self.version = version
+        self.event = asyncio.Event()
+        self.waiters = 0
+
+
+class StatusHub:
+    """
+    job 상태 변화를 기다리는 연결들을 위한 polling hub
+    - 누군가 기다리는 job들의 version을 interval마다 쿼리 한 번으로 확인 (연결 수와 무관)
+    - version이 바뀐 job만 다시 읽어서 그 job을 기다리는 연결들을 깨움
+    - 연결마다 스레드나 쿼리가 생기지 않으므로 대기 연결 수천 개도 이벤트 루프 하나로 처리
+    """
+    def __init__(self, store, interval: float = 0.1):
+        self.store = store
+        self.interval = interval
+        self._watches = {} # job_id → _Watch
+        self._task = None
+
+    async def start(self, app=None):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self, app=None):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _call(self, fn, *args):
+        # job 저장소(SQLite)는 blocking이므로 스레드 풀에서 실행
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def get(self, job_id: str):
+        return await self._call(self.store.get_versioned, job_id)
+
+    async def wait_change(self, job_id: str, version, timeout: float):
+        """
+        job의 version이 version과 달라지거나 timeout이 지나면 (data, version) 반환
+        (job이 없으면 data=None)
+        """
+        watch = self._watches.get(job_id)
+        if watch is None:
+            data, current = await self.get(job_id)
+            if data is None or current != version:
+                return data, current
+            watch = self._watches.get(job_id)
+            if watch is None:
+                watch = self._watches[job_id] = _Watch(data, current)
+        elif watch.version != version:
+            return watch.data, watch.version
+
+        event = watch.event
+        watch.waiters += 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            watch.waiters -= 1
+            if watch.waiters == 0 and self._watches.get(job_id) is watch:
+                del self._watches[job_id]
+        return watch.data, watch.version
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self._watches:
+                continue
+            try:
+                await self._poll()
+            except Exception as e:
+                print(f"StatusHub: poll failed ({e})")
+
+    async def _poll(self):
+        watches = dict(self._watches)
+        versions = await self._call(self.store.versions, list(watches))
+        for job_id, watch in watches.items():
+            current = versions.get(job_id)
+            if current == watch.version:
+                continue
+            data, current = (None, None) if current is None else await self.get(job_id)
+            watch.data, watch.version = data, current
+            # 지금 기다리는 연결들을 깨우고, 이후 대기용 이벤트는 새로 만듦
+            watch.event.set()
+            watch.event = asyncio.Event()
+
+
+def _sse(event: str, data: dict, event_id=None) -> bytes:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+async def job_events(request):
+    """
+    GET /api/events/<job_id>  (text/event-stream)
+    상태가 바뀔 때마다 'status' 이벤트 전송 (id = version), 완료/실패 후 연결 종료
+    재연결 시 Last-Event-ID 이후 변화부터 이어서 받음
+    """
+    hub = request.app["status_hub"]
+    job_id = request.match_info["job_id"]
+
+    resp = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await resp.prepare(request)
+
+    last = request.headers.get("Last-Event-ID")
+    version = int(last) if last and last.isdigit() else None
+    while True:
+        data, current = await hub.wait_change(job_id, version, HEARTBEAT_SEC)
+        if data is None:
+            await resp.write(_sse("error", {"status": "error", "message": "Job ID not found."}))
+            break
+        if current == version:
+            await resp.write(b": keep-alive\n\n")
+            continue
+        version = current
+        await resp.write(_sse("status", data, version))
+        if data.get("status") in FINISHED:
+            break
+    return resp
+
+
+async def job_status_wait(request):
+    """
+    GET /api/status/<job_id>/wait?version=N&timeout=초  (long-poll)
+    상태 version이 N과 달라지면 바로, 아니면 timeout 후 현재 상태 반환 (응답의 version을 다음 요청에 사용)
+    """
+    hub = request.app["status_hub"]
+    job_id = request.match_info["job_id"]
+    version = request.query.get("version")
+    version = int(version) if version and version.isdigit() else None
+    try:
+        timeout = min(LONG_POLL_MAX_SEC, float(request.query.get("timeout", 25)))
+    except ValueError:
+        timeout = LONG_POLL_MAX_SEC
+
+    data, current = await hub.wait_change(job_id, version, timeout)
+    if data is None:
+        return web.json_response({"status": "error", "message": "Job ID not found."}, status=404)
+    return web.json_response({**data, "version": current})
+
+
+def add_event_routes(app: web.Application, store, interval: float = 0.1):
+    """aiohttp 앱에 SSE / long-poll 엔드포인트와 hub 등록"""
+    hub = StatusHub(store, interval)
+    app["status_hub"] = hub
+    app.on_startup.append(hub.start)
+    app.on_cleanup.append(hub.stop)
+    app.router.add_get("/api/events/{job_id}", job_events)
+    app.router.add_get("/api/status/{job_id}/wait", job_status_wait)
+    return hub
+
+
+if __name__ == "__main__":
+    # Flask 서버(app.py)와 같은 job 저장소(SQLite)를 보는 별도 이벤트 서버
+    store = open_job_store(os.environ.get("MUSICGEN_JOB_STORE", DEFAULT_JOB_STORE_URL))
+    events_app = web.Application()
+    add_event_routes(events_app, store)
+    web.run_app(events_app, host="0.0.0.0", port=int(os.environ.get("MUSICGEN_EVENTS_PORT", 5001)))
@@ -1,9 +1,15 @@
-from typing import List, Dict
+from typing import List, Dict, Sequence, TYPE_CHECKING
 from pathlib import Path
-import pandas as pd
 import math
 
-def read_csv_strict(path: str) -> pd.DataFrame:
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+def read_csv_strict(path: str) -> "pd.DataFrame":
+    # 서버 경로(sketch_csv + sessions_to_prefix)는 pandas를 쓰지 않으므로 필요할 때만 import
+    import pandas as pd
     return pd.read_csv(path)
 
 def build_prefix_tokens(feat: Dict[str, object]) -> List[str]:
@@ -44,7 +50,7 @@ def _classify_color_5(r: int, g: int, b: int) -> str:
 _BPM_MAP = {"red": 120, "yellow": 100, "green": 100, "blue": 80, "white": 60}
 _COLOR_KEY = {"red": "C", "yellow":"D#", "green":"F", "blue":"G#", "white":"A#"}
 
-def session_to_prefix(df: pd.DataFrame) -> Dict[str, object]:
+def session_to_prefix(df: "pd.DataFrame") -> Dict[str, object]:
     df_sorted = df.sort_values("StrokeIndex")
 
     first = df_sorted.iloc[0]
@@ -65,6 +71,19 @@ def session_to_prefix(df: pd.DataFrame) -> Dict[str, object]:
     g_val = float(dom["ColorG"])
     b_val = float(dom["ColorB"])
 
+    return _scalar_features((start_x, start_y, start_z), (end_x, end_y, end_z),
+                            (r_val, g_val, b_val), len(df_sorted), float(last["TotalUndoCount"]))
+
+
+def _scalar_features(start, end, rgb, stroke_count: int, undo_total: float) -> Dict[str, object]:
+    """
+    시작점 / 끝점 / 대표 색 / stroke 수 / undo 횟수 → prefix feature
+    (session_to_prefix와 FeatureAccumulator가 같은 계산을 사용)
+    """
+    start_x, start_y, start_z = start
+    end_x, end_y, end_z = end
+    r_val, g_val, b_val = rgb
+
     if max(r_val, g_val, b_val) <= 1.0:
         r_i = int(round(r_val * 255))
         g_i = int(round(g_val * 255))
@@ -97,7 +116,6 @@ def session_to_prefix(df: pd.DataFrame) -> Dict[str, object]:
     else:
         reg = "REG_HIGH"
 
-    stroke_count = len(df_sorted)
     complexity_score = stroke_count * D
     score = math.log1p(complexity_score)
     edge_density = score / (1.0 + score)
@@ -108,7 +126,6 @@ def session_to_prefix(df: pd.DataFrame) -> Dict[str, object]:
 
     # edge_density = float(last["BrushSize"])
 
-    undo_total = float(last["TotalUndoCount"])
     rhy = int(round(undo_total))
     if rhy < 0: rhy = 0
     if rhy < 2: rhy = 2
@@ -135,3 +152,235 @@ def session_to_prefix(df: pd.DataFrame) -> Dict[str, object]:
         "chr_idx": chr,
         "pos_idx": pos,
     }
+
+
+# ----- numpy 벡터화 버전 (pandas 없이, 여러 스케치를 한 번에) -----
+# session_to_prefix와 같은 결과 (round는 둘 다 half-to-even)
+# 동점 처리: 시작 stroke는 StrokeIndex가 가장 작은 첫 행, 끝 stroke는 가장 큰 마지막 행,
+#           대표 색은 Count가 가장 큰 첫 행 (StrokeIndex가 겹치지 않는 일반 스케치에서는 항상 같음)
+
+_COLOR_NAMES = ["red", "yellow", "green", "blue", "white"]
+_COLOR_KEY_IDX = np.array([_KEY2IDX[_COLOR_KEY[c]] for c in _COLOR_NAMES])
+_COLOR_BPM = np.array([_BPM_MAP[c] for c in _COLOR_NAMES])
+_REG_NAMES = ["REG_LOW", "REG_MID", "REG_HIGH"]
+
+
+def _classify_color_5_np(r, g, b):
+    """_classify_color_5의 배열 버전 → _COLOR_NAMES index"""
+    mx = np.maximum(np.maximum(r, g), b)
+    mn = np.minimum(np.minimum(r, g), b)
+    red_dom = (r >= g) & (r >= b)
+    return np.select(
+        [(mx > 220) & ((mx - mn) < 15),
+         red_dom & (r > 180) & (g > 180) & (b < 120),
+         red_dom,
+         (g >= r) & (g >= b)],
+        [4, 1, 0, 2], default=3)
+
+
+def _column(sketch, name, dtype):
+    return np.asarray(sketch[name], dtype=dtype)
+
+
+def sessions_to_prefix(sketches: Sequence[object]) -> List[Dict[str, object]]:
+    """
+    여러 스케치(sketch_csv.SketchTable 또는 DataFrame)의 prefix feature를 한 번에 계산
+    행을 하나로 이어 붙이고 스케치 번호로 정렬해서 스케치마다 반복문 없이 처리
+    """
+    if not sketches:
+        return []
+    lengths = np.array([len(s) for s in sketches])
+    if (lengths == 0).any():
+        raise ValueError("empty sketch")
+    n = len(sketches)
+    seg = np.repeat(np.arange(n), lengths)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    ends = starts + lengths - 1
+    order = np.arange(len(seg))
+
+    def cat(name, dtype=np.float64):
+        return np.concatenate([_column(s, name, dtype) for s in sketches])
+
+    # 시작/끝 stroke: (스케치, StrokeIndex, 행 순서)로 정렬 → 스케치별 첫 행 / 마지막 행
+    by_stroke = np.lexsort((order, cat("StrokeIndex", np.int64), seg))
+    first = by_stroke[starts]
+    last = by_stroke[ends]
+    # 대표 색: Count 내림차순 정렬에서 스케치별 첫 행 (= idxmax)
+    dom = np.lexsort((order, -cat("Count"), seg))[starts]
+
+    rgb = np.stack([cat("ColorR")[dom], cat("ColorG")[dom], cat("ColorB")[dom]], axis=1)
+    scale = np.where(rgb.max(axis=1) <= 1.0, 255.0, 1.0)
+    rgb = np.rint(rgb * scale[:, None]).astype(np.int64)
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+
+    warm = (r >= g) & (r >= b)
+    cool = (b >= r) & (b >= g)
+    mode_major = ~(cool & ~warm)
+
+    start = np.stack([cat("Start_X")[first], cat("Start_Y")[first], cat("Start_Z")[first]], axis=1)
+    end = np.stack([cat("End_X")[last], cat("End_Y")[last], cat("End_Z")[last]], axis=1)
+    d = end - start
+    D = (d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] + d[:, 2] * d[:, 2]) ** 0.5
+    norm_D = D / (1.0 + D)
+    reg = np.where(norm_D < (1.0 / 3.0), 0, np.where(norm_D < (2.0 / 3.0), 1, 2))
+
+    score = np.log1p(lengths * D)
+    edge_density = score / (1.0 + score)
+    dens = np.maximum(np.rint(edge_density * 2), 2).astype(np.int64)
+
+    rhy = np.maximum(np.rint(cat("TotalUndoCount")[last]), 2).astype(np.int64)
+
+    chroma_value = rgb.max(axis=1) / 255.0 - rgb.min(axis=1) / 255.0
+    chr = np.maximum(np.rint(chroma_value), 2).astype(np.int64)
+
+    color = _classify_color_5_np(r, g, b)
+    key = _COLOR_KEY_IDX[color]
+    bpm = _COLOR_BPM[color]
+
+    return [{
+        "key_idx": int(key[i]),
+        "bpm": int(bpm[i]),
+        "mode_major": bool(mode_major[i]),
+        "reg": _REG_NAMES[reg[i]],
+        "rhy_idx": int(rhy[i]),
+        "dens_idx": int(dens[i]),
+        "chr_idx": int(chr[i]),
+        "pos_idx": 0,
+    } for i in range(n)]
+
+
+def sketch_to_prefix(sketch) -> Dict[str, object]:
+    """스케치 하나 (session_to_prefix와 같은 결과, pandas 불필요)"""
+    return sessions_to_prefix([sketch])[0]
+
+
+
+def all_prefixes(vocab_tokens=None) -> List[List[str]]:
+    """
+    session_to_prefix → build_prefix_tokens가 낼 수 있는 모든 prefix (prefix 상태 pre-warm용)
+    - 색 5종이 KEY와 BPM을 함께 정함, MODE 2 × REG 3
+    - DENS / CHR: 계산값이 1 이하라 2로 고정, RHY: undo 횟수(2 이상)
+    vocab_tokens를 주면 모든 토큰이 vocab에 있는 prefix만 (RHY 상한도 vocab에서 결정)
+    """
+    vocab = set(vocab_tokens) if vocab_tokens is not None else None
+    rhy_values = [2]
+    if vocab is not None:
+        while f"RHY_{rhy_values[-1] + 1}" in vocab:
+            rhy_values.append(rhy_values[-1] + 1)
+
+    out = []
+    for color in _COLOR_NAMES:
+        for mode_major in (True, False):
+            for reg in _REG_NAMES:
+                for rhy in rhy_values:
+                    tokens = build_prefix_tokens({
+                        "key_idx": _KEY2IDX[_COLOR_KEY[color]], "bpm": _BPM_MAP[color],
+                        "mode_major": mode_major, "reg": reg, "rhy_idx": rhy,
+                        "dens_idx": 2, "chr_idx": 2, "pos_idx": 0,
+                    })
+                    if vocab is None or all(t in vocab for t in tokens):
+                        out.append(tokens)
+    return out
+
+
+class FeatureAccumulator:
+    """
+    라이브 세션용: stroke가 추가될 때마다 O(1)로 feature 상태를 갱신
+    - 시작 stroke(StrokeIndex 최소, 먼저 온 것) / 끝 stroke(StrokeIndex 최대, 나중에 온 것)
+    - 대표 색(Count 최대, 먼저 온 것) / stroke 수 / 끝 stroke의 TotalUndoCount
+    전체 CSV로 session_to_prefix를 다시 계산한 것과 같은 결과
+    stroke는 추가만 가능 (지워진 stroke를 반영하려면 reset 후 전체 세션을 다시 add)
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n_strokes = 0
+        self._first = None # (stroke_index, start xyz)
+        self._last = None  # (stroke_index, end xyz, total_undo)
+        self._dom = None   # (count, rgb)
+        self.emitted = None # 마지막으로 내보낸 prefix
+
+    def add_stroke(self, stroke_index: int, rgb, count: float, start, end, total_undo: float):
+        """stroke 하나 반영 (prefix 계산은 하지 않음)"""
+        if self._first is None or stroke_index < self._first[0]:
+            self._first = (stroke_index, tuple(start))
+        if self._last is None or stroke_index >= self._last[0]:
+            self._last = (stroke_index, tuple(end), total_undo)
+        if self._dom is None or count > self._dom[0]:
+            self._dom = (count, tuple(rgb))
+        self.n_strokes += 1
+
+    def add_rows(self, sketch):
+        """
+        SketchTable / DataFrame의 행들을 순서대로 반영
+        양자화된 feature(→ prefix 토큰)가 바뀌었으면 새 prefix, 아니면 None
+        """
+        cols = [np.asarray(sketch[c], dtype=np.float64).tolist() for c in (
+            "ColorR", "ColorG", "ColorB", "Count",
+            "Start_X", "Start_Y", "Start_Z", "End_X", "End_Y", "End_Z", "TotalUndoCount")]
+        stroke = np.asarray(sketch["StrokeIndex"], dtype=np.int64).tolist()
+        for i, (r, g, b, count, sx, sy, sz, ex, ey, ez, undo) in enumerate(zip(*cols)):
+            self.add_stroke(stroke[i], (r, g, b), count, (sx, sy, sz), (ex, ey, ez), undo)
+        return self.update()
+
+    def features(self) -> Dict[str, object]:
+        if self.n_strokes == 0:
+            raise ValueError("no strokes")
+        return _scalar_features(self._first[1], self._last[1], self._dom[1],
+                                self.n_strokes, self._last[2])
+
+    def prefix(self) -> List[str]:
+        return build_prefix_tokens(self.features())
+
+    def update(self):
+        """현재 prefix가 마지막으로 내보낸 것과 다르면 새 prefix 반환, 같으면 None"""
+        if self.n_strokes == 0:
+            return None
+        prefix = self.prefix()
+        if prefix == self.emitted:
+            return None
+        self.emitted = prefix
+        return prefix
+
+
+if __name__ == "__main__":
+    # 샘플 CSV에서 기존 pandas 버전과 결과가 같은지 확인
+    import argparse
+    import glob
+    import time
+    from sketch_csv import parse_sketch_csv
+
+    ap = argparse.ArgumentParser(description="session_to_prefix / sessions_to_prefix 결과 비교")
+    ap.add_argument("paths", nargs="*", default=sorted(glob.glob("uploads/*.csv")))
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    dfs, tables = [], []
+    for path in args.paths:
+        dfs.append(read_csv_strict(path))
+        with open(path, "rb") as f:
+            tables.append(parse_sketch_csv(f.read()))
+
+    batch = sessions_to_prefix(tables)
+    mismatch = 0
+    for path, df, table, feat in zip(args.paths, dfs, tables, batch):
+        ref = session_to_prefix(df)
+        ok = ref == feat == sketch_to_prefix(table) == sketch_to_prefix(df)
+        ok = ok and build_prefix_tokens(ref) == build_prefix_tokens(feat)
+        mismatch += not ok
+        print(f"{path}: {'OK' if ok else 'MISMATCH'} {build_prefix_tokens(feat)}")
+        if not ok:
+            print(f"  pandas: {ref}\n  numpy:  {feat}")
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for df in dfs:
+            session_to_prefix(df)
+    ref_us = (time.perf_counter() - start) / (args.repeat * len(dfs)) * 1e6
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        sessions_to_prefix(tables)
+    batch_us = (time.perf_counter() - start) / (args.repeat * len(tables)) * 1e6
+    print(f"per sketch: pandas {ref_us:.0f}us, numpy batch {batch_us:.0f}us")
+    raise SystemExit(1 if mismatch else 0)
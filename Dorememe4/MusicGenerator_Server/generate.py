@@ -1,4 +1,5 @@
 import re, math
+import logging
 import time
 from typing import List, Optional
 from pathlib import Path
@@ -6,6 +7,13 @@ import torch
 import torch.nn as nn
 import miditoolkit
 
+from sampler import get_sampler
+from grammar import get_grammar
+from prefix_cache import prefill
+from metrics import DECODE_STEP_SECONDS, DECODE_STEPS_PER_SEC, SAFETY_STOPS
+
+logger = logging.getLogger(__name__)
+
 NOTE_RE = re.compile(r"^NOTE_(\d+)$")
 DUR_RE = re.compile(r"^DUR_(\d+)$")
 VEL_RE = re.compile(r"^VEL_(\d+)$")
@@ -25,8 +33,201 @@ def parse_bpm(prefix_tokens, default=120):
     
 # --- 토큰 생성 함수 ---
 
+def sample_batch(logits: torch.Tensor, states) -> List[int]:
+    """logits: [B, V], states: row별 DecodeState → row별 다음 token id"""
+    sampler = get_sampler(logits.size(-1), states[0].EOS_ID, logits.device)
+    allowed = None
+    if any(st.constrained for st in states):
+        # 문법 제약을 쓰는 row는 현재 상태의 mask, 아니면 전부 허용
+        grammar = states[0].grammar
+        allowed = grammar.allowed([st.gstate if st.constrained else grammar.FREE for st in states],
+                                  logits.device)
+    return sampler.sample(logits,
+                          temperature=[st.temperature for st in states],
+                          top_p=[st.top_p for st in states],
+                          top_k=[st.top_k for st in states],
+                          forbid_eos=[st.forbid_eos() for st in states],
+                          limit=[st.limit for st in states],
+                          generators=[st.generator for st in states],
+                          allowed=allowed)
+
+
+class DecodeState:
+    """
+    곡 하나(batch의 row 하나)의 생성 진행 상태
+    generate_until_seconds와 engine.GenerationEngine이 같은 규칙(목표 마디, EOS 금지,
+    안전 장치)으로 생성하도록 공유
+    constrained=True면 grammar.MelodyGrammar의 mask로 문법에 맞는 토큰만 샘플링
+    long_form=True면 block_size를 넘겨도 학습(MelodyDataset.pad_or_trim)과 같이
+    앞쪽 prefix_len개 + 최근 토큰을 컨텍스트로 사용 (window() 참고)
+    max_steps=None이면 목표 마디 수에서 계산 (마디당 최대 토큰 수 기준)
+    """
+    def __init__(self,
+                 dataset,
+                 prefix_tokens: List[str],
+                 target_sec: float,
+                 temperature = 1.0,
+                 top_p: float = 0.98,
+                 max_steps: int = 1024,
+                 beats_per_bar: int = 4,
+                 fill_last_bar: bool = False,
+                 generator: Optional[torch.Generator] = None,
+                 top_k: int = 0,
+                 constrained: bool = False,
+                 long_form: bool = False,
+                 prefix_len: int = 7,
+                 stride: int = 64):
+        self.itos = dataset.itos
+        self.EOS_ID = dataset.EOS_ID
+        self.target_sec = target_sec
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.max_steps = max_steps
+        self.beats_per_bar = beats_per_bar
+        self.fill_last_bar = fill_last_bar
+        self.generator = generator
+        self.constrained = constrained
+        self.long_form = long_form
+        self.prefix_len = prefix_len
+        self.stride = stride
+
+        # 토큰 종류 판별(id 기준)과 문법 상태
+        self.grammar = get_grammar(dataset.itos)
+        self.BAR_ID = self.grammar.BAR_ID
+
+        self.bpm = parse_bpm(prefix_tokens, default=120)
+
+        # 목표 마디 수 계산
+        self.target_bars = max(4, int(math.ceil(target_sec * self.bpm / (60 * beats_per_bar))))
+
+        # prefix 준비
+        self.ids = [dataset.stoi.get(t, dataset.PAD_ID) for t in prefix_tokens]
+        self.gstate = self.grammar.initial_state(self.ids)
+        if self.max_steps is None:
+            self.max_steps = self.target_bars * self.grammar.max_bar_tokens() + 1
+
+        # 모델 캐시에 들어 있는 컨텍스트 길이 (다음 토큰의 위치)
+        self.ctx_len = len(self.ids)
+
+        self.bars = sum(1 for t in prefix_tokens if t == "BAR")
+        self.prefix_bars = self.bars
+        self.limit = (self.bars >= self.target_bars)
+
+        # 시간 기반 안전 장치를 위한 시작 시간 기록
+        self.start_time = time.time()
+
+        self.steps = 0
+        self.in_last_bar = False
+        self.lastbar_note_cnt = 0
+
+        # 마디 단위 스트리밍: 아직 내보내지 않은 토큰 시작 위치
+        self.emitted = 0
+        self.new_bar = False
+
+    def begin_step(self) -> bool:
+        """다음 스텝을 진행해도 되면 True, 안전 장치에 걸리면 False"""
+        # 1. 생성 길이/시간 초과 시 무조건 종료
+        if self.steps >= self.max_steps:
+            logger.warning("Max steps (%d) reached. Forcing stop.", self.max_steps)
+            SAFETY_STOPS.inc("max_steps")
+            return False
+
+        # 2. 시간 초과 조건
+        if (time.time() - self.start_time) > (self.target_sec * 2): # 목표 시간의 2배를 넘으면 비정상으로 간주
+            logger.warning("Time exceeded 2x target (%.1fs). Forcing stop.", self.target_sec * 2)
+            SAFETY_STOPS.inc("time_limit")
+            return False
+
+        self.steps += 1
+        return True
+
+    def forbid_eos(self) -> bool:
+        # 로직 수정: target_bars에 도달하지 않았으면 무조건 EOS 금지
+        if self.fill_last_bar:
+            # fill_last_bar 모드에서는 마지막 마디에 노트를 최소 1개는 강제함
+            return (not self.limit) or (self.in_last_bar and self.lastbar_note_cnt == 0)
+        return not self.limit
+
+    def sample(self, logits: torch.Tensor) -> int:
+        start = time.perf_counter()
+        nid = sample_batch(logits, [self])[0]
+        DECODE_STEP_SECONDS.observe(time.perf_counter() - start, "sampling")
+        return nid
+
+    def push(self, nid: int) -> bool:
+        """샘플링된 토큰 반영, 생성이 끝났으면 True (이때 nid는 시퀀스에 추가되지 않을 수 있음)"""
+        self.new_bar = False
+
+        if nid == self.BAR_ID and self.limit:
+            # 목표 마디 도달 후 BAR이 나오면 즉시 종료
+            return True
+
+        self.ids.append(nid)
+        self.ctx_len += 1
+        self.gstate = self.grammar.step(self.gstate, nid)
+
+        if nid == self.BAR_ID:
+            self.new_bar = True
+            self.bars += 1
+            if self.bars == self.target_bars:
+                self.limit = True
+                self.in_last_bar = True
+
+        if self.in_last_bar and self.grammar.is_note(nid):
+            self.lastbar_note_cnt += 1
+
+        return nid == self.EOS_ID
+
+    def needs_window(self, block_size: int) -> bool:
+        # 방금 추가된 토큰이 block_size 밖의 위치가 되면 컨텍스트를 다시 채워야 함
+        return self.ctx_len > block_size
+
+    def window(self, block_size: int) -> List[int]:
+        """
+        모델에 새로 채울 컨텍스트 (위치는 0부터 다시 매겨짐)
+        - 기본: 마지막 block_size개 (block_size를 넘으면 매 스텝 다시 계산)
+        - long_form: prefix_len개 + 최근 토큰, stride만큼 여유를 남겨 두어
+          이후 stride 스텝 동안은 캐시에 새 토큰만 추가 → 스텝당 비용이 곡 길이와 무관
+        """
+        if len(self.ids) <= block_size:
+            ctx = self.ids
+        elif not self.long_form:
+            ctx = self.ids[-block_size:]
+        else:
+            p = min(self.prefix_len, block_size // 2)
+            keep = max(1, block_size - p - max(1, self.stride))
+            ctx = self.ids[:p] + self.ids[-keep:]
+        self.ctx_len = len(ctx)
+        return ctx
+
+    def take_bar(self) -> List[str]:
+        """방금 나온 BAR 직전까지(완성된 마디)의 아직 내보내지 않은 토큰"""
+        end = len(self.ids) - 1
+        chunk = [self.itos[i] for i in self.ids[self.emitted:end]]
+        self.emitted = end
+        return chunk
+
+    def take_rest(self) -> List[str]:
+        chunk = [self.itos[i] for i in self.ids[self.emitted:]]
+        self.emitted = len(self.ids)
+        return chunk
+
+    def finish(self) -> List[str]:
+        toks = [self.itos[i] for i in self.ids]
+        approx = bars_to_seconds(self.bars, self.bpm, self.beats_per_bar)
+        elapsed = time.time() - self.start_time
+        if self.steps and elapsed > 0:
+            DECODE_STEPS_PER_SEC.observe(self.steps / elapsed)
+        logger.info("%.1fs  (bars=%d, bpm=%d, steps=%d, %.1fs)", approx, self.bars, self.bpm, self.steps, elapsed)
+        # 토큰 전체 출력은 debug 레벨에서만 (MUSICGEN_LOG_LEVEL=DEBUG)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Generated tokens:\n %s", " ".join(toks))
+        return toks
+
+
 @torch.no_grad()
-def generate_until_seconds(model: nn.Module,
+def stream_until_seconds(model: nn.Module,
                            dataset,
                            prefix_tokens: List[str],
                            target_sec: float,
@@ -36,133 +237,84 @@ def generate_until_seconds(model: nn.Module,
                            beats_per_bar: int = 4,
                            fill_last_bar: bool = False,
                            generator: Optional[torch.Generator] = None,
+                           top_k: int = 0,
+                           constrained: bool = False,
+                           long_form: bool = False,
+                           prefix_len: int = 7,
+                           stride: int = 64,
+                           prefix_cache=None,
                            ):
+    """
+    generate_until_seconds와 같은 토큰을 마디가 완성될 때마다(BAR 토큰이 나올 때마다) 조각으로 yield
+    yield된 조각을 순서대로 이어 붙이면 generate_until_seconds의 결과와 같음
+    long_form=True: 몇 분 길이의 곡도 스텝당 비용이 일정한 슬라이딩 윈도우 모드 (DecodeState.window)
+    prefix_cache: prefix_cache.PrefixStateCache, 같은 prefix의 KV 상태를 재사용 (첫 prefill만)
+    """
     model.eval()
-    stoi = dataset.stoi
-    itos = dataset.itos
     PAD_ID = dataset.PAD_ID
-    EOS_ID = dataset.EOS_ID
-
-    bpm = parse_bpm(prefix_tokens, default=120)
 
-    # 목표 마디 수 계산
-    target_bars = max(4, int(math.ceil(target_sec * bpm / (60 * beats_per_bar))))
+    st = DecodeState(dataset, prefix_tokens, target_sec, temperature, top_p,
+                     max_steps, beats_per_bar, fill_last_bar, generator, top_k, constrained,
+                     long_form, prefix_len, stride)
 
     dev = next(model.parameters()).device
+    block_size = dataset.block_size
 
-    # prefix 준비
-    ids = [stoi.get(t, PAD_ID) for t in prefix_tokens]
-    x = torch.tensor(ids, dtype=torch.long, device=dev).unsqueeze(0)
-
-    prefix_bars = sum(1 for t in prefix_tokens if t == "BAR")
-    bars = prefix_bars
-
-    limit = (bars >= target_bars)
-    
-    # 시간 기반 안전 장치를 위한 시작 시간 기록
-    start_time = time.time() 
-
-    steps = 0
-    stop = False
-    in_last_bar = False
-    lastbar_note_cnt = 0
+    # KV cache: 컨텍스트는 한 번만 계산하고 이후에는 새 토큰만 모델에 넣음
+    cache = None
+    feed = None
 
     # 루프 조건: max_steps 또는 내부 break에 의존
-    while True: 
-        # 1. 생성 길이/시간 초과 시 무조건 종료
-        if steps >= max_steps:
-             print(f"[Generator] WARNING: Max steps ({max_steps}) reached. Forcing stop.")
-             break 
-             
-        # 2. 시간 초과 조건
-        if (time.time() - start_time) > (target_sec * 2): # 목표 시간의 2배를 넘으면 비정상으로 간주
-             print(f"[Generator] WARNING: Time exceeded 2x target ({target_sec * 2:.1f}s). Forcing stop.")
-             break
-
-        steps += 1
-
-        if x.size(1) > dataset.block_size:
-            x = x[:, -dataset.block_size:]
-
-        logits = model(x, pad_id=PAD_ID)[:, -1, :]
-        logits = logits / max(1e-6, temperature)
-        base_logits = logits.clone()
-
-        # 목표 마디 도달 전 EOS 금지
-        if EOS_ID is not None:
-            # 로직 수정: target_bars에 도달하지 않았으면 무조건 EOS 금지
-            forbid_eos = (not limit) 
-            
-            if fill_last_bar:
-                # fill_last_bar 모드에서는 마지막 마디에 노트를 최소 1개는 강제함
-                forbid_eos = (not limit) or (in_last_bar and lastbar_note_cnt == 0)
-
-            if forbid_eos:
-                logits[:, EOS_ID] = float("-inf")
-
-        # Nucleus(Top-p) Sampling
-        sorted_logits, sorted_idx = torch.sort(logits, descending=True)
-        probs = torch.softmax(sorted_logits[0], dim=-1)
-        cum = torch.cumsum(probs, dim=-1)
-        cutoff_idx = (cum > top_p).nonzero(as_tuple=False)
-        cutoff = (int(cutoff_idx[0].item()) + 1) if cutoff_idx.numel() > 0 else probs.size(0)
-        if cutoff < 1:
-            cutoff = 1
-
-        keep = torch.zeros_like(logits, dtype=torch.bool)
-        keep.scatter_(1, sorted_idx[:, :cutoff], True)
-        logits = logits.masked_fill(~keep, float("-inf"))
-
-        # 모든 로짓이 -inf가 되는 예외 상황 (Fallback)
-        row = logits[0]
-        if torch.isneginf(row).all():
-            logits = base_logits.clone()
-            if EOS_ID is not None and not limit:
-                logits[:, EOS_ID] = float("-inf")
-
-        # 최종 확률 분포
-        probs = torch.softmax(logits, dim=-1)
-        
-        # isfinite 체크 및 Fallback
-        if (not torch.isfinite(probs).all()) or (probs.sum() <= 0):
-             # 텐서에 NaN/Inf가 있거나 확률 합이 0이면, 가장 높은 로짓을 강제 선택
-            intnext = int(torch.argmax(logits[0]).item())
-            next_id = torch.tensor([[intnext]], dtype=torch.long, device=logits.device)
+    while st.begin_step():
+        start = time.perf_counter()
+        if cache is None or st.needs_window(block_size):
+            # 윈도우가 밀리면 위치 idx가 0부터 다시 매겨지므로 캐시를 새로 채움
+            # (처음 prefix는 prefix_cache에 있으면 그 상태를 그대로 사용)
+            states = prefix_cache if cache is None else None
+            cache, logits = prefill(model, st.window(block_size), PAD_ID, states)
+            DECODE_STEP_SECONDS.observe(time.perf_counter() - start, "prefill")
         else:
-            next_id = torch.multinomial(probs, 1, generator=generator)
-
-        nid = int(next_id.item())
-        tok = itos[nid]
-
-        if tok == "BAR":
-            if limit: 
-                # 목표 마디 도달 후 BAR이 나오면 즉시 종료
-                stop = True
-                break # continue 대신 break 사용
-            # 목표 마디 도달 전이면 BAR을 허용하고 다음 스텝으로 진행
-
-        ids.append(nid)
-        x = torch.cat([x, next_id], dim=1)
-
-        if tok == "BAR":
-            bars += 1
-            if bars == target_bars:
-                limit = True
-                in_last_bar = True
-                
-        if in_last_bar and tok.startswith("NOTE_"):
-            lastbar_note_cnt += 1
-
-        if stop and tok == "EOS":
-            break
-        if tok == "EOS":
+            timings = {}
+            logits = model.forward_cached(feed, cache, pad_id=PAD_ID, timings=timings)[:, -1, :]
+            DECODE_STEP_SECONDS.observe(time.perf_counter() - start, "forward")
+            DECODE_STEP_SECONDS.observe(timings["attention"], "attention")
+        nid = st.sample(logits)
+        if st.push(nid):
             break
+        if st.new_bar:
+            yield st.take_bar()
+
+        feed = torch.tensor([[nid]], dtype=torch.long, device=dev)
+
+    st.finish()
+    yield st.take_rest()
 
-    toks = [itos[i] for i in ids]
-    approx = bars_to_seconds(bars, bpm, beats_per_bar)
-    print(f"{approx:.1f}s  (bars={bars}, bpm={bpm})")
-    print("Generated tokens:\n", " ".join(toks))
 
+def generate_until_seconds(model: nn.Module,
+                           dataset,
+                           prefix_tokens: List[str],
+                           target_sec: float,
+                           temperature = 1.0,
+                           top_p: float = 0.98,
+                           max_steps: int = 1024, # 8000 -> 1024
+                           beats_per_bar: int = 4,
+                           fill_last_bar: bool = False,
+                           generator: Optional[torch.Generator] = None,
+                           top_k: int = 0,
+                           constrained: bool = False,
+                           long_form: bool = False,
+                           prefix_len: int = 7,
+                           stride: int = 64,
+                           prefix_cache=None,
+                           ):
+    toks = []
+    for chunk in stream_until_seconds(model, dataset, prefix_tokens, target_sec,
+                                      temperature=temperature, top_p=top_p, max_steps=max_steps,
+                                      beats_per_bar=beats_per_bar, fill_last_bar=fill_last_bar,
+                                      generator=generator, top_k=top_k, constrained=constrained,
+                                      long_form=long_form, prefix_len=prefix_len, stride=stride,
+                                      prefix_cache=prefix_cache):
+        toks.extend(chunk)
     return toks
 
 
@@ -177,7 +329,8 @@ def vbin_to_vel(vbin: int, vel_bins: int = 8) -> int:
     return max(1, min(127, vel))
 
 
-def tokens_to_midi(tokens, out_midi_path: str, tpq: int = 480, grid_div: int = 4):
+def tokens_to_midi_obj(tokens, tpq: int = 480, grid_div: int = 4) -> miditoolkit.MidiFile:
+    # 파일로 쓰지 않고 메모리 상의 MidiFile만 만듦 (synth.py에서 바로 합성)
     bpm = 120
     for t in tokens:
         m = BPM_RE.match(t)
@@ -267,7 +420,11 @@ def tokens_to_midi(tokens, out_midi_path: str, tpq: int = 480, grid_div: int = 4
             break
 
     flush_note()
+    return midi
 
+
+def tokens_to_midi(tokens, out_midi_path: str, tpq: int = 480, grid_div: int = 4):
+    midi = tokens_to_midi_obj(tokens, tpq, grid_div)
     Path(out_midi_path).parent.mkdir(parents=True, exist_ok=True)
     midi.dump(out_midi_path)
     return out_midi_path
\ No newline at end of file
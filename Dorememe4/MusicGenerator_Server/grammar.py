@@ -0,0 +1,120 @@
+from typing import Dict, List
+
+import torch
+
+# 토큰 종류
+C_PAD, C_META, C_BAR, C_EOS, C_POS, C_NOTE, C_DUR, C_VEL = range(8)
+
+# 상태(phase): 마지막으로 나온 토큰 종류
+P_FREE, P_META, P_BAR, P_POS, P_NOTE, P_DUR, P_VEL, P_END = range(8)
+N_PHASES = 8
+
+_META_PREFIXES = ("KEY_", "MODE_", "BPM_", "REG_", "RHY_", "DENS_", "CHR_")
+_CLASS_TO_PHASE = {C_META: P_META, C_BAR: P_BAR, C_EOS: P_END, C_POS: P_POS,
+                   C_NOTE: P_NOTE, C_DUR: P_DUR, C_VEL: P_VEL}
+
+
+def token_class(tok: str) -> int:
+    if tok == "BAR":
+        return C_BAR
+    if tok == "EOS":
+        return C_EOS
+    if tok.startswith("POS_"):
+        return C_POS
+    if tok.startswith("NOTE_"):
+        return C_NOTE
+    if tok.startswith("DUR_"):
+        return C_DUR
+    if tok.startswith("VEL_"):
+        return C_VEL
+    if tok.startswith(_META_PREFIXES):
+        return C_META
+    return C_PAD
+
+
+class MelodyGrammar:
+    """
+    멜로디 토큰 문법 상태 기계
+        (prefix) → BAR → POS → NOTE → DUR → VEL → (POS | BAR | EOS)
+    - 상태 = phase * n_pos + 현재 마디 안의 POS 값 (정수 하나)
+    - 상태마다 다음에 올 수 있는 토큰을 vocab 크기 bool mask로 미리 계산해 둠
+    - monotonic_pos=True면 한 마디 안에서 POS가 줄어들지 않도록만 허용 (학습 코퍼스와 같음,
+      같은 POS가 다시 나오는 화음/겹친 음은 코퍼스에 있으므로 허용, test_grammar.py)
+    - 토큰 판별은 id 기준 lookup table로 처리 (문자열 비교 없음)
+    """
+    def __init__(self, itos: Dict[int, str], monotonic_pos: bool = True):
+        V = len(itos)
+        toks = [itos[i] for i in range(V)]
+        self.vocab_size = V
+        self.monotonic_pos = monotonic_pos
+
+        self.token_class = [token_class(t) for t in toks]
+        self.pos_value = [int(t[4:]) if c == C_POS else -1 for t, c in zip(toks, self.token_class)]
+        self.n_pos = max(1, max(self.pos_value) + 1)
+        self.BAR_ID = toks.index("BAR") if "BAR" in toks else None
+        self.EOS_ID = toks.index("EOS") if "EOS" in toks else None
+
+        self.FREE = P_FREE * self.n_pos
+        self.masks = self._build_masks()
+        self._masks_on = {self.masks.device: self.masks}
+
+    def _build_masks(self) -> torch.Tensor:
+        V, n_pos = self.vocab_size, self.n_pos
+        cls = torch.tensor(self.token_class)
+        pos = torch.tensor(self.pos_value)
+        is_ = lambda c: cls == c
+
+        masks = torch.zeros(N_PHASES * n_pos, V, dtype=torch.bool)
+        for p in range(n_pos):
+            masks[P_FREE * n_pos + p] = True
+            masks[P_META * n_pos + p] = is_(C_BAR)
+            masks[P_BAR * n_pos + p] = is_(C_POS)
+            masks[P_POS * n_pos + p] = is_(C_NOTE)
+            masks[P_NOTE * n_pos + p] = is_(C_DUR)
+            masks[P_DUR * n_pos + p] = is_(C_VEL)
+            next_pos = is_(C_POS) & (pos >= p) if self.monotonic_pos else is_(C_POS)
+            masks[P_VEL * n_pos + p] = next_pos | is_(C_BAR) | is_(C_EOS)
+            masks[P_END * n_pos + p] = is_(C_EOS)
+        return masks
+
+    def step(self, state: int, nid: int) -> int:
+        """토큰 하나를 반영한 다음 상태"""
+        c = self.token_class[nid]
+        if c == C_PAD:
+            return state
+        if c == C_POS:
+            return P_POS * self.n_pos + self.pos_value[nid]
+        pos = 0 if c == C_BAR else state % self.n_pos
+        return _CLASS_TO_PHASE[c] * self.n_pos + pos
+
+    def initial_state(self, ids: List[int]) -> int:
+        state = self.FREE
+        for i in ids:
+            state = self.step(state, i)
+        return state
+
+    def max_bar_tokens(self) -> int:
+        # BAR + 위치마다 (POS NOTE DUR VEL)
+        return 1 + 4 * self.n_pos
+
+    def is_note(self, nid: int) -> bool:
+        return self.token_class[nid] == C_NOTE
+
+    def allowed(self, states: List[int], device=None) -> torch.Tensor:
+        """상태 목록 → [B, V] 허용 mask"""
+        device = torch.device(device) if device is not None else self.masks.device
+        masks = self._masks_on.get(device)
+        if masks is None:
+            masks = self._masks_on[device] = self.masks.to(device)
+        return masks[torch.tensor(states, device=device)]
+
+
+_grammars = {}
+
+def get_grammar(itos: Dict[int, str], monotonic_pos: bool = True) -> MelodyGrammar:
+    """vocab별로 한 번만 만들어 재사용"""
+    key = (tuple(itos[i] for i in range(len(itos))), monotonic_pos)
+    grammar = _grammars.get(key)
+    if grammar is None:
+        grammar = _grammars[key] = MelodyGrammar(itos, monotonic_pos)
+    return grammar
@@ -0,0 +1,266 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 허용되는 상태 전이 (완료/실패 후에는 바뀌지 않음)
+TRANSITIONS = {
+    "in_progress": {"1st_ready", "completed", "failed"},
+    "1st_ready": {"completed", "failed"},
+}
+FINISHED = ("completed", "failed")
+UNFINISHED = tuple(TRANSITIONS)
+
+DEFAULT_URL = "sqlite:///jobs.sqlite"
+
+
+class MemoryJobStore:
+    """
+    프로세스 안에서만 쓰는 job 저장소 (worker 프로세스와 공유되지 않음)
+    worker 풀 없이 한 프로세스에서 생성까지 처리할 때 / 테스트용
+    """
+    def __init__(self):
+        self._jobs = {} # job_id → [record, version, created_at, updated_at, owner]
+        self._lock = threading.Lock()
+
+    def create(self, job_id: str, owner: str = None, **fields):
+        """owner: job을 처리하는 서버 프로세스 (record에는 넣지 않음, fail_unfinished 참고)"""
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = [dict(fields), 1, now, now, owner]
+
+    def get(self, job_id: str):
+        data, _ = self.get_versioned(job_id)
+        return data
+
+    def get_versioned(self, job_id: str):
+        with self._lock:
+            row = self._jobs.get(job_id)
+            if row is None:
+                return None, None
+            return dict(row[0]), row[1]
+
+    def versions(self, job_ids) -> dict:
+        """{job_id: version} (없는 job은 빠짐)"""
+        with self._lock:
+            return {jid: self._jobs[jid][1] for jid in job_ids if jid in self._jobs}
+
+    def update(self, job_id: str, **fields) -> bool:
+        """상태는 그대로 두고 필드만 갱신"""
+        fields.pop("status", None)
+        with self._lock:
+            row = self._jobs.get(job_id)
+            if row is None:
+                return False
+            row[0].update(fields)
+            row[1] += 1
+            row[3] = time.time()
+            return True
+
+    def transition(self, job_id: str, status: str, **fields) -> bool:
+        """현재 상태에서 status로 바꿀 수 있을 때만 필드와 함께 반영"""
+        with self._lock:
+            row = self._jobs.get(job_id)
+            if row is None or status not in TRANSITIONS.get(row[0].get("status"), ()):
+                return False
+            row[0].update(fields, status=status)
+            row[1] += 1
+            row[3] = time.time()
+            return True
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def purge_finished(self, older_than: float):
+        """older_than(epoch 초) 이전에 끝난 job을 삭제하고 그 record 목록을 반환"""
+        with self._lock:
+            expired = [jid for jid, row in self._jobs.items()
+                       if row[0].get("status") in FINISHED and row[3] < older_than]
+            return [(jid, self._jobs.pop(jid)[0]) for jid in expired]
+
+    def owners(self) -> set:
+        """끝나지 않은 job의 owner 목록"""
+        with self._lock:
+            return {row[4] for row in self._jobs.values()
+                    if row[0].get("status") in UNFINISHED and row[4] is not None}
+
+    def fail_unfinished(self, owner: str = None, older_than: float = None, **fields):
+        """
+        끝나지 않은 job 중 owner가 같거나(owner) older_than(epoch 초) 이후 바뀌지 않은 job을 failed로 바꾸고
+        그 job_id 목록을 반환 (재시작 / 죽은 서버가 남긴 job 정리용)
+        """
+        now = time.time()
+        failed = []
+        with self._lock:
+            for jid, row in self._jobs.items():
+                if row[0].get("status") not in UNFINISHED:
+                    continue
+                if (owner is not None and row[4] == owner) or (older_than is not None and row[3] < older_than):
+                    row[0].update(fields, status="failed")
+                    row[1] += 1
+                    row[3] = now
+                    failed.append(jid)
+        return failed
+
+
+class SQLiteJobStore:
+    """
+    SQLite(WAL) job 저장소: 여러 프로세스(worker, 서버 여러 개)가 같은 파일을 공유
+    - job_id PRIMARY KEY로 조회, (status, updated_at) index로 만료 job 정리
+    - 상태 전이는 한 트랜잭션 안에서 현재 상태를 확인하고 바꿈
+    - 연결은 프로세스/스레드마다 따로 열어 사용 (fork/spawn 후에도 안전)
+    """
+    def __init__(self, path: str = "jobs.sqlite", timeout: float = 10.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 1,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_updated ON jobs (status, updated_at)")
+            # owner 열이 없던 이전 파일
+            if "owner" not in [r[1] for r in conn.execute("PRAGMA table_info(jobs)")]:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+    def __getstate__(self):
+        # spawn 방식 worker로 넘길 때 연결은 제외
+        return {"path": self.path, "timeout": self.timeout}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, job_id: str, owner: str = None, **fields):
+        """owner: job을 처리하는 서버 프로세스 (data에는 넣지 않음, fail_unfinished 참고)"""
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO jobs (job_id, status, data, version, created_at, updated_at, owner) "
+            "VALUES (?, ?, ?, 1, ?, ?, ?)",
+            (job_id, fields.get("status", ""), json.dumps(fields), now, now, owner))
+
+    def get(self, job_id: str):
+        data, _ = self.get_versioned(job_id)
+        return data
+
+    def get_versioned(self, job_id: str):
+        row = self._conn().execute("SELECT data, version FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def versions(self, job_ids) -> dict:
+        """{job_id: version} (없는 job은 빠짐), 여러 job을 한 번에 조회"""
+        job_ids = list(job_ids)
+        out = {}
+        conn = self._conn()
+        for i in range(0, len(job_ids), 500):
+            chunk = job_ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            out.update(conn.execute(f"SELECT job_id, version FROM jobs WHERE job_id IN ({marks})", chunk))
+        return out
+
+    def _modify(self, job_id: str, status, fields) -> bool:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT status, data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None or (status is not None and status not in TRANSITIONS.get(row[0], ())):
+                conn.execute("ROLLBACK")
+                return False
+            data = json.loads(row[1])
+            data.update(fields)
+            if status is not None:
+                data["status"] = status
+            conn.execute(
+                "UPDATE jobs SET status = ?, data = ?, version = version + 1, updated_at = ? WHERE job_id = ?",
+                (data.get("status", row[0]), json.dumps(data), time.time(), job_id))
+            conn.execute("COMMIT")
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def update(self, job_id: str, **fields) -> bool:
+        """상태는 그대로 두고 필드만 갱신"""
+        fields.pop("status", None)
+        return self._modify(job_id, None, fields)
+
+    def transition(self, job_id: str, status: str, **fields) -> bool:
+        """현재 상태에서 status로 바꿀 수 있을 때만 필드와 함께 반영"""
+        return self._modify(job_id, status, fields)
+
+    def delete(self, job_id: str):
+        self._conn().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def purge_finished(self, older_than: float):
+        """older_than(epoch 초) 이전에 끝난 job을 삭제하고 그 record 목록을 반환"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT job_id, data FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (*FINISHED, older_than)).fetchall()
+            conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(r[0],) for r in rows])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [(job_id, json.loads(data)) for job_id, data in rows]
+
+    def owners(self) -> set:
+        """끝나지 않은 job의 owner 목록"""
+        rows = self._conn().execute(
+            "SELECT DISTINCT owner FROM jobs WHERE status IN (?, ?) AND owner IS NOT NULL", UNFINISHED)
+        return {r[0] for r in rows}
+
+    def fail_unfinished(self, owner: str = None, older_than: float = None, **fields):
+        """
+        끝나지 않은 job 중 owner가 같거나(owner) older_than(epoch 초) 이후 바뀌지 않은 job을 failed로 바꾸고
+        그 job_id 목록을 반환 (재시작 / 죽은 서버가 남긴 job 정리용)
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT job_id, data FROM jobs WHERE status IN (?, ?) AND (owner = ? OR updated_at < ?)",
+                (*UNFINISHED, owner, older_than if older_than is not None else float("-inf"))).fetchall()
+            now = time.time()
+            for job_id, data in rows:
+                data = json.loads(data)
+                data.update(fields, status="failed")
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', data = ?, version = version + 1, updated_at = ? "
+                    "WHERE job_id = ?", (json.dumps(data), now, job_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [r[0] for r in rows]
+
+
+def open_job_store(url: str):
+    """'memory' 또는 'sqlite:///경로'"""
+    if url == "memory":
+        return MemoryJobStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteJobStore(url[len("sqlite:///"):])
+    raise ValueError(f"unknown job store: {url}")
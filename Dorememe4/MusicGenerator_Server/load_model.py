@@ -1,22 +1,15 @@
 import os
 import torch
-from data import MelodyDataset
+from data import MelodyDataset, MelodyVocab
 from model import MelodyModel
-    
-def load_model(ckpt_path, tok_path, voc_path, cfg, device):
-    if not os.path.exists(ckpt_path):
-        raise FileNotFoundError(ckpt_path)
-    
-    ckpt = torch.load(ckpt_path, map_location="cpu")
-
-    assert isinstance(ckpt, dict) and "model" in ckpt # 가중치 state_dict
+from quantize import quantize_model, quantized_path, save_quantized, load_quantized_state
+from result_cache import checkpoint_hash
 
-    dataset = MelodyDataset(tok_path, voc_path, cfg.block_size, cut_at_eos=True)
-
-    V = len(dataset.vocab) # 모델 출력 차원 V
-    PAD_ID = dataset.PAD_ID
+def _new_model(vocab, cfg):
+    V = len(vocab.vocab) # 모델 출력 차원 V
+    PAD_ID = vocab.PAD_ID
 
-    model = MelodyModel(
+    return MelodyModel(
         vocab_size=V,
         hidden_size=cfg.hidden_size,
         num_heads=cfg.num_heads,
@@ -25,10 +18,61 @@ def load_model(ckpt_path, tok_path, voc_path, cfg, device):
         dropout=cfg.dropout,
         block_size=cfg.block_size,
         pad_id=PAD_ID
-        ).to(device)
+        )
+
+def build_model(ckpt_path, vocab, cfg, device):
+    if not os.path.exists(ckpt_path):
+        raise FileNotFoundError(ckpt_path)
+
+    # cfg.quant: "fp32"(기본) / "int8" / "bf16" (양자화는 CPU 추론 전용)
+    quant = getattr(cfg, "quant", "fp32")
+    if quant != "fp32":
+        if torch.device(device).type != "cpu":
+            raise ValueError(f"quant={quant} is supported only on cpu")
+        return _build_quantized(ckpt_path, vocab, cfg, quant)
+
+    ckpt = torch.load(ckpt_path, map_location="cpu")
+
+    assert isinstance(ckpt, dict) and "model" in ckpt # 가중치 state_dict
+
+    model = _new_model(vocab, cfg).to(device)
     
     model.load_state_dict(ckpt["model"], strict=True)
     
     model.eval()
 
-    return model, dataset
\ No newline at end of file
+    return model
+
+def _build_quantized(ckpt_path, vocab, cfg, quant):
+    # 변환된 가중치는 체크포인트 옆(melModel_tf.int8.pt 등)에 저장해 두고 다음 시작 때 바로 읽음
+    model = _new_model(vocab, cfg).eval()
+    source = checkpoint_hash(ckpt_path)
+    qpath = quantized_path(ckpt_path, quant)
+    if os.path.exists(qpath) and load_quantized_state(model, qpath, quant, source):
+        print(f"Loaded {quant} weights from {qpath}")
+        return model
+
+    ckpt = torch.load(ckpt_path, map_location="cpu")
+    assert isinstance(ckpt, dict) and "model" in ckpt # 가중치 state_dict
+    model.load_state_dict(ckpt["model"], strict=True)
+    quantize_model(model, quant)
+    try:
+        save_quantized(model, qpath, source)
+    except OSError as e:
+        print(f"Could not cache {quant} weights: {e}")
+    return model
+
+def load_model(ckpt_path, tok_path, voc_path, cfg, device):
+    # 학습/평가용: 코퍼스 전체를 MelodyDataset으로 로드
+    if not os.path.exists(ckpt_path):
+        raise FileNotFoundError(ckpt_path)
+
+    dataset = MelodyDataset(tok_path, voc_path, cfg.block_size, cut_at_eos=True)
+    model = build_model(ckpt_path, dataset, cfg, device)
+    return model, dataset
+
+def load_inference_model(ckpt_path, voc_path, cfg, device):
+    # 추론용: vocab만 읽으므로 시작 시간/메모리가 코퍼스 크기와 무관
+    vocab = MelodyVocab(voc_path, cfg.block_size)
+    model = build_model(ckpt_path, vocab, cfg, device)
+    return model, vocab
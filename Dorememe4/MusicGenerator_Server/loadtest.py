@@ -0,0 +1,74 @@
+"""
+간단한 HTTP 부하 테스트 (Flask 개발 서버 app.py vs 비동기 서버 server.py 비교용)
+예:
+  python loadtest.py http://localhost:5000/api/status/<job_id> -c 64 -d 10
+  python loadtest.py http://localhost:5000/music/<file>.wav -c 32 -d 10 --range 0-65535
+  python loadtest.py http://localhost:5000/api/upload_data --post sketch.csv -c 16 -d 10
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from aiohttp import ClientSession, TCPConnector
+
+
+async def _worker(session, args, body, deadline, latencies, errors):
+    headers = {}
+    if args.range:
+        headers["Range"] = f"bytes={args.range}"
+    if body is not None:
+        headers["X-File-Name"] = "loadtest.csv"
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if body is not None:
+                resp = await session.post(args.url, data=body, headers=headers)
+            else:
+                resp = await session.get(args.url, headers=headers)
+            async with resp:
+                await resp.read()
+                if resp.status >= 500 or resp.status == 404:
+                    errors[resp.status] = errors.get(resp.status, 0) + 1
+                    continue
+        except Exception as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(args):
+    body = None
+    if args.post:
+        with open(args.post, "rb") as f:
+            body = f.read()
+
+    latencies, errors = [], {}
+    async with ClientSession(connector=TCPConnector(limit=0)) as session:
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*[_worker(session, args, body, deadline, latencies, errors)
+                               for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    pct = lambda p: round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2) if latencies else None
+    return {
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "latency_ms": {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99)},
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("url")
+    ap.add_argument("-c", "--concurrency", type=int, default=32)
+    ap.add_argument("-d", "--duration", type=float, default=10.0)
+    ap.add_argument("--range", help="Range 요청 (예: 0-65535)")
+    ap.add_argument("--post", help="이 파일을 body로 POST (upload_data)")
+    args = ap.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
@@ -0,0 +1,245 @@
+"""
+생성 파이프라인 계측 (Prometheus text format, /metrics)
+- 지표는 모두 이 모듈에서 선언 → 어느 프로세스에서나 같은 slot 배치
+- 값은 프로세스마다 자기 row에만 더하고(프로세스 안의 threading.Lock만 사용),
+  /metrics를 응답하는 메인 프로세스가 모든 row를 합산
+  (create_shared()는 메인 프로세스에서 worker 시작 전에, attach()는 worker 초기화에서)
+- 공유 메모리를 붙이지 않은 프로세스(스크립트, 테스트)에서는 프로세스 내부 값으로 동작
+- 관측 한 번 = lock + float 덧셈 몇 개 → 운영에서 항상 켜 둘 수 있는 비용
+"""
+import bisect
+import multiprocessing
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.size = 0
+        self._lock = threading.Lock()
+        self._buf = None    # 모든 프로세스의 값 (flat, 공유 메모리 또는 프로세스 내부 array)
+        self._rows = 1
+        self._base = 0      # 이 프로세스 row의 시작 위치
+
+    def declare(self, metric, n_slots: int) -> int:
+        if self._buf is not None:
+            raise RuntimeError("metrics must be declared before first use")
+        self.metrics.append(metric)
+        offset = self.size
+        self.size += n_slots
+        return offset
+
+    def _values(self):
+        if self._buf is None:
+            self._buf = memoryview(array("d", bytes(8 * self.size)))
+        return self._buf
+
+    def create_shared(self, processes: int):
+        """메인 프로세스: worker들과 공유할 저장소 (worker_pool initargs로 전달), 메인은 0번 row"""
+        raw = multiprocessing.RawArray("d", processes * self.size)
+        next_row = multiprocessing.Value("i", 1)
+        self._use(raw, processes, 0)
+        return raw, next_row, processes
+
+    def attach(self, shared, row: int = None):
+        """worker 프로세스: 공유 저장소에서 자기 row를 하나 할당받음 (row를 지정하면 그 row 사용)"""
+        if shared is None:
+            return
+        raw, next_row, processes = shared
+        if row is None:
+            with next_row.get_lock():
+                row = next_row.value
+                next_row.value += 1
+        if row >= processes:
+            print(f"Metrics: no free slot for this process (row {row} >= {processes}), not exported")
+            return
+        self._use(raw, processes, row)
+
+    def _use(self, raw, processes: int, row: int):
+        with self._lock:
+            self._buf = memoryview(raw).cast("B").cast("d")
+            self._rows = processes
+            self._base = row * self.size
+
+    def add(self, slot: int, value: float = 1.0):
+        with self._lock:
+            buf = self._values()
+            buf[self._base + slot] += value
+
+    def add_hist(self, bucket: int, sum_slot: int, value: float):
+        with self._lock:
+            buf = self._values()
+            base = self._base
+            buf[base + bucket] += 1
+            buf[base + sum_slot] += value
+            buf[base + sum_slot + 1] += 1
+
+    def set(self, slot: int, value: float):
+        with self._lock:
+            self._values()[self._base + slot] = value
+
+    def totals(self) -> np.ndarray:
+        values = np.frombuffer(self._values(), dtype=np.float64)
+        return values.reshape(self._rows, self.size).sum(axis=0)
+
+    def render(self) -> str:
+        totals = self.totals()
+        lines = []
+        for m in self.metrics:
+            lines.extend(m.render(totals))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels=(), values=(), slots_per_series: int = 1,
+                 registry: MetricsRegistry = REGISTRY):
+        """labels: 라벨 이름들, values: 가능한 라벨 값 조합 (라벨이 하나면 문자열 목록도 가능)"""
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = [v if isinstance(v, tuple) else (v,) for v in values] if labels else [()]
+        self._index = {v: i for i, v in enumerate(self.values)}
+        self.stride = slots_per_series
+        self.registry = registry
+        self.offset = registry.declare(self, len(self.values) * slots_per_series)
+
+    def _base(self, labels) -> int:
+        return self.offset + self._index[labels] * self.stride
+
+    def _label_str(self, values, extra=None) -> str:
+        pairs = [f'{k}="{v}"' for k, v in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self, totals):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values in self.values:
+            lines.append(f"{self.name}{self._label_str(values)} {_fmt(totals[self._base(values)])}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0):
+        self.registry.add(self._base(labels), amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        # 보통 메인 프로세스(0번 row)에서 설정하는 값 (scrape 시점의 상태)
+        # worker가 각자 row에 설정하면 /metrics에는 모든 worker의 합으로 나옴
+        self.registry.set(self._base(labels), value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets, labels=(), values=(), registry: MetricsRegistry = REGISTRY):
+        self.buckets = sorted(float(b) for b in buckets)
+        # slot: bucket별 개수(마지막은 +Inf, 누적 아님) / sum / count
+        super().__init__(name, help, labels, values, len(self.buckets) + 3, registry)
+
+    def observe(self, value: float, *labels):
+        base = self._base(labels)
+        n = len(self.buckets) + 1
+        self.registry.add_hist(base + bisect.bisect_left(self.buckets, value), base + n, value)
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self, totals):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        n = len(self.buckets) + 1
+        for values in self.values:
+            base = self._base(values)
+            cumulative = 0.0
+            for i, le in enumerate(self.buckets + [float("inf")]):
+                cumulative += totals[base + i]
+                le_label = 'le="' + _fmt(le) + '"'
+                lines.append(f"{self.name}_bucket{self._label_str(values, le_label)} {_fmt(cumulative)}")
+            lines.append(f"{self.name}_sum{self._label_str(values)} {_fmt(totals[base + n])}")
+            lines.append(f"{self.name}_count{self._label_str(values)} {_fmt(totals[base + n + 1])}")
+        return lines
+
+
+def create_shared(processes: int):
+    return REGISTRY.create_shared(processes)
+
+
+def attach(shared, row: int = None):
+    REGISTRY.attach(shared, row)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# ----- 지표 선언 -----
+
+_STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+_STEP_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+JOB_STAGE_SECONDS = Histogram(
+    "musicgen_job_stage_seconds",
+    "Per-job time by stage (first_pass/final_decode: from generation start until the preview/last "
+    "tokens are decoded, midi/synth/write: summed over all renders of the job).",
+    _STAGE_BUCKETS, labels=("stage",),
+    values=("queue_wait", "model_load", "first_pass", "final_decode", "midi", "synth", "write", "total"),
+)
+DECODE_STEP_SECONDS = Histogram(
+    "musicgen_decode_step_seconds",
+    "Time per decode step by phase (attention is part of forward; prefill is a context refill).",
+    _STEP_BUCKETS, labels=("phase",), values=("prefill", "forward", "attention", "sampling"),
+)
+DECODE_STEPS_PER_SEC = Histogram(
+    "musicgen_decode_steps_per_second",
+    "Decode steps per second of each generated song.",
+    (10, 25, 50, 100, 200, 400, 800, 1600),
+)
+SAFETY_STOPS = Counter(
+    "musicgen_safety_stops_total",
+    "Generations cut short by a safety limit.",
+    labels=("reason",), values=("max_steps", "time_limit"),
+)
+ENGINE_PREEMPTIONS = Counter(
+    "musicgen_engine_preemptions_total",
+    "Final renders paused at a bar boundary so first-pass (preview) work could run.",
+)
+JOBS = Counter(
+    "musicgen_jobs_total",
+    "Generation jobs by result.",
+    labels=("result",), values=("completed", "failed", "cached", "rejected"),
+)
+WORKERS_READY = Gauge("musicgen_workers_ready", "Worker processes with the model loaded.")
+QUEUE_DEPTH = Gauge("musicgen_queue_depth", "Jobs waiting in the worker pool queue.")
+# worker마다 자기 row에 1을 기록 → 합산하면 합성 경로별 worker 수
+SYNTH_WORKERS = Gauge(
+    "musicgen_synth_workers",
+    "Worker processes by audio synthesis path (in_process: pyfluidsynth, cli: one fluidsynth process per render).",
+    labels=("mode",), values=("in_process", "cli"),
+)
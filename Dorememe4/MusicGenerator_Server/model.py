@@ -1,5 +1,8 @@
+import math
+import time
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 class LearnedPositionalEncoding(nn.Module):
     """
@@ -10,11 +13,14 @@ class LearnedPositionalEncoding(nn.Module):
         super().__init__()
         self.pos = nn.Embedding(max_len, hidden_size) # pos idx(int) → vector
 
-    def forward(self, x: torch.Tensor):
+    def forward(self, x: torch.Tensor, positions: torch.Tensor = None):
         # x: [B, L, D]
         # B: batch size
         # L: sequence length
         # D: hidden dimendion
+        # positions: [B, L] 위치 인덱스 직접 지정 (incremental decoding 시 사용)
+        if positions is not None:
+            return x + self.pos(positions) # [B, L, D]
         B, L, D = x.shape
         idx = torch.arange(L, device=x.device) # [L], 0..L-1 위치 인덱스 생성
         pos_emb = self.pos(idx) # [L, D] 각 위치의 임베딩 벡터 조회
@@ -22,6 +28,62 @@ class LearnedPositionalEncoding(nn.Module):
         return x + pos_emb # [B, L, D] 브로드캐스팅
     
 
+def _pad_right(t, length: int, dim: int, fill):
+    need = length - t.size(dim)
+    if need <= 0:
+        return t
+    shape = list(t.shape)
+    shape[dim] = need
+    return torch.cat([t, t.new_full(shape, fill)], dim=dim)
+
+
+class KVCache:
+    """
+    incremental decoding용 layer별 key/value 캐시
+    k[i], v[i]: [B, H, L, Dh] i번째 layer의 self-attention key/value
+    pad: [B, L] PAD 위치(True), forward()의 key_padding_mask와 같은 의미
+    next_pos: [B] 각 row에서 다음 토큰이 받을 position idx
+    """
+    def __init__(self, num_layers: int):
+        self.k = [None] * num_layers
+        self.v = [None] * num_layers
+        self.pad = None
+        self.next_pos = None
+
+    def __len__(self):
+        return 0 if self.pad is None else self.pad.size(1)
+
+    def select(self, rows: torch.Tensor):
+        # batch에서 rows에 해당하는 row만 남김 (생성이 끝난 row 제거용)
+        self.k = [k.index_select(0, rows) for k in self.k]
+        self.v = [v.index_select(0, rows) for v in self.v]
+        self.pad = self.pad.index_select(0, rows)
+        self.next_pos = self.next_pos.index_select(0, rows)
+
+    def row(self, i: int) -> "KVCache":
+        # i번째 row만 복사한 cache (batch에서 잠시 빠지는 row 보관용)
+        out = KVCache(len(self.k))
+        out.k, out.v, out.pad, out.next_pos = self.k, self.v, self.pad, self.next_pos
+        out.select(torch.tensor([i], dtype=torch.long, device=self.pad.device))
+        return out
+
+    @staticmethod
+    def concat(caches) -> "KVCache":
+        """
+        여러 cache를 batch 방향으로 이어 붙임 (row 순서 유지)
+        길이가 다르면 오른쪽을 PAD 칸으로 채우고 pad mask로 가림 (next_pos는 row별로 그대로)
+        """
+        if len(caches) == 1:
+            return caches[0]
+        L = max(len(c) for c in caches)
+        out = KVCache(len(caches[0].k))
+        out.k = [torch.cat([_pad_right(c.k[i], L, 2, 0) for c in caches]) for i in range(len(out.k))]
+        out.v = [torch.cat([_pad_right(c.v[i], L, 2, 0) for c in caches]) for i in range(len(out.v))]
+        out.pad = torch.cat([_pad_right(c.pad, L, 1, True) for c in caches])
+        out.next_pos = torch.cat([c.next_pos for c in caches])
+        return out
+
+
 class MelodyModel(nn.Module):
     """
     Decoder-only
@@ -72,7 +134,8 @@ class MelodyModel(nn.Module):
         # i 현재 토큰 j 참조 토큰 → (i < j) True
         return torch.triu(torch.ones((L, L), dtype=torch.bool, device=device), diagonal=1)
 
-    def forward(self, x:torch.Tensor, pad_id:int=None, attn_override=None):
+    def forward(self, x:torch.Tensor, pad_id:int=None, attn_override=None, positions=None):
+        # positions: [B, L] 위치 idx (packing 학습에서 곡마다 0부터 다시 매길 때, 기본은 0..L-1)
         if pad_id is None:
             pad_id = self.pad_id
 
@@ -80,7 +143,7 @@ class MelodyModel(nn.Module):
         B, L = x.shape
         
         h = self.tok(x) # [B, L, D]
-        h = self.pos(h) # [B, L, D]
+        h = self.pos(h, positions) # [B, L, D]
 
         # PAD 위치 mask
         key_padding_mask = (x == pad_id) if pad_id is not None else None
@@ -97,4 +160,103 @@ class MelodyModel(nn.Module):
             src_key_padding_mask=key_padding_mask
             ) # [B, L, D]
         logits = self.head(self.ln(y)) # [B, L, V]
-        return logits
\ No newline at end of file
+        return logits
+
+    # ----- incremental decoding (KV cache) -----
+
+    def new_cache(self) -> KVCache:
+        return KVCache(len(self.enc.layers))
+
+    def forward_cached(self, x: torch.Tensor, cache: KVCache, pad_id: int = None, positions=None,
+                       timings: dict = None):
+        """
+        forward()와 같은 logits을 내지만, 이전 토큰들의 key/value는 cache에서 재사용하고
+        새로 들어온 토큰 x: [B, T]만 계산 (처음 호출 시 prefix 전체, 이후 보통 T=1)
+        cache는 in-place로 갱신됨
+        positions: [B, T] 지정하지 않으면 cache.next_pos부터 이어서 부여
+        timings: dict를 넘기면 self-attention에 걸린 시간(초)을 timings["attention"]에 더함 (metrics용)
+        """
+        if pad_id is None:
+            pad_id = self.pad_id
+
+        B, T = x.shape
+        P = len(cache) # 캐시에 들어있는 과거 토큰 수
+
+        if positions is None:
+            step = torch.arange(T, device=x.device).unsqueeze(0) # [1, T]
+            if cache.next_pos is None:
+                positions = step.expand(B, T)
+            else:
+                positions = cache.next_pos.unsqueeze(1) + step # [B, T]
+
+        pad = (x == pad_id) if pad_id is not None else torch.zeros_like(x, dtype=torch.bool)
+        cache.pad = pad if cache.pad is None else torch.cat([cache.pad, pad], dim=1) # [B, P+T]
+        cache.next_pos = positions[:, -1] + 1
+
+        # 새 토큰 t는 과거 전체 + 자기 자신까지 참조 (True = 참조 가능)
+        causal = ~torch.triu(torch.ones((T, P + T), dtype=torch.bool, device=x.device), diagonal=P + 1)
+        # PAD query도 자기 자신은 참조하게 해서 NaN이 생기지 않도록 함 (PAD key는 다른 토큰이 보지 않음)
+        itself = torch.zeros((T, P + T), dtype=torch.bool, device=x.device)
+        itself[:, P:] = torch.eye(T, dtype=torch.bool, device=x.device)
+        allowed = causal.unsqueeze(0) & (~cache.pad.unsqueeze(1) | itself.unsqueeze(0)) # [B, T, P+T]
+        allowed = allowed.unsqueeze(1) # [B, 1, T, P+T] head 방향 브로드캐스팅
+
+        h = self.tok(x) # [B, T, D]
+        h = self.pos(h, positions) # [B, T, D]
+
+        attn_sec = 0.0
+        for i, layer in enumerate(self.enc.layers):
+            if timings is not None:
+                start = time.perf_counter()
+            if layer.norm_first:
+                a = self._attn_cached(layer, layer.norm1(h), i, cache, allowed)
+            else:
+                a = self._attn_cached(layer, h, i, cache, allowed)
+            if timings is not None:
+                attn_sec += time.perf_counter() - start
+            if layer.norm_first:
+                h = h + a
+                h = h + self._ffn(layer, layer.norm2(h))
+            else:
+                h = layer.norm1(h + a)
+                h = layer.norm2(h + self._ffn(layer, h))
+        if timings is not None:
+            timings["attention"] = timings.get("attention", 0.0) + attn_sec
+
+        if self.enc.norm is not None:
+            h = self.enc.norm(h)
+
+        logits = self.head(self.ln(h)) # [B, T, V]
+        return logits
+
+    def _attn_cached(self, layer, h, i, cache: KVCache, allowed):
+        attn = layer.self_attn
+        B, T, D = h.shape
+        H = attn.num_heads
+        Dh = D // H
+
+        # quantize.py로 변환한 모델은 in_proj를 (양자화된) Linear 모듈로 가짐
+        in_proj = getattr(attn, "in_proj", None)
+        if in_proj is not None:
+            qkv = in_proj(h)
+        else:
+            qkv = F.linear(h, attn.in_proj_weight, attn.in_proj_bias)
+        q, k, v = qkv.chunk(3, dim=-1)
+        q = q.view(B, T, H, Dh).transpose(1, 2) # [B, H, T, Dh]
+        k = k.view(B, T, H, Dh).transpose(1, 2)
+        v = v.view(B, T, H, Dh).transpose(1, 2)
+
+        if cache.k[i] is not None:
+            k = torch.cat([cache.k[i], k], dim=2) # [B, H, P+T, Dh]
+            v = torch.cat([cache.v[i], v], dim=2)
+        cache.k[i] = k
+        cache.v[i] = v
+
+        scores = torch.matmul(q, k.transpose(-2, -1)) / math.sqrt(Dh) # [B, H, T, P+T]
+        scores = scores.masked_fill(~allowed, float("-inf"))
+        out = torch.matmul(torch.softmax(scores, dim=-1), v) # [B, H, T, Dh]
+        out = out.transpose(1, 2).reshape(B, T, D)
+        return attn.out_proj(out)
+
+    def _ffn(self, layer, h):
+        return layer.linear2(layer.dropout(layer.activation(layer.linear1(h))))
\ No newline at end of file
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+
+import torch
+
+from model import KVCache
+
+
+class _Entry:
+    def __init__(self, k, v, pad, logits):
+        self.k = k           # layer별 [1, H, L, Dh]
+        self.v = v
+        self.pad = pad       # [1, L]
+        self.logits = logits # [1, V] 마지막 prefix 토큰 위치의 logits
+
+    def nbytes(self) -> int:
+        return sum(t.numel() * t.element_size() for t in self.k + self.v) + self.logits.numel() * 4
+
+
+class PrefixStateCache:
+    """
+    prefix(조건 토큰) → 모델 KV cache 상태 + 첫 토큰 logits (LRU)
+    build_prefix_tokens가 낼 수 있는 prefix는 수십 개뿐이므로, 한 번 계산한 prefix는
+    다음 job부터 transformer를 다시 돌리지 않고 첫 생성 토큰부터 바로 디코딩
+    - forward_cached는 캐시 텐서를 in-place로 바꾸지 않으므로(torch.cat / index_select) 복사 없이 공유
+    - 항목은 batch 1로 계산해 두므로 결과가 같은 batch의 다른 job과 무관 (int8 동적 양자화 포함)
+    """
+    def __init__(self, model, pad_id: int, max_entries: int = 256):
+        self.model = model
+        self.pad_id = pad_id
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # tuple(ids) → _Entry
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(e.nbytes() for e in self._entries.values())
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @torch.no_grad()
+    def _compute(self, ids: List[int]) -> _Entry:
+        dev = next(self.model.parameters()).device
+        cache = self.model.new_cache()
+        x = torch.tensor(ids, dtype=torch.long, device=dev).unsqueeze(0)
+        logits = self.model.forward_cached(x, cache, pad_id=self.pad_id)[:, -1, :]
+        return _Entry(cache.k, cache.v, cache.pad, logits)
+
+    def entry(self, ids: List[int]) -> _Entry:
+        key = tuple(ids)
+        entry = self._get(key)
+        if entry is None:
+            entry = self._compute(ids)
+            self._put(key, entry)
+        return entry
+
+    def prefill(self, ids: List[int]):
+        """ids 한 개 → (KVCache [1, ...], logits [1, V])"""
+        entry = self.entry(ids)
+        cache = self.model.new_cache()
+        cache.k = list(entry.k)
+        cache.v = list(entry.v)
+        cache.pad = entry.pad
+        cache.next_pos = torch.tensor([len(ids)], dtype=torch.long, device=entry.pad.device)
+        return cache, entry.logits
+
+    def prefill_batch(self, seqs: List[List[int]]):
+        """
+        여러 prefix → 하나의 batch KVCache (GenerationEngine._prefill과 같은 형태)
+        길이가 다르면 오른쪽을 PAD 칸으로 채우고 pad mask로 가림
+        """
+        caches, logits = zip(*(self.prefill(s) for s in seqs))
+        return KVCache.concat(list(caches)), torch.cat(logits, dim=0)
+
+    def warm(self, prefixes: List[List[int]]) -> dict:
+        """시작 시 prefix 상태를 미리 계산 (이미 있는 것은 건너뜀)"""
+        start = time.time()
+        added = 0
+        for ids in prefixes:
+            key = tuple(ids)
+            with self._lock:
+                if key in self._entries:
+                    continue
+            self._put(key, self._compute(ids))
+            added += 1
+        return {"prefixes": added, "entries": len(self), "sec": round(time.time() - start, 2),
+                "mbytes": round(self.nbytes() / (1024 * 1024), 1)}
+
+
+def prefill(model, ids: List[int], pad_id: int, prefix_cache: PrefixStateCache = None):
+    """
+    컨텍스트 ids를 새 KVCache에 채우고 (cache, 마지막 위치 logits [1, V]) 반환
+    prefix_cache가 있으면 같은 ids의 상태를 재사용
+    """
+    if prefix_cache is not None:
+        return prefix_cache.prefill(ids)
+    dev = next(model.parameters()).device
+    cache = model.new_cache()
+    x = torch.tensor(ids, dtype=torch.long, device=dev).unsqueeze(0)
+    return cache, model.forward_cached(x, cache, pad_id=pad_id)[:, -1, :]
@@ -0,0 +1,191 @@
+"""
+job 단위 프로파일링 (opt-in: 요청 헤더 또는 일부 job만 샘플링)
+- torch.profiler: 연산자별 CPU 시간 (nn.TransformerEncoder의 matmul / top-p 정렬 등)
+  → torch_trace.json.gz (Perfetto / chrome://tracing), torch_ops.txt (연산자별 self 시간, folded 형식)
+- Python stack sampler: job 스레드의 stack을 interval마다 기록
+  → python_stacks.txt (folded stack, 정규식/문자열 처리나 fluidsynth subprocess 대기도 보임)
+- folded stack은 flamegraph.pl / speedscope에서 바로 열 수 있음
+- 결과는 profiles/<시각>-<이름>/ 에 저장하고 오래된 것부터 지워 개수 / 용량을 제한
+- torch profiler는 프로세스에 하나만 켤 수 있으므로 같은 프로세스에서 동시에 하나의 job만 프로파일링
+  (이미 진행 중이면 이번 job은 그냥 실행)
+"""
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+import torch
+
+_active = threading.Lock()
+
+
+def sampled(rate: float) -> bool:
+    """rate 비율의 job만 True (0이면 항상 False)"""
+    return rate > 0 and random.random() < rate
+
+
+def _frame_name(code) -> str:
+    # folded stack 형식에서 ';'는 구분자이므로 이름에 쓰지 않음
+    parts = code.co_filename.replace("\\", "/").split("/")
+    return f"{code.co_name} ({'/'.join(parts[-2:])}:{code.co_firstlineno})".replace(";", ":")
+
+
+class StackSampler:
+    """대상 스레드의 Python stack을 interval초마다 기록 (folded stack 횟수)"""
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _torch_profiler():
+    # with_stack은 job 하나에 수백 MB의 trace를 만들므로 끔 (Python 쪽 stack은 StackSampler가 담당)
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    return torch.profiler.profile(activities=activities)
+
+
+def _write_op_stacks(events, path: str):
+    """torch 연산자별 self CPU 시간(us)을 folded stack 형식으로 (연산자 이름 한 단계)"""
+    with open(path, "w", encoding="utf-8") as f:
+        for evt in events:
+            us = int(evt.self_cpu_time_total)
+            if us > 0:
+                f.write(f"{evt.key.replace(';', ':')} {us}\n")
+
+
+def prune(root: str, keep: int, max_bytes: int):
+    """profiles 폴더에서 오래된 결과부터 삭제 (개수 keep개, 전체 max_bytes 이하)"""
+    try:
+        entries = [os.path.join(root, d) for d in os.listdir(root) if not d.startswith(".")]
+    except OSError:
+        return
+    entries = [d for d in entries if os.path.isdir(d)]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    total = 0
+    for i, path in enumerate(entries):
+        size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        total += size
+        if i >= keep or total > max_bytes:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class JobProfiler:
+    """
+    with JobProfiler(...) as prof: 블록 안(현재 스레드)의 실행을 프로파일링
+    블록이 끝나면(예외 포함) background에서 prof.path에 결과 저장 (몇 초 뒤에 생김)
+    다른 job을 프로파일링 / 저장 중이면 prof.enabled=False로 그냥 실행
+    """
+    def __init__(self, root: str, name: str, interval: float = 0.005, keep: int = 20,
+                 max_bytes: int = 200 * 1024 * 1024):
+        self.root = root
+        self.name = name
+        self.interval = interval
+        self.keep = keep
+        self.max_bytes = max_bytes
+        self.enabled = False
+        self.path = None
+        self._torch = None
+        self._sampler = None
+        self._start = None
+
+    def __enter__(self):
+        if not _active.acquire(blocking=False):
+            print(f"Profiler: another job is being profiled, running {self.name} without profiling")
+            return self
+        self.enabled = True
+        try:
+            self._torch = _torch_profiler()
+            self._torch.__enter__()
+        except Exception as e:
+            print(f"Profiler: torch profiler unavailable ({e})")
+            self._torch = None
+        # sampler는 torch profiler 시작 / 종료 사이에만 돌려서 profiler 자체의 준비 시간은 제외
+        self._start = time.perf_counter()
+        self._sampler = StackSampler(threading.get_ident(), self.interval).start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return False
+        try:
+            elapsed = time.perf_counter() - self._start
+            self._sampler.stop()
+            if self._torch is not None:
+                self._torch.__exit__(None, None, None)
+            # 이벤트 집계 / trace 저장은 수 초가 걸리므로 job 완료를 막지 않도록 background에서
+            # (끝날 때까지 이 프로세스의 다음 프로파일링은 건너뜀)
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.name}"
+            self.path = os.path.join(self.root, name)
+            threading.Thread(target=self._write, args=(name, elapsed, exc), name="profile-writer",
+                             daemon=True).start()
+        except Exception:
+            print(f"Profiler: failed to stop profiling {self.name}")
+            traceback.print_exc()
+            _active.release()
+        return False
+
+    def _write(self, name: str, elapsed: float, exc):
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            # 다 쓴 뒤에 이름을 바꿔서 공개 (도중에 읽거나 prune하지 않도록 '.'으로 시작하는 임시 폴더)
+            tmp = os.path.join(self.root, f".{name}.tmp")
+            os.makedirs(tmp, exist_ok=True)
+
+            self._sampler.write(os.path.join(tmp, "python_stacks.txt"))
+            lines = [f"job: {self.name}", f"wall_sec: {elapsed:.3f}",
+                     f"python_samples: {self._sampler.samples} (interval {self.interval * 1000:.1f}ms)"]
+            if exc is not None:
+                lines.append(f"error: {type(exc).__name__}: {exc}")
+            if self._torch is not None:
+                events = self._torch.key_averages()
+                _write_op_stacks(events, os.path.join(tmp, "torch_ops.txt"))
+                lines += ["", events.table(sort_by="self_cpu_time_total", row_limit=40)]
+                self._torch.export_chrome_trace(os.path.join(tmp, "torch_trace.json.gz"))
+            with open(os.path.join(tmp, "summary.txt"), "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+
+            os.replace(tmp, self.path)
+            prune(self.root, self.keep, self.max_bytes)
+            print(f"Profiler: wrote {self.path}")
+        except Exception:
+            print(f"Profiler: failed to write profile for {self.name}")
+            traceback.print_exc()
+        finally:
+            self._torch = None
+            _active.release()
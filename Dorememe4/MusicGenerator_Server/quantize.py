@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import time
+import warnings
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+QUANT_MODES = ("fp32", "int8", "bf16")
+
+
+class BF16Linear(nn.Module):
+    """bf16 가중치 Linear (입력은 bf16으로 계산 후 원래 dtype으로 되돌림)"""
+    def __init__(self, in_features: int, out_features: int, bias: bool = True):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.weight = nn.Parameter(torch.empty(out_features, in_features, dtype=torch.bfloat16),
+                                   requires_grad=False)
+        self.bias = nn.Parameter(torch.empty(out_features, dtype=torch.bfloat16),
+                                 requires_grad=False) if bias else None
+
+    @classmethod
+    def from_float(cls, lin: nn.Linear):
+        mod = cls(lin.in_features, lin.out_features, lin.bias is not None)
+        mod.weight.data.copy_(lin.weight.detach())
+        if lin.bias is not None:
+            mod.bias.data.copy_(lin.bias.detach())
+        return mod
+
+    def forward(self, x):
+        return F.linear(x.to(torch.bfloat16), self.weight, self.bias).to(x.dtype)
+
+
+def _dynamic_linear():
+    # torch.ao 양자화 모듈 (import 시 경고가 나오는 버전이 있어 필요할 때만 import)
+    import torch.ao.nn.quantized.dynamic as nnqd
+    return nnqd.Linear
+
+
+def _targets(model):
+    """
+    양자화 대상 Linear: (부모 module, attribute 이름)
+    attention in/out projection, FFN linear1/linear2, 출력 head
+    in_proj_weight는 Parameter라서 forward_cached가 쓰는 in_proj Linear로 옮김
+    """
+    out = []
+    for layer in model.enc.layers:
+        attn = layer.self_attn
+        if getattr(attn, "in_proj", None) is None:
+            w = attn.in_proj_weight
+            lin = nn.Linear(w.size(1), w.size(0), bias=attn.in_proj_bias is not None)
+            lin.weight = w
+            if attn.in_proj_bias is not None:
+                lin.bias = attn.in_proj_bias
+            attn.in_proj = lin
+            # nn.MultiheadAttention.forward가 아니라 forward_cached 경로만 사용하므로 원본은 제거
+            attn.in_proj_weight = None
+            attn.in_proj_bias = None
+        out += [(attn, "in_proj"), (attn, "out_proj"), (layer, "linear1"), (layer, "linear2")]
+    out.append((model, "head"))
+    return out
+
+
+def _convert(lin: nn.Linear, mode: str):
+    if mode == "bf16":
+        return BF16Linear.from_float(lin)
+    qlin = _dynamic_linear()
+    lin.qconfig = torch.ao.quantization.per_channel_dynamic_qconfig
+    return qlin.from_float(lin)
+
+
+def _empty(lin: nn.Linear, mode: str):
+    # 캐시된 state_dict를 읽기 위한 빈 모듈 (가중치 변환 계산 없음)
+    bias = lin.bias is not None
+    if mode == "bf16":
+        return BF16Linear(lin.in_features, lin.out_features, bias)
+    return _dynamic_linear()(lin.in_features, lin.out_features, bias_=bias, dtype=torch.qint8)
+
+
+def quantize_model(model, mode: str = "int8", convert: bool = True):
+    """
+    MelodyModel의 Linear들을 int8(dynamic) / bf16으로 바꿈 (in-place, CPU 추론 전용)
+    변환 후에는 forward_cached 경로만 사용 가능 (forward()는 학습용 fp32 모델에서만 사용)
+    convert=False면 구조만 바꿈 (load_state_dict로 변환된 가중치를 읽을 때)
+    """
+    if mode not in QUANT_MODES:
+        raise ValueError(f"unknown quant mode: {mode}")
+    if mode == "fp32":
+        return model
+
+    model.eval()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for parent, name in _targets(model):
+            lin = getattr(parent, name)
+            setattr(parent, name, _convert(lin, mode) if convert else _empty(lin, mode))
+    model.quant = mode
+    return model
+
+
+def quantized_path(ckpt_path: str, mode: str) -> str:
+    # melModel_tf.pt → melModel_tf.int8.pt
+    root, ext = os.path.splitext(ckpt_path)
+    return f"{root}.{mode}{ext}"
+
+
+def save_quantized(model, path: str, source_hash: str):
+    # 여러 worker가 동시에 저장해도 깨지지 않도록 임시 파일에 쓰고 교체
+    tmp = f"{path}.{os.getpid()}.tmp"
+    torch.save({"model": model.state_dict(), "quant": model.quant, "source": source_hash}, tmp)
+    os.replace(tmp, path)
+
+
+def load_quantized_state(model, path: str, mode: str, source_hash: str) -> bool:
+    """캐시가 같은 체크포인트에서 만든 것이면 읽고 True, 아니면 False"""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            ckpt = torch.load(path, map_location="cpu", weights_only=False)
+    except (OSError, RuntimeError, EOFError):
+        return False
+    if ckpt.get("quant") != mode or ckpt.get("source") != source_hash:
+        return False
+    quantize_model(model, mode, convert=False)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        model.load_state_dict(ckpt["model"], strict=True)
+    return True
+
+
+# ----- 정확도 / 속도 확인 -----
+
+@torch.no_grad()
+def _next_token_logprobs(model, ids, pad_id):
+    cache = model.new_cache()
+    x = torch.tensor(ids, dtype=torch.long).unsqueeze(0)
+    return torch.log_softmax(model.forward_cached(x, cache, pad_id=pad_id)[0].float(), dim=-1) # [L, V]
+
+
+def check_accuracy(ref_model, q_model, sequences, pad_id, block_size: int = 384) -> dict:
+    """
+    같은 시퀀스(teacher forcing)에서 위치마다 다음 토큰 분포 비교
+    - top1_agreement: argmax 토큰이 같은 비율
+    - kl_mean / kl_max: KL(fp32 || 양자화) 위치 평균 / 최대 (nats)
+    """
+    agree, total, kl_sum, kl_max = 0, 0, 0.0, 0.0
+    for ids in sequences:
+        ids = ids[:block_size]
+        ref = _next_token_logprobs(ref_model, ids, pad_id)
+        q = _next_token_logprobs(q_model, ids, pad_id)
+        agree += int((ref.argmax(-1) == q.argmax(-1)).sum())
+        total += ref.size(0)
+        kl = (ref.exp() * (ref - q)).sum(-1)
+        kl_sum += float(kl.sum())
+        kl_max = max(kl_max, float(kl.max()))
+    return {
+        "positions": total,
+        "top1_agreement": agree / max(1, total),
+        "kl_mean": kl_sum / max(1, total),
+        "kl_max": kl_max,
+    }
+
+
+@torch.no_grad()
+def tokens_per_sec(model, prefix_ids, steps: int = 200, pad_id: int = 0) -> float:
+    # KV cache로 한 토큰씩 디코딩하는 속도 (greedy)
+    cache = model.new_cache()
+    x = torch.tensor(prefix_ids, dtype=torch.long).unsqueeze(0)
+    logits = model.forward_cached(x, cache, pad_id=pad_id)
+    start = time.time()
+    for _ in range(steps):
+        nid = logits[:, -1].argmax(-1, keepdim=True)
+        logits = model.forward_cached(nid, cache, pad_id=pad_id)
+    return steps / (time.time() - start)
+
+
+def read_prompts(tok_path: str, n: int):
+    seqs = []
+    with open(tok_path, "r", encoding="utf-8") as f:
+        for ln in f:
+            if ln.strip():
+                seqs.append(json.loads(ln)["tokens"])
+            if len(seqs) >= n:
+                break
+    return seqs
+
+
+if __name__ == "__main__":
+    from load_model import build_model, load_inference_model
+    from data import MelodyVocab
+
+    class Cfg:
+        def __init__(self, quant):
+            self.block_size = 384
+            self.hidden_size = 384
+            self.num_heads = 6
+            self.num_layers = 8
+            self.ffn_hidden_size = 4 * self.hidden_size
+            self.dropout = 0.1
+            self.quant = quant
+
+    ap = argparse.ArgumentParser(description="양자화 모델 정확도 / 속도 확인")
+    ap.add_argument("--ckpt", default="./melModel_tf.pt")
+    ap.add_argument("--voc", default="./melody_voc.json")
+    ap.add_argument("--tok", default="./melody_tok.jsonl")
+    ap.add_argument("--mode", default="int8", choices=QUANT_MODES)
+    ap.add_argument("--prompts", type=int, default=32)
+    ap.add_argument("--steps", type=int, default=200)
+    args = ap.parse_args()
+
+    vocab = MelodyVocab(args.voc)
+    ref = build_model(args.ckpt, vocab, Cfg("fp32"), "cpu")
+    q_model, _ = load_inference_model(args.ckpt, args.voc, Cfg(args.mode), "cpu")
+
+    report = check_accuracy(ref, q_model, read_prompts(args.tok, args.prompts), vocab.PAD_ID, vocab.block_size)
+    prefix = read_prompts(args.tok, 1)[0][:9]
+    report["fp32_tokens_per_sec"] = tokens_per_sec(ref, prefix, args.steps, vocab.PAD_ID)
+    report[f"{args.mode}_tokens_per_sec"] = tokens_per_sec(q_model, prefix, args.steps, vocab.PAD_ID)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+_file_hashes = {}
+
+def checkpoint_hash(path: str) -> str:
+    """체크포인트 파일 sha256 (프로세스마다 한 번만 계산)"""
+    key = os.path.abspath(path)
+    st = os.stat(key)
+    memo = _file_hashes.get(key)
+    if memo is not None and memo[0] == (st.st_size, st.st_mtime):
+        return memo[1]
+
+    h = hashlib.sha256()
+    with open(key, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    _file_hashes[key] = ((st.st_size, st.st_mtime), h.hexdigest())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    생성 결과(토큰 + 렌더링된 WAV) 디스크 캐시
+    - key: prefix 토큰, target_sec, seed, 샘플링 파라미터, 체크포인트 hash로 만든 sha256
+    - 항목 하나 = 디렉터리 하나 (meta.json + WAV 파일들), 여러 프로세스가 함께 사용 가능
+    - LRU: 적중할 때마다 meta.json의 mtime을 갱신하고, 용량/개수를 넘으면 오래된 항목부터 삭제
+    """
+    def __init__(self, root: str, max_bytes: int = 512 * 1024 * 1024, max_entries: int = 2000):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def make_key(prefix_tokens, target_sec, seed, temperature, top_p, model_hash, **params) -> str:
+        payload = {
+            "prefix": list(prefix_tokens),
+            "target_sec": float(target_sec),
+            "seed": int(seed),
+            "temperature": float(temperature),
+            "top_p": float(top_p),
+            "model": model_hash,
+        }
+        payload.update(params)
+        raw = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def get(self, key: str):
+        """적중 시 {'tokens', 'files': {이름: 경로}, ...} 반환, 없으면 None"""
+        meta_path = os.path.join(self._entry_dir(key), "meta.json")
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            os.utime(meta_path) # LRU 갱신
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        files = {name: os.path.join(self._entry_dir(key), fn) for name, fn in meta["files"].items()}
+        if not all(os.path.exists(p) for p in files.values()):
+            return None # 삭제 중인 항목
+        meta["files"] = files
+        return meta
+
+    def put(self, key: str, tokens, files: dict, **extra):
+        """files: {이름: 원본 경로} 복사해서 저장"""
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        try:
+            stored = {}
+            for name, src in files.items():
+                fn = f"{name}{os.path.splitext(src)[1]}"
+                shutil.copyfile(src, os.path.join(tmp, fn))
+                stored[name] = fn
+
+            meta = {"tokens": list(tokens), "files": stored, "created": time.time()}
+            meta.update(extra)
+            with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+
+            # 디렉터리 rename으로 원자적 반영 (다른 프로세스가 먼저 넣었으면 그대로 둠)
+            try:
+                os.rename(tmp, self._entry_dir(key))
+                tmp = None
+            except OSError:
+                pass
+        finally:
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(e.stat().st_size for e in os.scandir(path))
+                last_used = os.stat(os.path.join(path, "meta.json")).st_mtime
+            except FileNotFoundError:
+                continue
+            entries.append((last_used, size, path))
+            total += size
+
+        entries.sort() # 오래 사용하지 않은 것부터
+        while entries and (total > self.max_bytes or len(entries) > self.max_entries):
+            _, size, path = entries.pop(0)
+            # rename 후 삭제해서 읽는 쪽이 반쯤 지워진 항목을 보지 않도록 함
+            trash = os.path.join(self.root, f".del-{uuid.uuid4().hex}")
+            try:
+                os.rename(path, trash)
+            except OSError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+            total -= size
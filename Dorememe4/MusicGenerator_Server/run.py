@@ -35,6 +35,7 @@ class Cfg:
         self.steps = 3000
         self.print_every = 100
         self.save_every = 1000
+        self.quant = "fp32" # 추론 가중치: fp32 / int8 / bf16 (CPU 전용, quantize.py)
 
 cfg = Cfg()
 
@@ -0,0 +1,149 @@
+import threading
+from typing import List, Optional, Sequence, Union
+
+import torch
+
+Scalar = Union[float, int, Sequence]
+
+
+def _per_row(value, B: int, default=None) -> list:
+    # 스칼라면 모든 row에 같은 값, 리스트면 row별 값
+    if value is None:
+        return [default] * B
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value] * B
+
+
+class BatchSampler:
+    """
+    [B, V] logits에서 row마다 다음 토큰 하나를 뽑는 top-k / top-p(nucleus) / temperature 샘플러
+    - EOS 금지, top-k, top-p를 정렬 한 번으로 처리하고 row 사이 Python 루프 없이 계산
+    - 정렬/누적합/mask용 버퍼는 미리 잡아 두고 재사용 (batch가 커지면 그때만 다시 할당)
+    - 같은 torch.Generator로 기존 torch.multinomial 샘플링과 같은 토큰을 뽑음 (test_sampler.py)
+      (multinomial(probs, 1)은 내부적으로 argmax(probs / Exp(1))이므로 row별 generator로 같은 난수를 씀)
+    """
+    def __init__(self, vocab_size: int, eos_id: Optional[int] = None, max_batch: int = 8, device="cpu"):
+        self.vocab_size = vocab_size
+        self.eos_id = eos_id
+        self.device = torch.device(device)
+        self._alloc(max_batch)
+
+    def _alloc(self, B: int):
+        V = self.vocab_size
+        dev = self.device
+        self.max_batch = B
+        self._vals = torch.empty(B, V, device=dev)
+        self._idx = torch.empty(B, V, dtype=torch.long, device=dev)
+        self._cum = torch.empty(B, V, device=dev)
+        self._excl = torch.empty(B, V, device=dev)
+        self._keep_sorted = torch.empty(B, V, dtype=torch.bool, device=dev)
+        self._keep = torch.empty(B, V, dtype=torch.bool, device=dev)
+        self._noise = torch.empty(B, V, device=dev)
+        self._rank = torch.arange(V, device=dev).unsqueeze(0)
+
+    def sample(self,
+               logits: torch.Tensor,
+               temperature: Scalar = 1.0,
+               top_p: Scalar = 1.0,
+               top_k: Scalar = 0,
+               forbid_eos=None,
+               limit=None,
+               generators=None,
+               allowed: Optional[torch.Tensor] = None) -> List[int]:
+        """
+        logits: [B, V]
+        temperature / top_p / top_k: 스칼라 또는 row별 리스트 (top_k <= 0이면 사용 안 함)
+        forbid_eos / limit: row별 bool 리스트 (limit은 fallback 시 EOS 허용 여부)
+        generators: row별 torch.Generator 리스트
+        allowed: [B, V] bool, False인 토큰은 샘플링하지 않음 (grammar.MelodyGrammar mask)
+        """
+        B, V = logits.shape
+        dev = logits.device
+        if B > self.max_batch or dev != self.device:
+            self.device = dev
+            self._alloc(max(B, self.max_batch))
+        if logits.dtype != self._vals.dtype:
+            logits = logits.to(self._vals.dtype)
+
+        temps = _per_row(temperature, B, 1.0)
+        ps = _per_row(top_p, B, 1.0)
+        ks = _per_row(top_k, B, 0)
+        forbid = _per_row(forbid_eos, B, False)
+        limits = _per_row(limit, B, False)
+        gens = _per_row(generators, B, None)
+
+        temp_t = torch.tensor([max(1e-6, t) for t in temps], dtype=logits.dtype, device=dev).unsqueeze(1)
+        p_t = torch.tensor(ps, dtype=logits.dtype, device=dev).unsqueeze(1)
+        k_t = torch.tensor([k if k and k > 0 else V for k in ks], device=dev).unsqueeze(1)
+
+        logits = logits / temp_t
+        if allowed is not None:
+            # 문법상 올 수 없는 토큰은 fallback에서도 제외
+            logits = logits.masked_fill(~allowed, float("-inf"))
+        base_logits = logits
+        masked = logits.clone()
+
+        # 목표 마디 도달 전 EOS 금지
+        eos_id = self.eos_id
+        if eos_id is not None and any(forbid):
+            masked[:, eos_id].masked_fill_(torch.tensor(forbid, device=dev), float("-inf"))
+
+        vals, idx = self._vals[:B], self._idx[:B]
+        torch.sort(masked, dim=-1, descending=True, out=(vals, idx))
+
+        # Nucleus: 누적 확률이 top_p를 처음 넘는 토큰까지 포함
+        # → 자기 앞까지의 누적합(exclusive cumsum)이 top_p 이하인 토큰만 남김 (첫 토큰은 항상 포함)
+        cum, excl = self._cum[:B], self._excl[:B]
+        torch.cumsum(torch.softmax(vals, dim=-1), dim=-1, out=cum)
+        excl[:, 0] = 0
+        excl[:, 1:] = cum[:, :-1]
+
+        keep_sorted = self._keep_sorted[:B]
+        torch.le(excl, p_t, out=keep_sorted)
+        keep_sorted &= self._rank < k_t # top-k
+        keep_sorted[:, 0] = True
+
+        keep = self._keep[:B]
+        keep.scatter_(1, idx, keep_sorted)
+        masked.masked_fill_(~keep, float("-inf"))
+
+        # 모든 로짓이 -inf가 되는 예외 상황 (Fallback)
+        dead = torch.isneginf(masked).all(dim=-1, keepdim=True)
+        fallback = base_logits
+        if eos_id is not None and not all(limits):
+            fallback = base_logits.clone()
+            fallback[:, eos_id].masked_fill_(~torch.tensor(limits, device=dev), float("-inf"))
+        masked = torch.where(dead, fallback, masked)
+
+        # 최종 확률 분포
+        probs = torch.softmax(masked, dim=-1)
+
+        # NaN/Inf가 있거나 확률 합이 0인 row는 가장 높은 로짓을 강제 선택 (난수 사용 안 함)
+        bad = (~torch.isfinite(probs).all(dim=-1)) | (probs.sum(dim=-1) <= 0)
+        bad_rows = bad.tolist() if bool(bad.any()) else [False] * B
+
+        noise = self._noise[:B]
+        for i in range(B):
+            if bad_rows[i]:
+                noise[i].fill_(1.0)
+            else:
+                noise[i].exponential_(generator=gens[i])
+        picked = torch.argmax(probs / noise, dim=-1)
+        if any(bad_rows):
+            picked = torch.where(bad, torch.argmax(masked, dim=-1), picked)
+        return picked.tolist()
+
+
+_local = threading.local()
+
+def get_sampler(vocab_size: int, eos_id: Optional[int], device="cpu") -> BatchSampler:
+    """스레드마다 vocab / device별로 하나씩 재사용 (버퍼를 스레드끼리 공유하지 않음)"""
+    samplers = getattr(_local, "samplers", None)
+    if samplers is None:
+        samplers = _local.samplers = {}
+    key = (vocab_size, eos_id, str(device))
+    sampler = samplers.get(key)
+    if sampler is None:
+        sampler = samplers[key] = BatchSampler(vocab_size, eos_id, max_batch=1, device=device)
+    return sampler
@@ -0,0 +1,102 @@
+"""
+운영용 비동기 HTTP 서버 (aiohttp)
+- 요청 처리 중 blocking 작업(CSV 파싱, 캐시/job 저장소 접근)은 스레드 풀에서 실행하고
+  모델 연산은 worker 풀(app.start_worker_tier)로 넘김 → 이벤트 루프는 막히지 않음
+- WAV 다운로드는 FileResponse(sendfile, HTTP Range / HEAD 지원)로 전송
+- SSE / long-poll 상태 엔드포인트(events.py)도 같은 서버에서 제공
+실행: python server.py  (Flask 개발 서버 대신 사용, 같은 포트 5000)
+"""
+import asyncio
+import multiprocessing
+import os
+
+from aiohttp import web
+
+import app as service # 설정 / 요청 처리 로직 / worker 풀은 Flask 앱과 공유
+from events import add_event_routes
+from sketch_csv import MAX_CSV_BYTES
+
+
+HOST = os.environ.get("MUSICGEN_HOST", "0.0.0.0")
+PORT = int(os.environ.get("MUSICGEN_PORT", 5000))
+# 업로드는 스케치 CSV뿐이므로 같은 제한 사용 (Content-Length 없는 chunked body도 이 크기에서 413)
+MAX_UPLOAD_BYTES = MAX_CSV_BYTES
+
+
+async def _blocking(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+async def upload_data(request):
+    too_large = service.check_upload_size(request.content_length)
+    if too_large is not None:
+        body, status = too_large
+        return web.json_response(body, status=status)
+    file_data = await request.read()
+    body, status = await _blocking(service.start_generation, request.headers.get("X-File-Name"), file_data,
+                                   service.wants_profile(request.headers.get("X-Profile")))
+    return web.json_response(body, status=status)
+
+
+async def post_session(request):
+    body, status = await _blocking(service.create_session)
+    return web.json_response(body, status=status)
+
+
+async def post_session_strokes(request):
+    too_large = service.check_upload_size(request.content_length)
+    if too_large is not None:
+        body, status = too_large
+        return web.json_response(body, status=status)
+    file_data = await request.read()
+    body, status = await _blocking(service.add_session_strokes, request.match_info["session_id"], file_data)
+    return web.json_response(body, status=status)
+
+
+async def remove_session(request):
+    body, status = await _blocking(service.delete_session, request.match_info["session_id"])
+    return web.json_response(body, status=status)
+
+
+async def get_job_status(request):
+    body, status = await _blocking(service.job_status, request.match_info["job_id"])
+    return web.json_response(body, status=status)
+
+
+async def get_job_segments(request):
+    body, status = await _blocking(service.job_segments, request.match_info["job_id"])
+    return web.json_response(body, status=status)
+
+
+async def get_metrics(request):
+    # Prometheus text format 0.0.4
+    return web.Response(text=await _blocking(service.metrics_text), content_type="text/plain")
+
+
+async def download_music(request):
+    # music 폴더 밖의 경로는 거부 (send_from_directory와 같은 동작)
+    root = os.path.realpath(service.OUTPUT_FOLDER)
+    path = os.path.realpath(os.path.join(root, request.match_info["filename"]))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        raise web.HTTPNotFound()
+    return web.FileResponse(path, chunk_size=256 * 1024)
+
+
+def create_app() -> web.Application:
+    web_app = web.Application(client_max_size=MAX_UPLOAD_BYTES)
+    web_app.router.add_post("/api/upload_data", upload_data)
+    web_app.router.add_post("/api/session", post_session)
+    web_app.router.add_post("/api/session/{session_id}/strokes", post_session_strokes)
+    web_app.router.add_delete("/api/session/{session_id}", remove_session)
+    web_app.router.add_get("/api/status/{job_id}", get_job_status)
+    web_app.router.add_get("/api/segments/{job_id}", get_job_segments)
+    web_app.router.add_get("/metrics", get_metrics)
+    web_app.router.add_get("/music/{filename:.+}", download_music)
+    add_event_routes(web_app, service.job_status_db)
+    return web_app
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    service.start_worker_tier()
+    web.run_app(create_app(), host=HOST, port=PORT, access_log=None)
@@ -0,0 +1,177 @@
+"""
+업로드된 스케치 CSV(Unity ExportCSV)를 메모리에서 바로 파싱
+- 임시 파일 / pandas DataFrame 없이 요청 body(bytes)를 한 줄씩 읽음
+- UTF-8 BOM이 붙은 헤더 처리
+- session_to_prefix에 필요한 열만 typed array(numpy)로 반환
+- 크기 / 행 수 제한은 파싱 전에(또는 도중에) 바로 검사
+"""
+import csv
+import io
+import math
+import os
+from array import array
+
+import numpy as np
+
+MAX_CSV_BYTES = int(os.environ.get("MUSICGEN_MAX_CSV_KB", 1024)) * 1024 # 업로드 CSV 최대 크기
+MAX_ROWS = int(os.environ.get("MUSICGEN_MAX_CSV_ROWS", 20000))         # 최대 stroke 행 수
+
+# session_to_prefix가 쓰는 열 → dtype
+INT_COLUMNS = ("StrokeIndex", "Count", "TotalUndoCount")
+FLOAT_COLUMNS = (
+    "ColorR", "ColorG", "ColorB",
+    "Start_X", "Start_Y", "Start_Z",
+    "End_X", "End_Y", "End_Z",
+)
+COLUMNS = INT_COLUMNS + FLOAT_COLUMNS
+INT_MIN, INT_MAX = -2**31, 2**31 - 1 # 정수 열은 int32로 반환
+
+
+class SketchCSVError(ValueError):
+    """형식이 잘못된 스케치 CSV"""
+
+
+class SketchCSVTooLarge(SketchCSVError):
+    """크기 / 행 수 제한 초과 (HTTP 413)"""
+
+
+class SketchTable:
+    """
+    파싱된 스케치 (열 이름 → 1차원 numpy 배열, 행 순서는 CSV 그대로)
+    table["Count"]처럼 DataFrame 열과 같은 이름으로 접근
+    """
+    def __init__(self, columns: dict):
+        self.columns = columns
+        self.n_rows = len(columns[COLUMNS[0]])
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.columns.values())
+
+
+def check_size(n_bytes, max_bytes: int = MAX_CSV_BYTES):
+    """Content-Length 등 body를 읽기 전에 크기만으로 거를 때 사용"""
+    if n_bytes is not None and n_bytes > max_bytes:
+        raise SketchCSVTooLarge(f"CSV is too large ({n_bytes} bytes > {max_bytes}).")
+
+
+def _parse_int(text: str) -> int:
+    try:
+        v = int(text)
+    except ValueError:
+        # "3.0"처럼 정수 값을 float 표기로 쓴 경우만 허용
+        f = float(text)
+        if not f.is_integer():
+            raise
+        v = int(f)
+    if not INT_MIN <= v <= INT_MAX:
+        raise ValueError(f"integer out of range {text!r}")
+    return v
+
+
+def _parse_float(text: str) -> float:
+    v = float(text)
+    if not math.isfinite(v):
+        raise ValueError(f"non-finite value {text!r}")
+    return v
+
+
+def parse_sketch_csv(data, max_bytes: int = MAX_CSV_BYTES, max_rows: int = MAX_ROWS) -> SketchTable:
+    """
+    스케치 CSV bytes → SketchTable
+    필요한 열이 없거나 값이 숫자가 아니면 SketchCSVError, 제한 초과면 SketchCSVTooLarge
+    """
+    check_size(len(data), max_bytes)
+    if not data:
+        raise SketchCSVError("CSV is empty.")
+
+    # utf-8-sig: 앞의 BOM(EF BB BF)을 떼고 읽음, bytes 복사 없이 한 줄씩 decode
+    text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    try:
+        header = next(reader, None)
+        if header is None:
+            raise SketchCSVError("CSV is empty.")
+        header = [h.strip() for h in header]
+        missing = [c for c in COLUMNS if c not in header]
+        if missing:
+            raise SketchCSVError(f"CSV is missing columns: {', '.join(missing)}")
+        n_fields = len(header)
+        index = {c: header.index(c) for c in COLUMNS}
+        int_cols = [(index[c], array("q")) for c in INT_COLUMNS]
+        float_cols = [(index[c], array("d")) for c in FLOAT_COLUMNS]
+
+        for row in reader:
+            if not row or (len(row) == 1 and not row[0].strip()):
+                continue # 빈 줄
+            line = reader.line_num
+            if len(float_cols[0][1]) >= max_rows:
+                raise SketchCSVTooLarge(f"CSV has too many rows (> {max_rows}).")
+            if len(row) != n_fields:
+                raise SketchCSVError(f"line {line}: expected {n_fields} fields, got {len(row)}")
+            try:
+                for i, out in int_cols:
+                    out.append(_parse_int(row[i]))
+                for i, out in float_cols:
+                    out.append(_parse_float(row[i]))
+            except (ValueError, OverflowError) as e:
+                raise SketchCSVError(f"line {line}: {e}") from None
+    except UnicodeDecodeError:
+        raise SketchCSVError("CSV is not valid UTF-8.") from None
+    except csv.Error as e:
+        raise SketchCSVError(f"line {reader.line_num}: {e}") from None
+    finally:
+        text.detach()
+
+    columns = {}
+    for (_, out), name in zip(int_cols, INT_COLUMNS):
+        columns[name] = np.frombuffer(out, dtype=np.int64).astype(np.int32)
+    for (_, out), name in zip(float_cols, FLOAT_COLUMNS):
+        columns[name] = np.frombuffer(out, dtype=np.float64)
+    if len(columns[COLUMNS[0]]) == 0:
+        raise SketchCSVError("CSV has no stroke rows.")
+    return SketchTable(columns)
+
+
+def to_frame(table: SketchTable):
+    """기존 DataFrame 기반 코드(features_to_prefix.session_to_prefix)에 넘길 때"""
+    import pandas as pd
+    return pd.DataFrame(table.columns)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    ap = argparse.ArgumentParser(description="스케치 CSV 파싱 확인 (pandas.read_csv와 비교)")
+    ap.add_argument("paths", nargs="+")
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    import pandas as pd
+    for path in args.paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        table = parse_sketch_csv(data)
+        df = pd.read_csv(io.BytesIO(data))
+        df.columns = [c.lstrip("﻿") for c in df.columns]
+        same = all(np.array_equal(table[c], df[c].to_numpy(dtype=table[c].dtype)) for c in COLUMNS)
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            parse_sketch_csv(data)
+        ours = (time.perf_counter() - start) / args.repeat
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            pd.read_csv(io.BytesIO(data))
+        theirs = (time.perf_counter() - start) / args.repeat
+        print(f"{path}: rows={len(table)} same_as_pandas={same} "
+              f"parse={ours * 1e6:.0f}us pandas={theirs * 1e6:.0f}us")
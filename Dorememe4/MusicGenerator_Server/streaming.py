@@ -0,0 +1,194 @@
+import io
+import os
+import time
+import wave
+from typing import List, Optional
+
+import miditoolkit
+
+from generate import tokens_to_midi_obj, parse_bpm, bars_to_seconds
+from synth import midi_to_wav_bytes
+
+
+class SegmentRenderer:
+    """
+    마디 단위로 들어오는 토큰 조각(stream_until_seconds / GenerationEngine.stream)을
+    순서대로 이어 재생할 수 있는 WAV segment들로 렌더링
+
+    - 새 segment 구간(직전 segment 끝 ~ 마지막 완성 마디 끝)에서 소리가 나는 음만 합성해서 잘라 저장
+      (segment 시작 전 tail_sec 안에 끝난 음의 잔향과 앞 마디에서 이어지는 음은 처음부터 함께 합성)
+      → 마디마다 합성하는 길이가 곡 길이와 무관, 곡 전체는 finish()에서 한 번만 합성
+    - preview(1st): 생성된 마디(BAR)가 preview_bars개 이상이 되는 순간까지의 segment를 이어 붙인 것
+      → 최종 곡의 앞부분과 같은 음악
+    """
+    def __init__(self, out_dir: str, name: str, sf2_path: str, prefix_tokens: List[str],
+                 beats_per_bar: int = 4, bars_per_segment: int = 1, preview_bars: int = 4,
+                 tail_sec: float = 2.0):
+        self.out_dir = out_dir
+        self.name = name
+        self.sf2_path = sf2_path
+        self.bpm = parse_bpm(prefix_tokens, default=120)
+        self.beats_per_bar = beats_per_bar
+        self.bars_per_segment = bars_per_segment
+        self.preview_bars = preview_bars
+        self.tail_sec = tail_sec
+
+        self.tokens = []
+        self.segments = [] # [{'file', 'start_sec', 'duration_sec'}]
+        self.preview_file = None
+        self._rendered_bars = 0 # segment로 저장이 끝난 마디 수 (0번 마디 포함)
+        self._preview_pcm = []  # preview를 만들기 전까지의 segment (WAV params, frames)
+        # 누적 시간(초, metrics용): 토큰 → MIDI / MIDI → WAV 합성 / WAV 파일 쓰기
+        self.midi_sec = 0.0
+        self.synth_sec = 0.0
+        self.write_sec = 0.0
+        os.makedirs(out_dir, exist_ok=True)
+
+    def bar_count(self) -> int:
+        return sum(1 for t in self.tokens if t == "BAR")
+
+    def add(self, chunk: List[str]) -> Optional[dict]:
+        """완성된 마디 조각 추가, 새 segment가 만들어지면 그 정보를 반환"""
+        self.tokens.extend(chunk)
+        # tokens_to_midi는 첫 BAR에서 1번 마디가 시작 → BAR n개면 0..n번 마디까지 완성
+        bars = self.bar_count() + 1
+        if bars - self._rendered_bars < self.bars_per_segment:
+            return None
+        return self._render_until(bars)
+
+    def finish(self, final_wav_name: str) -> str:
+        """생성이 끝난 뒤 전체 곡을 렌더링하고 남은 구간을 마지막 segment로 저장"""
+        final_path = os.path.join(self.out_dir, final_wav_name)
+        wav_bytes, _ = self._render()
+        self._write(final_wav_name, wav_bytes)
+        self._cut_segment(wav_bytes, self._segment_start(), None)
+        self._rendered_bars = self.bar_count() + 1
+        if self.preview_file is None:
+            # 곡이 preview 길이보다 짧으면 최종 곡을 preview로 사용
+            self.preview_file = f"{self.name}_1st.wav"
+            self._write(self.preview_file, wav_bytes)
+        return final_path
+
+    def state(self) -> dict:
+        """다른 프로세스에서 이어서 렌더링하기 위한 상태 (JSON으로 보낼 수 있는 값, 토큰 제외)"""
+        return {"segments": list(self.segments), "preview_file": self.preview_file,
+                "rendered_bars": self._rendered_bars}
+
+    def restore(self, state: dict):
+        """
+        state()에서 이어서 렌더링 (segment 번호 / 시작 시간이 이어짐)
+        토큰은 비운 채로 시작: 이어서 생성한 stream의 첫 조각에 지금까지의 토큰이 모두 들어 있음
+        """
+        self.tokens = []
+        self.segments = list(state["segments"])
+        self.preview_file = state["preview_file"]
+        self._rendered_bars = state["rendered_bars"]
+        return self
+
+    # ----- 내부 -----
+
+    def _segment_start(self) -> float:
+        return bars_to_seconds(self._rendered_bars, self.bpm, self.beats_per_bar)
+
+    def _render(self, from_sec: float = 0.0):
+        """
+        from_sec 이후에 소리가 나는 음만 합성 → (WAV bytes, WAV 시작이 곡에서 몇 초인지)
+        from_sec - tail_sec 이후에 끝나는 음은 모두 원래 시작부터 합성
+        """
+        start = time.perf_counter()
+        midi = tokens_to_midi_obj(self.tokens)
+        offset = 0.0
+        if from_sec > 0:
+            midi, offset = _window(midi, from_sec - self.tail_sec)
+        mid = time.perf_counter()
+        wav_bytes = midi_to_wav_bytes(midi, self.sf2_path)
+        self.midi_sec += mid - start
+        self.synth_sec += time.perf_counter() - mid
+        return wav_bytes, offset
+
+    def _write(self, filename: str, data: bytes):
+        start = time.perf_counter()
+        with open(os.path.join(self.out_dir, filename), "wb") as f:
+            f.write(data)
+        self.write_sec += time.perf_counter() - start
+
+    def _render_until(self, bars: int) -> dict:
+        start_sec = self._segment_start()
+        wav_bytes, offset = self._render(start_sec)
+
+        end_sec = bars_to_seconds(bars, self.bpm, self.beats_per_bar)
+        seg = self._cut_segment(wav_bytes, start_sec, end_sec, offset)
+        self._rendered_bars = bars
+
+        if self.preview_file is None and self.bar_count() >= self.preview_bars:
+            self.preview_file = f"{self.name}_1st.wav"
+            self._write_preview()
+        return seg
+
+    def _write_preview(self):
+        # 지금까지의 segment를 이어 붙여 preview로 저장 (다시 합성하지 않음)
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as dst:
+            dst.setparams(self._preview_pcm[0][0])
+            for _, frames in self._preview_pcm:
+                dst.writeframes(frames)
+        self._preview_pcm = []
+        self._write(self.preview_file, buf.getvalue())
+
+    def _cut_segment(self, wav_bytes: bytes, start_sec: float, end_sec: Optional[float],
+                     offset: float = 0.0) -> Optional[dict]:
+        # offset: wav_bytes의 시작이 곡에서 몇 초인지 (start_sec / end_sec는 곡 기준)
+        with wave.open(io.BytesIO(wav_bytes), "rb") as src:
+            params = src.getparams()
+            sr = src.getframerate()
+            start = int(round((start_sec - offset) * sr))
+            end = src.getnframes() if end_sec is None else int(round((end_sec - offset) * sr))
+            if end <= start:
+                return None
+            src.setpos(min(start, src.getnframes()))
+            frames = src.readframes(max(0, end - start))
+
+        # 렌더링이 마디 끝보다 짧으면 무음으로 채워 segment 길이를 마디 경계에 맞춤
+        frame_bytes = params.sampwidth * params.nchannels
+        need = (end - start) * frame_bytes - len(frames)
+        if need > 0:
+            frames += b"\x00" * need
+
+        seg_file = f"{self.name}_seg{len(self.segments):03d}.wav"
+        write_start = time.perf_counter()
+        with wave.open(os.path.join(self.out_dir, seg_file), "wb") as dst:
+            dst.setparams(params)
+            dst.writeframes(frames)
+        self.write_sec += time.perf_counter() - write_start
+        if self.preview_file is None:
+            self._preview_pcm.append((params, frames))
+
+        seg = {
+            "file": seg_file,
+            "start_sec": round(start_sec, 3),
+            "duration_sec": round((end - start) / sr, 3),
+        }
+        self.segments.append(seg)
+        return seg
+
+
+def _window(midi, from_sec: float):
+    """
+    from_sec 이후에 끝나는 음만 남기고 그중 가장 이른 시작(없으면 from_sec)을 0으로 당긴 MIDI
+    → (MIDI, 당긴 시간(초)), tokens_to_midi_obj와 같이 tempo는 하나
+    """
+    tpq = midi.ticks_per_beat
+    sec_per_tick = 60.0 / (midi.tempo_changes[0].tempo * tpq)
+    cut = max(0, int(from_sec / sec_per_tick))
+    out = miditoolkit.MidiFile()
+    out.ticks_per_beat = tpq
+    out.tempo_changes = [miditoolkit.TempoChange(midi.tempo_changes[0].tempo, time=0)]
+
+    notes = [(inst, [n for n in inst.notes if n.end > cut]) for inst in midi.instruments]
+    shift = min([cut] + [n.start for _, kept in notes for n in kept])
+    for inst, kept in notes:
+        new = miditoolkit.Instrument(program=inst.program, is_drum=inst.is_drum, name=inst.name)
+        new.notes = [miditoolkit.Note(velocity=n.velocity, pitch=n.pitch, start=n.start - shift, end=n.end - shift)
+                     for n in kept]
+        out.instruments.append(new)
+    return out, shift * sec_per_tick
@@ -0,0 +1,135 @@
+import io
+import os
+import tempfile
+import threading
+import wave
+
+import numpy as np
+
+from midi2wav import midi_to_wav
+
+try:
+    import fluidsynth # pyfluidsynth (libfluidsynth 필요)
+except ImportError:
+    fluidsynth = None
+
+
+def _tick_to_sec(midi):
+    """tempo 변화를 반영해 tick → 초 변환 함수 생성"""
+    tpq = midi.ticks_per_beat
+    # (시작 tick, 시작 초, 초/tick), tempo 정보가 없으면 120 BPM
+    table = [(0, 0.0, 60.0 / (120 * tpq))]
+    for tc in sorted(midi.tempo_changes, key=lambda t: t.time):
+        start_tick, start_sec, spt = table[-1]
+        table.append((tc.time, start_sec + (tc.time - start_tick) * spt, 60.0 / (tc.tempo * tpq)))
+
+    def convert(tick):
+        for start_tick, start_sec, spt in reversed(table):
+            if tick >= start_tick:
+                return start_sec + (tick - start_tick) * spt
+        return 0.0
+    return convert
+
+
+def pcm_to_wav_bytes(pcm: np.ndarray, sample_rate: int) -> bytes:
+    # pcm: [N, 2] int16 → WAV 파일 bytes
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(pcm.shape[1])
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(np.ascontiguousarray(pcm, dtype="<i2").tobytes())
+    return buf.getvalue()
+
+
+class SoundFontSynth:
+    """
+    SoundFont를 한 번만 로드해 두고 miditoolkit.MidiFile을 프로세스 안에서 바로 PCM으로 합성
+    (임시 .mid 파일 / fluidsynth 프로세스 실행 없음)
+    fluidsynth CLI(-ni -F)와 같이 마지막 이벤트 시점까지 렌더링
+    """
+    def __init__(self, sf2_path: str, sample_rate: int = 32000, gain: float = 0.2):
+        if fluidsynth is None:
+            raise RuntimeError("pyfluidsynth is not available")
+        self.sample_rate = sample_rate
+        self._fs = fluidsynth.Synth(gain=gain, samplerate=float(sample_rate))
+        self._sfid = self._fs.sfload(str(sf2_path))
+        if self._sfid == -1:
+            raise FileNotFoundError(sf2_path)
+        self._lock = threading.Lock()
+
+    def render(self, midi, tail_sec: float = 0.0) -> np.ndarray:
+        """midi → [N, 2] int16 PCM"""
+        to_sec = _tick_to_sec(midi)
+        sr = self.sample_rate
+
+        # (sample 위치, 0=note off / 1=note on, channel, pitch, velocity)
+        events = []
+        programs = {}
+        for i, inst in enumerate(midi.instruments):
+            # 9번 채널은 드럼 전용이므로 건너뜀
+            chan = 9 if inst.is_drum else (i if i < 9 else i + 1) % 16
+            programs[chan] = (128 if inst.is_drum else 0, inst.program)
+            for n in inst.notes:
+                events.append((int(round(to_sec(n.start) * sr)), 1, chan, n.pitch, n.velocity))
+                events.append((int(round(to_sec(n.end) * sr)), 0, chan, n.pitch, 0))
+        # 같은 시점이면 note off를 먼저 처리 (같은 음 재타건)
+        events.sort(key=lambda e: (e[0], e[1]))
+
+        chunks = []
+        with self._lock:
+            self._fs.system_reset()
+            for chan, (bank, program) in programs.items():
+                self._fs.program_select(chan, self._sfid, bank, program)
+
+            pos = 0
+            for at, on, chan, pitch, vel in events:
+                if at > pos:
+                    chunks.append(self._fs.get_samples(at - pos))
+                    pos = at
+                if on:
+                    self._fs.noteon(chan, pitch, vel)
+                else:
+                    self._fs.noteoff(chan, pitch)
+
+            tail = int(round(tail_sec * sr))
+            if tail > 0:
+                chunks.append(self._fs.get_samples(tail))
+
+        if not chunks:
+            return np.zeros((0, 2), dtype=np.int16)
+        return np.concatenate(chunks).astype(np.int16).reshape(-1, 2)
+
+    def render_wav_bytes(self, midi, tail_sec: float = 0.0) -> bytes:
+        return pcm_to_wav_bytes(self.render(midi, tail_sec), self.sample_rate)
+
+
+_synths = {}
+_synths_lock = threading.Lock()
+
+def get_synth(sf2_path: str, sample_rate: int = 32000):
+    """프로세스마다 SoundFont별로 하나씩 재사용, 사용할 수 없으면 None"""
+    key = (os.path.abspath(sf2_path), sample_rate)
+    with _synths_lock:
+        if key not in _synths:
+            try:
+                _synths[key] = SoundFontSynth(sf2_path, sample_rate)
+            except Exception as e:
+                print(f"Synth: in-process synthesis unavailable, using fluidsynth CLI ({e})")
+                _synths[key] = None
+        return _synths[key]
+
+
+def midi_to_wav_bytes(midi, sf2_path: str, sample_rate: int = 32000) -> bytes:
+    """메모리 상의 MidiFile → WAV bytes (pyfluidsynth가 없으면 기존 CLI 경로로 대체)"""
+    synth = get_synth(sf2_path, sample_rate)
+    if synth is not None:
+        return synth.render_wav_bytes(midi)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        midi_path = os.path.join(tmp, "render.mid")
+        wav_path = os.path.join(tmp, "render.wav")
+        midi.dump(midi_path)
+        midi_to_wav(midi_path, wav_path, sf2_path, sample_rate)
+        with open(wav_path, "rb") as f:
+            return f.read()
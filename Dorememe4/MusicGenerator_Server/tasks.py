@@ -0,0 +1,156 @@
+"""
+Celery 작업 큐: worker_pool.py(한 머신 안의 프로세스 풀) 대신 worker를 여러 프로세스 / 여러 머신으로 늘릴 때
+MUSICGEN_TASK_BACKEND=celery로 HTTP 서버(server.py / app.py)를 띄우면 job을 이 큐로 보냄 (HTTP API는 같음)
+- job 하나 = generate_preview → generate_final
+  preview: 앞 PREVIEW_BARS 마디만 생성해 1차 음악 공개, 멈춘 곳의 토큰 + 난수 상태를 final task로 넘김
+  final: 그 상태에서 이어서 생성 → 나머지 segment / 최종 WAV
+  (fp32는 한 번에 생성한 곡과 같음, int8은 batch 엔진처럼 연산 순서 차이로 조금 달라질 수 있음)
+- 큐를 나눠서 새 job의 preview가 쌓여 있는 final 뒤에서 기다리지 않음
+  파일 시스템 broker(기본, celery_transport.py)와 redis broker: worker는 preview 큐가 빌 때만 final을 가져옴
+  (이미 실행 중인 final task는 끝날 때까지 기다림)
+  amqp / sqla broker: worker가 두 큐를 번갈아 가져오므로 preview가 먼저 처리되지 않음
+  → '-Q musicgen.preview'로 preview만 처리하는 worker를 따로 띄움 (아래 실행 예의 w0)
+- worker 프로세스는 task를 하나씩만 가져오고(celeryconfig.py) 모델 / prefix 상태 / SoundFont는 처음 한 번만 로드
+  worker 하나 = 모델 하나를 든 프로세스 하나(-P solo), 같은 머신 / 다른 머신에서 worker를 더 띄워서 늘림
+  (prefork -c N도 되지만 파일 시스템 / sqlite broker에서는 celery가 task 사이마다 최대 2초씩 쉼)
+- job 상태는 app의 job 저장소(MUSICGEN_JOB_STORE), WAV는 music 폴더에 쓰므로
+  HTTP 서버와 worker가 같은 저장소 / 폴더를 봐야 함 (sqlite는 같은 머신 또는 공유 폴더)
+- worker의 지표는 HTTP 서버의 /metrics에 합산되지 않음
+실행:
+  MUSICGEN_TASK_BACKEND=celery python server.py
+  MUSICGEN_WORKERS=2 celery -A tasks worker -P solo -Q musicgen.preview,musicgen.final -n w1@%h
+  MUSICGEN_WORKERS=2 celery -A tasks worker -P solo -Q musicgen.preview,musicgen.final -n w2@%h
+  (amqp / sqla broker면 w2 대신: celery -A tasks worker -P solo -Q musicgen.preview -n w0@%h)
+  (MUSICGEN_WORKERS는 그 머신의 worker 수: 프로세스마다 torch 스레드 수를 CPU 코어 / MUSICGEN_WORKERS로 제한)
+"""
+import queue
+import threading
+import time
+
+from celery import Celery
+from celery.signals import worker_process_init
+
+import app as service
+
+celery_app = Celery("musicgen")
+celery_app.config_from_object("celeryconfig")
+
+PREVIEW_QUEUE = "musicgen.preview"
+FINAL_QUEUE = "musicgen.final"
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def _init_worker():
+    """worker 프로세스에서 한 번: job 저장소 연결 + 모델 로드 (엔진 없이 task를 하나씩 처리)"""
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        service.require_shared_job_store()
+        service.initialize_job_db()
+        service.init_worker(service.job_status_db, batch_engine=False)
+        _initialized = True
+
+
+@worker_process_init.connect
+def _preload(**kwargs):
+    # prefork worker: 자식 프로세스가 뜰 때 미리 로드 (solo / threads pool은 첫 task에서)
+    _init_worker()
+
+
+@celery_app.task(name="musicgen.generate_preview")
+def generate_preview(job_id, output_name, prefix_tokens, target_sec, cache_key, submitted_at, profile=False):
+    _init_worker()
+    service.JOB_STAGE_SECONDS.observe(max(0.0, time.time() - submitted_at), "queue_wait")
+    if profile:
+        # 프로파일링 job은 한 task에서 끝까지 (preview / final이 한 profile에 들어가도록)
+        service.process_music_generation(job_id, output_name, prefix_tokens, target_sec,
+                                         service.job_status_db, cache_key=cache_key, profile=True)
+        return
+    resume = service.process_preview(job_id, output_name, prefix_tokens, target_sec,
+                                     service.job_status_db, cache_key=cache_key)
+    if resume is not None:
+        generate_final.delay(job_id, output_name, target_sec, resume, cache_key)
+
+
+@celery_app.task(name="musicgen.generate_final")
+def generate_final(job_id, output_name, target_sec, resume, cache_key):
+    _init_worker()
+    service.process_final(job_id, output_name, target_sec, resume, service.job_status_db, cache_key=cache_key)
+
+
+class CeleryQueue:
+    """
+    HTTP 서버 쪽에서 app.worker_pool(WorkerPool) 대신 사용: 같은 submit / ready_workers / backlog
+    - ready_workers: 최근 stale초 안에 ping에 응답한 worker 수 (solo worker는 task 실행 중에는 응답하지 못함)
+    - backlog: 두 큐에 쌓인 task 수
+      (refresh초마다 broker에 확인, 그 사이에는 submit마다 1씩 더함, 확인할 수 없으면 worker가 있다고 보고 받음)
+    - 쌓인 task가 max_backlog 이상이면 submit에서 queue.Full (→ 429)
+    """
+    def __init__(self, max_backlog: int = 32, refresh: float = 5.0, stale: float = 120.0):
+        self.max_backlog = max_backlog
+        self.refresh = refresh
+        self.stale = stale
+        self._seen = {} # worker 이름 → 마지막 응답 시각
+        self._workers = 0
+        self._backlog = 0
+        self._sent = 0 # 마지막 broker 확인을 시작한 뒤 보낸 task 수
+        self._lock = threading.Lock() # _backlog / _sent (HTTP 요청 스레드들 / monitor 스레드)
+        self._checked = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._check()
+        self._thread = threading.Thread(target=self._loop, name="celery-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def ready_workers(self) -> int:
+        return self._workers
+
+    def backlog(self):
+        return self._backlog
+
+    def submit(self, job):
+        # 확인 / 보내기 / 증가를 한 번에 (동시에 들어온 요청이 함께 max_backlog를 넘지 않도록)
+        with self._lock:
+            if self._backlog >= self.max_backlog:
+                raise queue.Full
+            generate_preview.delay(*job)
+            self._backlog += 1
+            self._sent += 1
+
+    def close(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._stop.wait(self.refresh):
+            self._check()
+
+    def _check(self):
+        try:
+            now = time.time()
+            for reply in celery_app.control.ping(timeout=1.0):
+                for name in reply:
+                    self._seen[name] = now
+            self._seen = {name: t for name, t in self._seen.items() if now - t < self.stale}
+            with self._lock:
+                self._sent = 0
+            with celery_app.connection_for_read() as conn:
+                channel = conn.default_channel
+                depth = sum(channel.queue_declare(q, passive=True).message_count
+                            for q in (PREVIEW_QUEUE, FINAL_QUEUE))
+            self._workers = len(self._seen)
+            with self._lock:
+                # 확인하는 동안 보낸 task는 depth에 빠졌을 수 있으므로 더함 (들어 있었다면 다음 확인까지 조금 많게 셈)
+                self._backlog = depth + self._sent
+        except Exception as e:
+            if not self._checked:
+                print(f"Celery: cannot check workers / queue depth ({e}), accepting jobs")
+            self._workers = max(self._workers, 1)
+        self._checked = True
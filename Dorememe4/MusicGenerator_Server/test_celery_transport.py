@@ -0,0 +1,53 @@
+"""
+celery_transport.py: 파일 시스템 broker에서 preview 큐를 먼저 가져오는지 확인 (python -m pytest test_celery_transport.py)
+"""
+import pytest
+from kombu import Connection, Exchange, Queue
+
+ORDER = ["musicgen.preview", "musicgen.final"]
+
+
+@pytest.fixture(scope="module")
+def control(tmp_path_factory):
+    # exchange 바인딩 파일: kombu가 선언한 exchange를 프로세스 안에서 기억하므로 테스트끼리 같은 폴더 사용
+    return str(tmp_path_factory.mktemp("control"))
+
+
+def _connection(tmp_path, control, transport):
+    options = {"data_folder_in": str(tmp_path), "data_folder_out": str(tmp_path), "control_folder": control}
+    if transport == "celery_transport:Transport":
+        options["queue_order"] = ORDER
+    return Connection("filesystem://localhost//", transport=transport, transport_options=options)
+
+
+def _received(tmp_path, control, transport):
+    exchange = Exchange("musicgen", type="direct")
+    queues = [Queue(name, exchange, routing_key=name) for name in reversed(ORDER)] # final을 먼저 consume
+    received = []
+    with _connection(tmp_path, control, transport) as conn:
+        for q in queues:
+            q(conn).declare()
+        producer = conn.Producer(exchange=exchange)
+        for name in reversed(ORDER): # final이 먼저 쌓여 있음
+            for i in range(3):
+                producer.publish({"n": i}, routing_key=name)
+
+        def on_message(body, message):
+            received.append(message.delivery_info["routing_key"])
+            message.ack()
+
+        with conn.Consumer(queues, callbacks=[on_message], prefetch_count=1):
+            while len(received) < 6:
+                conn.drain_events(timeout=1)
+    return received
+
+
+def test_preview_queue_is_drained_first(tmp_path, control):
+    received = _received(tmp_path, control, "celery_transport:Transport")
+    assert received == ["musicgen.preview"] * 3 + ["musicgen.final"] * 3
+
+
+def test_default_transport_alternates(tmp_path, control):
+    # kombu 기본 filesystem transport는 번갈아 가져옴 (celery_transport가 필요한 이유)
+    received = _received(tmp_path, control, "filesystem")
+    assert received[:2] != ["musicgen.preview"] * 2
@@ -0,0 +1,54 @@
+"""
+GenerationEngine 스케줄링 확인 (python -m pytest test_engine.py)
+작은 무작위 초기화 모델 + 무음 합성으로 실행하므로 체크포인트 / SoundFont 없이 동작
+"""
+import io
+import wave
+
+import torch
+
+import streaming
+from data import MelodyVocab
+from engine import GenerationEngine
+from features_to_prefix import all_prefixes
+from load_model import _new_model
+from streaming import SegmentRenderer
+from train import Cfg
+
+
+def _silent_wav(midi, sf2_path, sample_rate=32000):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+    return buf.getvalue()
+
+
+def test_final_priority_starts_when_preview_is_written(tmp_path, monkeypatch):
+    monkeypatch.setattr(streaming, "midi_to_wav_bytes", _silent_wav)
+    torch.manual_seed(0)
+    vocab = MelodyVocab("melody_voc.json")
+    model = _new_model(vocab, Cfg(hidden_size=64, num_heads=2, num_layers=2, ffn_hidden_size=128)).eval()
+    engine = GenerationEngine(model, vocab, max_batch=1, preview_bars=4).start()
+
+    prefix = all_prefixes(vocab.vocab)[0]
+    renderer = SegmentRenderer(str(tmp_path), "t", "unused.sf2", prefix, preview_bars=4)
+    seen = [] # 마디 조각마다 (preview 파일이 있는지, 엔진이 아직 1차 작업으로 보는지)
+
+    def on_bar(chunk):
+        renderer.add(chunk)
+        seen.append((renderer.preview_file is not None, engine._first_pass(engine._batch[0])))
+
+    try:
+        future = engine.submit(prefix, 30.0, on_bar=on_bar, generator=torch.Generator().manual_seed(1),
+                               constrained=True, long_form=True, max_steps=None)
+        future.result(timeout=300)
+    finally:
+        engine.stop()
+
+    bars = seen[:-1] # 마지막은 생성이 끝난 뒤의 나머지 조각
+    assert any(preview for preview, _ in bars), "song ended before the preview"
+    assert not bars[0][0]
+    # preview가 만들어진 조각부터 바로 최종 렌더링 우선순위
+    assert all(preview != first_pass for preview, first_pass in bars)
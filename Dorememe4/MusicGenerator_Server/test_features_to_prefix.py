@@ -0,0 +1,42 @@
+"""
+numpy 버전 prefix 계산(sketch_to_prefix / sessions_to_prefix)이 pandas 버전 session_to_prefix와
+같은 결과인지 확인 (python -m pytest test_features_to_prefix.py)
+"""
+import glob
+import io
+
+import pandas as pd
+import pytest
+
+from features_to_prefix import build_prefix_tokens, session_to_prefix, sessions_to_prefix, sketch_to_prefix
+from sketch_csv import parse_sketch_csv
+
+SAMPLES = sorted(glob.glob("uploads/*.csv") + glob.glob("ExportCSV/*.csv"))
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return data, pd.read_csv(io.BytesIO(data))
+
+
+@pytest.mark.parametrize("path", SAMPLES)
+def test_sketch_matches_session_to_prefix(path):
+    data, df = _read(path)
+    expected = session_to_prefix(df)
+    assert sketch_to_prefix(parse_sketch_csv(data)) == expected
+    assert sketch_to_prefix(df) == expected
+    assert build_prefix_tokens(sketch_to_prefix(parse_sketch_csv(data))) == build_prefix_tokens(expected)
+
+
+def test_batch_matches_one_by_one():
+    assert SAMPLES
+    samples = [_read(path) for path in SAMPLES]
+    # 같은 스케치가 여러 번, 행 순서가 섞인 스케치도 함께 (StrokeIndex 정렬 / Count 최대값 위치가 달라짐)
+    dfs = [df for _, df in samples]
+    dfs += [df.sample(frac=1.0, random_state=i) for i, df in enumerate(dfs)] + dfs[:1]
+    tables = [parse_sketch_csv(data) for data, _ in samples]
+
+    assert sessions_to_prefix(dfs) == [session_to_prefix(df) for df in dfs]
+    assert sessions_to_prefix(tables) == [session_to_prefix(df) for _, df in samples]
+    assert sessions_to_prefix([]) == []
@@ -0,0 +1,53 @@
+"""
+MelodyGrammar가 학습 코퍼스의 토큰 순서를 모두 허용하는지 확인 (python -m pytest test_grammar.py)
+"""
+import json
+
+import pytest
+
+from data import MelodyVocab
+from grammar import C_META, MelodyGrammar
+
+
+def _corpus():
+    with open("melody_tok.jsonl", "r", encoding="utf-8") as f:
+        return [json.loads(line)["tokens"] for line in f]
+
+
+@pytest.fixture(scope="module")
+def vocab():
+    return MelodyVocab("melody_voc.json")
+
+
+@pytest.mark.parametrize("monotonic_pos", [True, False])
+def test_corpus_sequences_are_allowed(vocab, monotonic_pos):
+    grammar = MelodyGrammar(vocab.itos, monotonic_pos=monotonic_pos)
+    masks = grammar.masks.tolist()
+    checked = 0
+    for n, ids in enumerate(_corpus()):
+        # 예외: 앞쪽 조건 토큰(KEY_ ~ CHR_)은 샘플링하지 않고 build_prefix_tokens가 정하므로
+        # 문법 검사 없이 initial_state로만 반영 (META 다음에는 BAR만 허용)
+        k = 0
+        while k < len(ids) and grammar.token_class[ids[k]] == C_META:
+            k += 1
+        state = grammar.initial_state(ids[:k])
+        for i in range(k, len(ids)):
+            nid = ids[i]
+            assert masks[state][nid], (
+                f"line {n + 1}: {vocab.itos[nid]} not allowed after "
+                f"{' '.join(vocab.itos[t] for t in ids[max(0, i - 8):i])}")
+            state = grammar.step(state, nid)
+            checked += 1
+    assert checked > 600000
+
+
+def test_pos_cannot_go_back_within_a_bar(vocab):
+    grammar = MelodyGrammar(vocab.itos, monotonic_pos=True)
+    ids = [vocab.stoi[t] for t in ["BAR", "POS_8", "NOTE_60", "DUR_1", "VEL_5"]]
+    allowed = grammar.allowed([grammar.initial_state(ids)])[0]
+    assert allowed[vocab.stoi["POS_8"]] and allowed[vocab.stoi["POS_9"]]
+    assert not allowed[vocab.stoi["POS_7"]]
+    assert allowed[vocab.stoi["BAR"]] and allowed[vocab.EOS_ID]
+    # 새 마디에서는 다시 POS_0부터
+    allowed = grammar.allowed([grammar.step(grammar.initial_state(ids), vocab.stoi["BAR"])])[0]
+    assert allowed[vocab.stoi["POS_0"]]
@@ -0,0 +1,164 @@
+"""
+job 저장소 (MemoryJobStore / SQLiteJobStore) 확인 (python -m pytest test_job_store.py)
+"""
+import time
+
+import pytest
+
+import app
+from job_store import MemoryJobStore, SQLiteJobStore, open_job_store
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryJobStore()
+    return SQLiteJobStore(str(tmp_path / "jobs.sqlite"))
+
+
+def _age(store, job_id, sec):
+    # updated_at을 sec초 전으로 (TTL / 오래된 job 확인용)
+    if isinstance(store, MemoryJobStore):
+        store._jobs[job_id][3] -= sec
+    else:
+        store._conn().execute("UPDATE jobs SET updated_at = updated_at - ? WHERE job_id = ?", (sec, job_id))
+
+
+def test_open_job_store(tmp_path):
+    assert isinstance(open_job_store("memory"), MemoryJobStore)
+    assert isinstance(open_job_store(f"sqlite:///{tmp_path / 'a.sqlite'}"), SQLiteJobStore)
+    with pytest.raises(ValueError):
+        open_job_store("redis://localhost")
+
+
+def test_create_get_delete(store):
+    assert store.get("a") is None
+    assert store.get_versioned("a") == (None, None)
+    store.create("a", status="in_progress", message="Starting")
+    assert store.get_versioned("a") == ({"status": "in_progress", "message": "Starting"}, 1)
+    store.delete("a")
+    assert store.get("a") is None
+
+
+@pytest.mark.parametrize("path", [
+    ["1st_ready", "completed"],
+    ["1st_ready", "failed"],
+    ["completed"],
+    ["failed"],
+])
+def test_allowed_transitions(store, path):
+    store.create("a", status="in_progress")
+    for i, status in enumerate(path):
+        assert store.transition("a", status, step=i)
+        data, version = store.get_versioned("a")
+        assert data["status"] == status and data["step"] == i
+        assert version == i + 2
+
+
+@pytest.mark.parametrize("start, path, rejected", [
+    ("in_progress", [], "in_progress"),
+    ("in_progress", ["1st_ready"], "1st_ready"),
+    ("in_progress", ["1st_ready"], "in_progress"),
+    ("in_progress", ["completed"], "failed"),
+    ("in_progress", ["completed"], "1st_ready"),
+    ("in_progress", ["failed"], "completed"),
+    ("completed", [], "failed"),
+])
+def test_rejected_transitions(store, start, path, rejected):
+    store.create("a", status=start)
+    for status in path:
+        assert store.transition("a", status)
+    before = store.get_versioned("a")
+    assert not store.transition("a", rejected, error="late")
+    assert store.get_versioned("a") == before # 필드도 버전도 그대로
+
+
+def test_missing_job(store):
+    assert not store.transition("nope", "completed")
+    assert not store.update("nope", eta=1)
+    assert store.versions(["nope"]) == {}
+
+
+def test_update_bumps_version_and_keeps_status(store):
+    store.create("a", status="in_progress")
+    assert store.update("a", eta=3.0, status="completed") # status는 update로 바뀌지 않음
+    data, version = store.get_versioned("a")
+    assert data == {"status": "in_progress", "eta": 3.0}
+    assert version == 2
+    store.create("b", status="in_progress")
+    assert store.versions(["a", "b", "c"]) == {"a": 2, "b": 1}
+
+
+def test_purge_finished(store):
+    for job_id, status in [("done", "completed"), ("bad", "failed"), ("run", "in_progress"),
+                           ("first", "1st_ready"), ("new", "completed")]:
+        store.create(job_id, status=status)
+    for job_id in ("done", "bad", "run", "first"):
+        _age(store, job_id, 100)
+
+    purged = store.purge_finished(time.time() - 50)
+    assert sorted(job_id for job_id, _ in purged) == ["bad", "done"]
+    assert dict(purged)["done"] == {"status": "completed"}
+    assert store.get("done") is None and store.get("bad") is None
+    # 끝나지 않은 job과 TTL이 지나지 않은 job은 남음
+    assert store.get("run") and store.get("first") and store.get("new")
+
+
+def test_fail_unfinished(store):
+    store.create("mine", owner="h:1:a", status="in_progress")
+    store.create("first", owner="h:1:a", status="1st_ready")
+    store.create("other", owner="h:2:b", status="in_progress")
+    store.create("done", owner="h:1:a", status="completed")
+    store.create("celery", status="in_progress")
+    assert store.owners() == {"h:1:a", "h:2:b"}
+    assert "owner" not in store.get("mine") # 상태 조회 응답에는 들어가지 않음
+
+    assert sorted(store.fail_unfinished(owner="h:1:a", error="gone")) == ["first", "mine"]
+    assert store.get("mine") == {"status": "failed", "error": "gone"}
+    assert store.get_versioned("first")[1] == 2
+    assert store.get("done")["status"] == "completed"
+    assert store.owners() == {"h:2:b"}
+
+    _age(store, "celery", 100)
+    assert store.fail_unfinished(older_than=time.time() - 50) == ["celery"]
+    assert store.get("other")["status"] == "in_progress"
+    # failed가 된 job은 이후 worker가 상태를 바꾸지 못함
+    assert not store.transition("mine", "completed")
+
+
+def test_sqlite_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    a, b = SQLiteJobStore(path), SQLiteJobStore(path)
+    a.create("x", status="in_progress")
+    assert b.transition("x", "1st_ready")
+    assert a.get_versioned("x") == ({"status": "1st_ready"}, 2)
+
+
+def test_cleanup_removes_expired_jobs_and_wavs(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "job_status_db", store)
+    music = tmp_path / "music"
+    music.mkdir()
+    monkeypatch.setattr(app, "OUTPUT_FOLDER", str(music))
+    store.create("old", status="completed")
+    store.create("keep", status="completed")
+    _age(store, "old", app.JOB_TTL_SEC + 10)
+    names = ["song-old_1st.wav", "song-old_seg000.wav", "song-old_final.wav", "song-keep_final.wav"]
+    for name in names:
+        (music / name).write_bytes(b"RIFF")
+
+    assert app.cleanup_expired_jobs() == 1
+    assert store.get("old") is None and store.get("keep") is not None
+    assert sorted(p.name for p in music.iterdir()) == ["song-keep_final.wav"]
+
+
+def test_cleanup_fails_jobs_of_a_stopped_server(store, monkeypatch):
+    monkeypatch.setattr(app, "job_status_db", store)
+    host = app.socket.gethostname()
+    store.create("restarted", owner=f"{host}:{app.os.getpid()}:previous", status="1st_ready")
+    store.create("running", owner=app.JOB_OWNER, status="in_progress")
+    store.create("remote", owner="elsewhere:1:x", status="in_progress")
+
+    app.cleanup_expired_jobs()
+    assert store.get("restarted")["status"] == "failed"
+    assert store.get("running")["status"] == "in_progress"
+    assert store.get("remote")["status"] == "in_progress"
@@ -0,0 +1,99 @@
+"""
+MelodyModel.forward_cached가 forward()와 같은 logits을 내는지 확인 (python -m pytest test_model.py)
+작은 무작위 초기화 모델로 실행하므로 체크포인트 없이 동작
+"""
+import pytest
+import torch
+
+from data import MelodyVocab
+from features_to_prefix import all_prefixes
+from generate import DecodeState, stream_until_seconds
+from load_model import _new_model
+from train import Cfg
+
+# fp32 기본 허용 오차 수준 (logits 크기가 수십이므로 상대 오차도 함께)
+ATOL = 1e-5
+RTOL = 1e-5
+
+
+def _model(vocab, block_size=384):
+    torch.manual_seed(0)
+    cfg = Cfg(hidden_size=64, num_heads=2, num_layers=2, ffn_hidden_size=128, block_size=block_size)
+    return _new_model(vocab, cfg).eval()
+
+
+def _ids(vocab, n, seed=0):
+    # PAD가 아닌 무작위 토큰
+    g = torch.Generator().manual_seed(seed)
+    ids = torch.randint(0, len(vocab.vocab), (1, n), generator=g)
+    return ids.masked_fill(ids == vocab.PAD_ID, vocab.PAD_ID + 1)
+
+
+@torch.no_grad()
+def test_prefill_and_steps_match_forward():
+    vocab = MelodyVocab("melody_voc.json")
+    model = _model(vocab)
+    x = _ids(vocab, 48)
+
+    full = model(x)
+    cache = model.new_cache()
+    prefill = model.forward_cached(x[:, :16], cache)
+    torch.testing.assert_close(prefill, full[:, :16], atol=ATOL, rtol=RTOL)
+
+    for t in range(16, x.size(1)):
+        step = model.forward_cached(x[:, t:t + 1], cache)[:, -1]
+        torch.testing.assert_close(step, full[:, t], atol=ATOL, rtol=RTOL)
+    assert len(cache) == x.size(1)
+
+
+@torch.no_grad()
+def test_batch_with_padded_rows_matches_forward():
+    # 길이가 다른 prefix를 오른쪽 PAD로 맞춘 batch (GenerationEngine과 같은 형태)
+    vocab = MelodyVocab("melody_voc.json")
+    model = _model(vocab)
+    a, b = _ids(vocab, 20, seed=1), _ids(vocab, 12, seed=2)
+    x = torch.cat([a, torch.cat([b, torch.full((1, 8), vocab.PAD_ID)], dim=1)])
+
+    cache = model.new_cache()
+    logits = model.forward_cached(x, cache)
+    torch.testing.assert_close(logits[0], model(a)[0], atol=ATOL, rtol=RTOL)
+    torch.testing.assert_close(logits[1, :12], model(b)[0], atol=ATOL, rtol=RTOL)
+
+    # row마다 자기 다음 위치에서 이어서 디코딩 (GenerationEngine._prefill과 같이 실제 길이로 지정)
+    cache.next_pos = torch.tensor([20, 12])
+    nxt = _ids(vocab, 2, seed=3).view(2, 1)
+    step = model.forward_cached(nxt, cache)[:, -1]
+    torch.testing.assert_close(step[0], model(torch.cat([a, nxt[:1]], dim=1))[0, -1], atol=ATOL, rtol=RTOL)
+    torch.testing.assert_close(step[1], model(torch.cat([b, nxt[1:]], dim=1))[0, -1], atol=ATOL, rtol=RTOL)
+
+
+@torch.no_grad()
+def _reference_tokens(model, vocab, prefix, target_sec, seed, **kwargs):
+    # KV cache 없이 매 스텝 컨텍스트 전체를 forward()로 계산 (캐시 이전 generate_until_seconds와 같은 방식)
+    st = DecodeState(vocab, prefix, target_sec, generator=torch.Generator().manual_seed(seed), **kwargs)
+    ctx = list(st.ids)
+    while st.begin_step():
+        logits = model(torch.tensor([ctx]), pad_id=vocab.PAD_ID)[:, -1, :]
+        nid = st.sample(logits)
+        if st.push(nid):
+            break
+        ctx.append(nid)
+        if st.needs_window(vocab.block_size):
+            ctx = st.window(vocab.block_size)
+    return [vocab.itos[i] for i in st.ids]
+
+
+@pytest.mark.parametrize("long_form", [False, True])
+def test_seeded_tokens_match_full_forward_after_window_trim(long_form):
+    # block_size를 작게 잡아 생성 도중 윈도우가 밀려 캐시를 다시 채우는 경우까지 확인
+    vocab = MelodyVocab("melody_voc.json", block_size=32)
+    model = _model(vocab, block_size=32)
+    prefix = all_prefixes(vocab.vocab)[0]
+    kwargs = dict(constrained=True, long_form=long_form, stride=8, max_steps=120)
+
+    expected = _reference_tokens(model, vocab, prefix, 16.0, seed=7, **kwargs)
+    got = [t for chunk in stream_until_seconds(model, vocab, prefix, 16.0,
+                                               generator=torch.Generator().manual_seed(7), **kwargs)
+           for t in chunk]
+    assert len(got) > 2 * vocab.block_size
+    assert got == expected
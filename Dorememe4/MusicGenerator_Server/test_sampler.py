@@ -0,0 +1,84 @@
+"""
+BatchSampler가 기존 torch.multinomial 샘플링과 같은 토큰을 뽑는지 확인 (python -m pytest test_sampler.py)
+"""
+import pytest
+import torch
+
+from sampler import BatchSampler
+
+V = 64
+EOS_ID = 3
+
+
+def _reference(logits, top_p, temperature=1.0, top_k=0, forbid_eos=False, limit=False, generator=None):
+    # BatchSampler 이전 generate_until_seconds의 샘플링 (logits: [1, V]) + top-k
+    logits = logits / max(1e-6, temperature)
+    base_logits = logits.clone()
+
+    if forbid_eos:
+        logits[:, EOS_ID] = float("-inf")
+
+    sorted_logits, sorted_idx = torch.sort(logits, descending=True)
+    probs = torch.softmax(sorted_logits[0], dim=-1)
+    cum = torch.cumsum(probs, dim=-1)
+    cutoff_idx = (cum > top_p).nonzero(as_tuple=False)
+    cutoff = (int(cutoff_idx[0].item()) + 1) if cutoff_idx.numel() > 0 else probs.size(0)
+    if top_k > 0:
+        cutoff = min(cutoff, top_k)
+    cutoff = max(cutoff, 1)
+
+    keep = torch.zeros_like(logits, dtype=torch.bool)
+    keep.scatter_(1, sorted_idx[:, :cutoff], True)
+    logits = logits.masked_fill(~keep, float("-inf"))
+
+    if torch.isneginf(logits[0]).all():
+        logits = base_logits.clone()
+        if not limit:
+            logits[:, EOS_ID] = float("-inf")
+
+    probs = torch.softmax(logits, dim=-1)
+    if (not torch.isfinite(probs).all()) or (probs.sum() <= 0):
+        return int(torch.argmax(logits[0]).item())
+    return int(torch.multinomial(probs, 1, generator=generator).item())
+
+
+def _logits(steps, B=1, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    return torch.randn(steps, B, V, generator=g) * 3
+
+
+@pytest.mark.parametrize("params", [
+    dict(top_p=0.98),
+    dict(top_p=0.9, temperature=0.7),
+    dict(top_p=1.0, temperature=1.3, top_k=8),
+    dict(top_p=0.5, top_k=3, forbid_eos=True),
+    dict(top_p=0.98, temperature=0.0),
+    dict(top_p=0.0, forbid_eos=True, limit=True),
+])
+def test_matches_multinomial(params):
+    sampler = BatchSampler(V, EOS_ID, max_batch=1)
+    ours, ref = torch.Generator().manual_seed(5), torch.Generator().manual_seed(5)
+    p = dict(params)
+    forbid, limit = p.pop("forbid_eos", False), p.pop("limit", False)
+    for logits in _logits(200):
+        got = sampler.sample(logits, forbid_eos=[forbid], limit=[limit], generators=[ours], **p)[0]
+        assert got == _reference(logits, forbid_eos=forbid, limit=limit, generator=ref, **p)
+
+
+def test_rows_match_their_own_generator():
+    # batch의 row마다 다른 설정 / generator를 써도 각자 단독으로 뽑은 것과 같음
+    rows = [dict(top_p=0.98), dict(top_p=0.8, temperature=0.6, forbid_eos=True),
+            dict(top_p=1.0, top_k=5), dict(top_p=0.95, temperature=1.5)]
+    sampler = BatchSampler(V, EOS_ID, max_batch=2) # batch보다 작게 잡아도 다시 할당
+    ours = [torch.Generator().manual_seed(10 + i) for i in range(len(rows))]
+    refs = [torch.Generator().manual_seed(10 + i) for i in range(len(rows))]
+    for logits in _logits(100, B=len(rows), seed=1):
+        got = sampler.sample(logits,
+                             temperature=[r.get("temperature", 1.0) for r in rows],
+                             top_p=[r["top_p"] for r in rows],
+                             top_k=[r.get("top_k", 0) for r in rows],
+                             forbid_eos=[r.get("forbid_eos", False) for r in rows],
+                             limit=[False] * len(rows),
+                             generators=ours)
+        for i, r in enumerate(rows):
+            assert got[i] == _reference(logits[i:i + 1], generator=refs[i], **r)
@@ -0,0 +1,71 @@
+"""
+스케치 CSV 파싱 확인 (python -m pytest test_sketch_csv.py)
+"""
+import glob
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sketch_csv import COLUMNS, SketchCSVError, SketchCSVTooLarge, parse_sketch_csv
+
+HEADER = "﻿StrokeIndex,ColorR,ColorG,ColorB,Count,Start_X,Start_Y,Start_Z,End_X,End_Y,End_Z,TotalUndoCount\n"
+
+
+def _csv(*rows) -> bytes:
+    return (HEADER + "".join(r + "\n" for r in rows)).encode("utf-8")
+
+
+def _row(index="0", count="1", undo="0", x="1.0"):
+    return f"{index},0,0,1,{count},{x},1,0,1,1,0,{undo}"
+
+
+@pytest.mark.parametrize("path", sorted(glob.glob("uploads/*.csv")))
+def test_sample_uploads_match_pandas(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    table = parse_sketch_csv(data)
+    df = pd.read_csv(io.BytesIO(data))
+    df.columns = [c.lstrip("﻿") for c in df.columns]
+    assert len(table) == len(df)
+    for c in COLUMNS:
+        assert np.array_equal(table[c], df[c].to_numpy(dtype=table[c].dtype)), c
+
+
+def test_int_columns():
+    table = parse_sketch_csv(_csv(_row(count="3.0"), _row(index="1", count="2147483647", undo="-2")))
+    assert table["Count"].dtype == np.int32
+    assert table["Count"].tolist() == [3, 2**31 - 1]
+    assert table["TotalUndoCount"].tolist() == [0, -2]
+
+
+@pytest.mark.parametrize("value", ["3000000000", "2147483648", "-2147483649", "1e12", "99999999999999999999"])
+def test_out_of_range_int_is_rejected(value):
+    # int32로 바꿀 때 음수 등으로 바뀌지 않도록 파싱 단계에서 거름
+    with pytest.raises(SketchCSVError, match="line 3"):
+        parse_sketch_csv(_csv(_row(), _row(index="1", count=value)))
+
+
+@pytest.mark.parametrize("data, message", [
+    (b"", "empty"),
+    (_csv(), "no stroke rows"),
+    (HEADER.replace(",TotalUndoCount", "").encode(), "missing columns: TotalUndoCount"),
+    (_csv(_row(count="1.5")), "line 2"),
+    (_csv(_row(x="nan")), "line 2"),
+    (_csv(_row(x="inf")), "line 2"),
+    (_csv(_row() + ",extra"), "line 2: expected 12 fields"),
+    (HEADER.encode() + b"\xff\xfe\n", "UTF-8"),
+])
+def test_invalid_csv(data, message):
+    with pytest.raises(SketchCSVError, match=message):
+        parse_sketch_csv(data)
+
+
+def test_limits():
+    data = _csv(_row(), _row(index="1"), _row(index="2"))
+    assert len(parse_sketch_csv(data, max_rows=3)) == 3
+    with pytest.raises(SketchCSVTooLarge):
+        parse_sketch_csv(data, max_rows=2)
+    with pytest.raises(SketchCSVTooLarge):
+        parse_sketch_csv(data, max_bytes=len(data) - 1)
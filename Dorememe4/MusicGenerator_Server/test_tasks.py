@@ -0,0 +1,77 @@
+"""
+CeleryQueue(tasks.py) backlog 제한 확인 (python -m pytest test_tasks.py)
+broker 없이 generate_preview.delay를 바꿔서 실행
+"""
+import queue
+import threading
+import time
+
+import pytest
+
+import tasks
+
+
+@pytest.fixture(autouse=True)
+def celery_dir(tmp_path, monkeypatch):
+    # celeryconfig.py가 처음 읽힐 때 만드는 파일 시스템 broker 폴더를 임시 폴더로
+    monkeypatch.setenv("MUSICGEN_CELERY_DIR", str(tmp_path / "celery_data"))
+
+
+def _submit_all(q, n):
+    accepted, rejected = [], []
+
+    def submit(i):
+        try:
+            q.submit((i,))
+            accepted.append(i)
+        except queue.Full:
+            rejected.append(i)
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return accepted, rejected
+
+
+def test_concurrent_submits_respect_max_backlog(monkeypatch):
+    sent = []
+
+    def delay(*job):
+        time.sleep(0.01) # broker에 보내는 동안 다른 요청이 들어옴
+        sent.append(job)
+
+    monkeypatch.setattr(tasks.generate_preview, "delay", delay)
+    q = tasks.CeleryQueue(max_backlog=4)
+    accepted, rejected = _submit_all(q, 16)
+    assert len(accepted) == 4 and len(rejected) == 12
+    assert len(sent) == 4 and q.backlog() == 4
+
+
+def test_check_keeps_tasks_sent_while_checking(monkeypatch):
+    q = tasks.CeleryQueue(max_backlog=8)
+    monkeypatch.setattr(tasks.generate_preview, "delay", lambda *job: None)
+    monkeypatch.setattr(tasks.celery_app.control, "ping", lambda timeout: [{"w1@h": {"ok": "pong"}}])
+
+    class Channel:
+        def queue_declare(self, name, passive):
+            # broker에 묻는 사이에 job 하나가 들어옴 (아직 depth에 없음)
+            if name == tasks.PREVIEW_QUEUE:
+                q.submit(("late",))
+            return type("Declared", (), {"message_count": 1})
+
+    class Connection:
+        default_channel = Channel()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(tasks.celery_app, "connection_for_read", Connection)
+    q.submit(("early",))
+    q._check()
+    assert q.ready_workers() == 1
+    assert q.backlog() == 3 # 두 큐 depth 2 + 확인 중에 보낸 1
@@ -0,0 +1,123 @@
+"""
+sequence packing 학습 데이터 확인 (python -m pytest test_train.py)
+작은 무작위 코퍼스 + 작은 무작위 초기화 모델로 실행
+"""
+import json
+
+import numpy as np
+import pytest
+import torch
+
+from data import MelodyVocab, trim_sequence
+from load_model import _new_model
+from token_corpus import write_corpus
+from train import Cfg, PackedMelodyDataset, document_mask, pack_lengths
+
+BLOCK = 32
+HEADS = 2
+
+
+@pytest.fixture(scope="module")
+def vocab():
+    return MelodyVocab("melody_voc.json", block_size=BLOCK)
+
+
+@pytest.fixture(scope="module")
+def corpus(vocab, tmp_path_factory):
+    # 길이가 다른 곡들 (EOS 뒤 토큰 / block_size보다 긴 곡 / 토큰 1개짜리 곡 포함)
+    rng = np.random.default_rng(0)
+    ids = [i for i in range(len(vocab.vocab)) if i not in (vocab.PAD_ID, vocab.EOS_ID)]
+    seqs = []
+    for n in [3, 5, 9, 14, 20, 27, 31, 40, 7, 12, 1, 6]:
+        seq = [int(t) for t in rng.choice(ids, n)] + [vocab.EOS_ID]
+        if n == 9:
+            seq += [int(t) for t in rng.choice(ids, 5)] # EOS 뒤는 잘림
+        seqs.append(seq)
+    seqs.append([int(rng.choice(ids))]) # 학습 위치가 없는 곡 (제외)
+    path = tmp_path_factory.mktemp("corpus") / "tok.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        for seq in seqs:
+            f.write(json.dumps({"tokens": seq}) + "\n")
+    return str(path), seqs
+
+
+def _docs(vocab, seqs):
+    return [trim_sequence(np.asarray(s), BLOCK + 1, 7, vocab.EOS_ID) for s in seqs]
+
+
+def test_pack_lengths_fits_capacity():
+    lengths = [30, 2, 17, 15, 8, 8, 1, 31, 16]
+    packs = pack_lengths(lengths, 32)
+    assert sorted(i for p in packs for i in p) == list(range(len(lengths)))
+    assert all(sum(lengths[i] for i in p) <= 32 for p in packs)
+    assert len(packs) == 4 # 합계 128 = 32 × 4, 남는 칸 없이 채움
+
+
+def test_packed_samples(vocab, corpus):
+    path, seqs = corpus
+    ds = PackedMelodyDataset(path, vocab, block_size=BLOCK)
+    docs = _docs(vocab, seqs)
+    assert ds.n_docs == len(seqs) - 1
+    seen, tails = [], 0
+    for idx in range(len(ds)):
+        x, y, pos, doc = (t.numpy() for t in ds[idx])
+        c = 0
+        for k, d in enumerate(ds.packs[idx]):
+            seq = docs[d]
+            n = len(seq) - 1
+            # 곡마다 위치가 0부터, 다음 토큰 target은 같은 곡 안에서만
+            assert x[c:c + n].tolist() == seq[:-1].tolist()
+            assert y[c:c + n].tolist() == seq[1:].tolist()
+            assert pos[c:c + n].tolist() == list(range(n))
+            assert (doc[c:c + n] == k).all()
+            seen.append(d)
+            c += n
+        # 남는 칸: x / y는 PAD, 마지막 곡에 붙이고 위치는 이어서
+        assert (x[c:] == vocab.PAD_ID).all() and (y[c:] == vocab.PAD_ID).all()
+        assert (doc[c:] == len(ds.packs[idx]) - 1).all()
+        assert pos[c:].tolist() == list(range(pos[c - 1] + 1, pos[c - 1] + 1 + BLOCK - c))
+        tails += c < BLOCK
+    assert tails > 0
+    assert sorted(seen) == list(range(len(seqs) - 1))
+    assert ds.n_tokens == sum(len(docs[d]) - 1 for d in seen)
+
+
+def test_binary_corpus_packs_the_same(vocab, corpus, tmp_path):
+    path, _ = corpus
+    out = str(tmp_path / "tok.bin")
+    write_corpus(path, out)
+    a, b = PackedMelodyDataset(path, vocab, BLOCK), PackedMelodyDataset(out, vocab, BLOCK)
+    assert a.packs == b.packs
+    for idx in range(len(a)):
+        assert all(torch.equal(s, t) for s, t in zip(a[idx], b[idx]))
+
+
+def test_document_mask_is_block_diagonal_causal():
+    doc = torch.tensor([[0, 0, 0, 1, 1, 2, 2, 2], [0, 0, 0, 0, 0, 0, 1, 1]])
+    mask = document_mask(doc, HEADS)
+    assert mask.shape == (2 * HEADS, 8, 8)
+    for b in range(2):
+        expected = torch.tensor([[not (doc[b, i] == doc[b, j] and j <= i) for j in range(8)] for i in range(8)])
+        for h in range(HEADS):
+            assert torch.equal(mask[b * HEADS + h], expected)
+
+
+@torch.no_grad()
+def test_packed_logits_match_each_document_alone(vocab, corpus):
+    path, seqs = corpus
+    torch.manual_seed(0)
+    cfg = Cfg(hidden_size=64, num_heads=HEADS, num_layers=2, ffn_hidden_size=128, block_size=BLOCK)
+    model = _new_model(vocab, cfg).eval()
+    ds = PackedMelodyDataset(path, vocab, block_size=BLOCK)
+    docs = _docs(vocab, seqs)
+
+    x, _, pos, doc = (torch.stack(t) for t in zip(*(ds[i] for i in range(len(ds)))))
+    logits = model(x, attn_override=document_mask(doc, HEADS), positions=pos)
+    assert torch.isfinite(logits).all()
+    for idx in range(len(ds)):
+        c = 0
+        for d in ds.packs[idx]:
+            seq = torch.from_numpy(docs[d][:-1]).unsqueeze(0)
+            n = seq.size(1)
+            torch.testing.assert_close(logits[idx, c:c + n], model(seq)[0], atol=1e-5, rtol=1e-5)
+            c += n
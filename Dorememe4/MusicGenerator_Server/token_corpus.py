@@ -0,0 +1,115 @@
+"""
+토큰 코퍼스 바이너리 포맷 (melody_tok.jsonl → melody_tok.bin)
+- 헤더 + offsets(int64, 시퀀스 수 + 1) + 모든 토큰을 이어 붙인 배열(uint8 / uint16)
+- np.memmap으로 열어서 필요한 시퀀스만 읽음 → 로드가 즉시 끝나고, 여러 DataLoader worker가
+  같은 파일 페이지(OS page cache)를 공유
+변환: python token_corpus.py melody_tok.jsonl melody_tok.bin
+"""
+import argparse
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b"MELTOK01"
+# magic, 토큰 itemsize(1/2), 예약, 시퀀스 수, 전체 토큰 수
+_HEADER = struct.Struct("<8sIIQQ")
+
+
+def read_jsonl_tokens(tok_path: str):
+    with open(tok_path, "r", encoding="utf-8") as f:
+        for ln in f:
+            if not ln.strip():
+                continue
+            yield json.loads(ln)["tokens"]
+
+
+def write_corpus(tok_path: str, out_path: str) -> dict:
+    """jsonl 코퍼스를 바이너리로 변환 (임시 파일에 쓰고 교체)"""
+    seqs = [np.asarray(ids, dtype=np.int64) for ids in read_jsonl_tokens(tok_path)]
+    lengths = np.array([len(s) for s in seqs], dtype=np.int64)
+    offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    max_id = max((int(s.max()) for s in seqs if len(s)), default=0)
+    if min((int(s.min()) for s in seqs if len(s)), default=0) < 0 or max_id > 0xFFFF:
+        raise ValueError(f"token id out of range for uint16 (max {max_id})")
+    dtype = np.uint8 if max_id <= 0xFF else np.uint16
+    tokens = np.concatenate(seqs).astype(dtype) if seqs else np.zeros(0, dtype=dtype)
+
+    tmp = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, np.dtype(dtype).itemsize, 0, len(seqs), len(tokens)))
+        f.write(offsets.tobytes())
+        f.write(tokens.tobytes())
+    os.replace(tmp, out_path)
+    return {"sequences": len(seqs), "tokens": int(len(tokens)), "dtype": np.dtype(dtype).name,
+            "bytes": os.path.getsize(out_path)}
+
+
+def is_corpus_file(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class TokenCorpus:
+    """
+    바이너리 코퍼스 읽기 전용 view
+    corpus[i] → i번째 시퀀스 (memmap의 slice, 복사 없음)
+    memmap은 처음 접근할 때 프로세스마다 열고, pickle(spawn worker)에는 경로만 넘김
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, itemsize, _, n_seqs, n_tokens = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"not a token corpus file: {path}")
+        if itemsize not in (1, 2):
+            raise ValueError(f"unsupported token itemsize {itemsize}: {path}")
+        self.dtype = np.uint8 if itemsize == 1 else np.uint16
+        self.n_seqs = n_seqs
+        self.n_tokens = n_tokens
+        self._offsets = None
+        self._tokens = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_offsets"] = state["_tokens"] = state["_pid"] = None
+        return state
+
+    def _open(self):
+        if self._tokens is None or self._pid != os.getpid():
+            off = _HEADER.size
+            self._offsets = np.memmap(self.path, dtype=np.int64, mode="r", offset=off, shape=(self.n_seqs + 1,))
+            off += (self.n_seqs + 1) * 8
+            self._tokens = np.memmap(self.path, dtype=self.dtype, mode="r", offset=off, shape=(self.n_tokens,)) \
+                if self.n_tokens else np.zeros(0, dtype=self.dtype)
+            self._pid = os.getpid()
+
+    def __len__(self):
+        return self.n_seqs
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        self._open()
+        return self._tokens[self._offsets[idx]:self._offsets[idx + 1]]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="melody_tok.jsonl → 바이너리 코퍼스 변환")
+    ap.add_argument("tok", nargs="?", default="./melody_tok.jsonl")
+    ap.add_argument("out", nargs="?", default=None, help="기본: tok과 같은 이름의 .bin")
+    args = ap.parse_args()
+
+    out = args.out or os.path.splitext(args.tok)[0] + ".bin"
+    start = time.time()
+    report = write_corpus(args.tok, out)
+    report["path"] = out
+    report["jsonl_bytes"] = os.path.getsize(args.tok)
+    report["sec"] = round(time.time() - start, 2)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,259 @@
+"""
+MelodyModel 학습 (sequence packing)
+- 짧은 곡 여러 개를 block_size 한 칸에 이어 붙여 PAD 계산을 줄임
+- 곡끼리는 서로 보지 못하도록 문서 단위 causal mask(attn_override) 사용,
+  위치 idx도 곡마다 0부터 다시 매김 → 곡 하나만 넣은 forward와 같은 계산
+- 체크포인트는 load_model이 읽는 {"model": state_dict} 형식 (+ optimizer / step, 이어서 학습용)
+예:
+  python token_corpus.py melody_tok.jsonl melody_tok.bin
+  python train.py --tok melody_tok.bin --out melModel_tf.pt --steps 3000
+  python train.py --tok new_tok.bin --init melModel_tf.pt --out melModel_ft.pt --steps 500
+"""
+import argparse
+import bisect
+import json
+import math
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset, DataLoader
+
+from data import MelodyDataset, MelodyVocab, trim_sequence
+from load_model import _new_model
+from token_corpus import TokenCorpus, is_corpus_file, read_jsonl_tokens
+
+
+class Cfg:
+    # run.py Cfg와 같은 모델 크기 / 학습 기본값
+    def __init__(self, **kwargs):
+        self.block_size = 384
+        self.hidden_size = 384
+        self.num_heads = 6
+        self.num_layers = 8
+        self.ffn_hidden_size = 4 * self.hidden_size
+        self.dropout = 0.1
+        self.batch_size = 4
+        self.lr = 3e-4
+        self.steps = 3000
+        self.print_every = 100
+        self.save_every = 1000
+        self.__dict__.update({k: v for k, v in kwargs.items() if v is not None})
+
+
+def pack_lengths(lengths, capacity: int):
+    """
+    길이 목록 → 칸(capacity) 목록 (best-fit decreasing)
+    각 칸은 들어간 항목 idx의 list, 긴 항목부터 남는 자리가 가장 작은 칸에 넣음
+    """
+    packs = []
+    free = [] # (남은 자리, 칸 idx) 정렬 유지
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        n = lengths[i]
+        j = bisect.bisect_left(free, (n, -1))
+        if j < len(free):
+            room, b = free.pop(j)
+            packs[b].append(i)
+            bisect.insort(free, (room - n, b))
+        else:
+            packs.append([i])
+            bisect.insort(free, (capacity - n, len(packs) - 1))
+    return packs
+
+
+class PackedMelodyDataset(Dataset):
+    """
+    곡(EOS에서 자르고 MelodyDataset과 같은 규칙으로 trim) 여러 개를 한 샘플로 이어 붙임
+    __getitem__ → x, y, positions, doc  (각각 [block_size])
+    - y는 같은 곡 안의 다음 토큰만 (곡 경계 / 남는 칸은 PAD → loss에서 제외)
+    - doc: 곡 번호 (남는 PAD 칸은 마지막 곡에 붙여서 참조할 key가 항상 있도록 함)
+    tok_path는 jsonl 또는 token_corpus 바이너리 (바이너리는 memmap)
+    """
+    def __init__(self, tok_path, vocab, block_size: int = 384, prefix_len: int = 7):
+        self.block_size = block_size
+        self.prefix_len = prefix_len
+        self.PAD_ID = vocab.PAD_ID
+        self.EOS_ID = vocab.EOS_ID
+        if is_corpus_file(tok_path):
+            self.corpus = TokenCorpus(tok_path)
+        else:
+            self.corpus = [np.asarray(ids, dtype=np.int64) for ids in read_jsonl_tokens(tok_path)]
+
+        # 곡마다 학습 위치 수 = trim한 길이 - 1 (1개 이하인 곡은 제외)
+        lengths = [len(self._doc(i)) - 1 for i in range(len(self.corpus))]
+        docs = [i for i, n in enumerate(lengths) if n > 0]
+        packs = pack_lengths([lengths[i] for i in docs], block_size)
+        self.packs = [[docs[k] for k in pack] for pack in packs]
+        self.n_docs = len(docs)
+        self.n_tokens = sum(lengths[i] for i in docs)
+
+    def _doc(self, i: int) -> np.ndarray:
+        return trim_sequence(self.corpus[i], self.block_size + 1, self.prefix_len, self.EOS_ID)
+
+    def fill_ratio(self) -> float:
+        """실제 토큰 / 전체 칸 (padding 학습에서는 곡 수 × block_size가 분모)"""
+        return self.n_tokens / max(1, len(self.packs) * self.block_size)
+
+    def __len__(self):
+        return len(self.packs)
+
+    def __getitem__(self, idx):
+        L = self.block_size
+        x = np.full(L, self.PAD_ID, dtype=np.int64)
+        y = np.full(L, self.PAD_ID, dtype=np.int64)
+        pos = np.zeros(L, dtype=np.int64)
+        doc = np.zeros(L, dtype=np.int64)
+        c = 0
+        for k, d in enumerate(self.packs[idx]):
+            seq = self._doc(d)
+            n = len(seq) - 1
+            x[c:c + n] = seq[:-1]
+            y[c:c + n] = seq[1:]
+            pos[c:c + n] = np.arange(n)
+            doc[c:c + n] = k
+            c += n
+        if c < L:
+            pos[c:] = pos[c - 1] + 1 + np.arange(L - c)
+            doc[c:] = doc[c - 1]
+        return (torch.from_numpy(x), torch.from_numpy(y),
+                torch.from_numpy(pos), torch.from_numpy(doc))
+
+
+def document_mask(doc: torch.Tensor, num_heads: int) -> torch.Tensor:
+    """
+    doc: [B, L] → nn.TransformerEncoder용 bool mask [B*H, L, L] (True = 참조 불가)
+    같은 곡의 자기 이전 위치만 참조
+    """
+    L = doc.size(1)
+    causal = torch.ones((L, L), dtype=torch.bool, device=doc.device).tril()
+    allowed = (doc.unsqueeze(2) == doc.unsqueeze(1)) & causal # [B, L, L]
+    return (~allowed).repeat_interleave(num_heads, dim=0)
+
+
+def save_checkpoint(path: str, model, optimizer, step: int, cfg):
+    # 학습 중 중단되어도 이전 체크포인트가 깨지지 않도록 임시 파일에 쓰고 교체
+    tmp = f"{path}.{os.getpid()}.tmp"
+    torch.save({
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "step": step,
+        "cfg": {k: v for k, v in vars(cfg).items() if isinstance(v, (int, float, str, bool))},
+    }, tmp)
+    os.replace(tmp, path)
+
+
+def _lr(step: int, cfg) -> float:
+    # warmup 후 cosine으로 lr의 10%까지
+    warmup = max(1, min(100, cfg.steps // 10))
+    if step < warmup:
+        return cfg.lr * (step + 1) / warmup
+    t = (step - warmup) / max(1, cfg.steps - warmup)
+    return cfg.lr * (0.1 + 0.9 * 0.5 * (1 + math.cos(math.pi * min(1.0, t))))
+
+
+def _batches(loader):
+    while True:
+        for batch in loader:
+            yield batch
+
+
+def train(cfg, tok_path, voc_path, out_path, device, init=None, pack=True, workers=2, seed=42):
+    torch.manual_seed(seed)
+    vocab = MelodyVocab(voc_path, cfg.block_size)
+    PAD_ID = vocab.PAD_ID
+
+    if pack:
+        dataset = PackedMelodyDataset(tok_path, vocab, cfg.block_size)
+        print(f"packed {dataset.n_docs} melodies into {len(dataset)} blocks "
+              f"(fill {dataset.fill_ratio():.1%})")
+    else:
+        dataset = MelodyDataset(tok_path, voc_path, cfg.block_size, cut_at_eos=True)
+
+    loader = DataLoader(
+        dataset, batch_size=cfg.batch_size, shuffle=True, drop_last=len(dataset) >= cfg.batch_size,
+        num_workers=workers, persistent_workers=workers > 0,
+        pin_memory=torch.device(device).type == "cuda",
+    )
+
+    model = _new_model(vocab, cfg).to(device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=cfg.lr, weight_decay=0.01)
+    step = 0
+    if init:
+        ckpt = torch.load(init, map_location="cpu")
+        model.load_state_dict(ckpt["model"], strict=True)
+        # 같은 체크포인트에서 이어서 학습할 때만 optimizer / step 복원
+        if init == out_path and "optimizer" in ckpt:
+            optimizer.load_state_dict(ckpt["optimizer"])
+            step = ckpt.get("step", 0)
+        print(f"initialized from {init} (step {step})")
+
+    model.train()
+    start = time.time()
+    seen_tokens = 0
+    slots = 0
+    loss_sum, loss_n = 0.0, 0
+    batches = _batches(loader)
+    while step < cfg.steps:
+        batch = next(batches)
+        if pack:
+            x, y, pos, doc = (t.to(device, non_blocking=True) for t in batch)
+            mask = document_mask(doc, cfg.num_heads)
+            logits = model(x, attn_override=mask, positions=pos)
+        else:
+            x, y = (t.to(device, non_blocking=True) for t in batch)
+            logits = model(x)
+
+        loss = F.cross_entropy(logits.reshape(-1, logits.size(-1)), y.reshape(-1), ignore_index=PAD_ID)
+
+        for group in optimizer.param_groups:
+            group["lr"] = _lr(step, cfg)
+        optimizer.zero_grad(set_to_none=True)
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+        optimizer.step()
+        step += 1
+
+        seen_tokens += int((y != PAD_ID).sum())
+        slots += y.numel()
+        loss_sum += loss.item()
+        loss_n += 1
+        if step % cfg.print_every == 0 or step == cfg.steps:
+            elapsed = time.time() - start
+            print(f"step {step}/{cfg.steps} loss {loss_sum / loss_n:.4f} "
+                  f"lr {_lr(step - 1, cfg):.2e} tokens/s {seen_tokens / elapsed:.0f} "
+                  f"fill {seen_tokens / max(1, slots):.1%}")
+            loss_sum, loss_n = 0.0, 0
+        if step % cfg.save_every == 0 or step == cfg.steps:
+            save_checkpoint(out_path, model, optimizer, step, cfg)
+            print(f"saved {out_path} (step {step})")
+
+    elapsed = time.time() - start
+    return {"steps": step, "sec": round(elapsed, 1), "tokens": seen_tokens,
+            "tokens_per_sec": round(seen_tokens / max(elapsed, 1e-9)),
+            "fill": round(seen_tokens / max(1, slots), 3)}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="MelodyModel 학습 (sequence packing)")
+    ap.add_argument("--tok", default="./melody_tok.jsonl", help="jsonl 또는 token_corpus.py 바이너리")
+    ap.add_argument("--voc", default="./melody_voc.json")
+    ap.add_argument("--out", default="./melModel_tf.pt")
+    ap.add_argument("--init", default=None, help="시작 가중치 (--out과 같으면 optimizer/step까지 이어서)")
+    ap.add_argument("--steps", type=int, default=None)
+    ap.add_argument("--batch-size", type=int, default=None)
+    ap.add_argument("--lr", type=float, default=None)
+    ap.add_argument("--save-every", type=int, default=None)
+    ap.add_argument("--print-every", type=int, default=None)
+    ap.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    ap.add_argument("--no-pack", action="store_true", help="곡마다 PAD로 채우는 기존 방식 (비교용)")
+    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    cfg = Cfg(steps=args.steps, batch_size=args.batch_size, lr=args.lr,
+              save_every=args.save_every, print_every=args.print_every)
+    report = train(cfg, args.tok, args.voc, args.out, args.device, init=args.init,
+                   pack=not args.no_pack, workers=args.workers, seed=args.seed)
+    print(json.dumps(report, indent=2))
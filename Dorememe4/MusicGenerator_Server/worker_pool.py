@@ -0,0 +1,215 @@
+import multiprocessing
+import queue
+import threading
+import traceback
+from multiprocessing.connection import wait
+
+_slot = None
+
+
+def worker_slot():
+    """worker 프로세스 안에서 자기 번호 (0..num_workers-1, 다시 띄운 worker도 같은 번호), 밖에서는 None"""
+    return _slot
+
+
+def _worker_main(initializer, initargs, handler, inbox, outbox, slot, threads):
+    """Worker 프로세스: 시작 시 한 번만 initializer(모델 로드)를 실행하고 job을 계속 처리"""
+    global _slot
+    _slot = slot
+    try:
+        initializer(*initargs)
+    except Exception:
+        print(f"Worker {multiprocessing.current_process().name}: initialization failed")
+        traceback.print_exc()
+        return
+
+    send_lock = threading.Lock()
+    outbox.send(("ready", None))
+    jobs = queue.Queue()
+
+    def consume():
+        while True:
+            job = jobs.get()
+            if job is None: # 종료 신호
+                break
+            try:
+                handler(job)
+            except Exception:
+                traceback.print_exc()
+            with send_lock:
+                outbox.send(("done", job))
+
+    # 한 프로세스 안에서 여러 job을 동시에 받아야 GenerationEngine이 batch로 묶을 수 있음
+    consumers = [threading.Thread(target=consume, daemon=True) for _ in range(max(1, threads))]
+    for t in consumers:
+        t.start()
+    while True:
+        try:
+            job = inbox.recv()
+        except EOFError:
+            job = None
+        if job is None:
+            break
+        jobs.put(job)
+    for _ in consumers:
+        jobs.put(None)
+    for t in consumers:
+        t.join()
+
+
+class _Worker:
+    def __init__(self, slot: int):
+        self.slot = slot
+        self.proc = None
+        self.inbox = None   # 메인 → worker (job)
+        self.outbox = None  # worker → 메인 ('ready' / 'done')
+        self.ready = False
+        self.running = []   # 이 worker에 보낸 뒤 아직 끝나지 않은 job
+
+
+class WorkerPool:
+    """
+    모델을 한 번만 로드한 long-lived worker 프로세스 풀
+    - job은 크기가 제한된 대기열(max_backlog)에 쌓이며, 가득 차면 submit()이 queue.Full을 던짐
+    - 메인 프로세스가 대기열에서 여유가 있는 worker(동시 job threads_per_worker개)에게 pipe로 하나씩 보냄
+      (worker끼리 공유하는 큐가 없으므로 worker가 죽어도 다른 worker에 영향 없음)
+    - monitor 스레드: worker가 죽으면(OOM, synth segfault 등) 그 worker에서 진행 중이던 job을 on_lost(job)로
+      알리고 같은 번호로 다시 띄움 (초기화에 실패해서 끝난 worker는 다시 띄우지 않음)
+    - initializer/handler는 spawn 방식에서도 피클링되도록 모듈 최상위 함수여야 함 (on_lost는 메인 프로세스에서 호출)
+    """
+    def __init__(self, initializer, handler, num_workers: int = 2, max_backlog: int = 32,
+                 threads_per_worker: int = 1, initargs=(), on_lost=None):
+        self.num_workers = num_workers
+        self._initializer = initializer
+        self._handler = handler
+        self._initargs = initargs
+        self._threads_per_worker = max(1, threads_per_worker)
+        self._on_lost = on_lost
+        self._pending = queue.Queue(maxsize=max_backlog)
+        self._workers = [_Worker(i) for i in range(num_workers)]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.restarts = 0
+
+    def start(self):
+        for w in self._workers:
+            self._spawn(w)
+        self._thread = threading.Thread(target=self._monitor, name="worker-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def ready_workers(self) -> int:
+        """모델 로드를 마치고 job을 받을 수 있는 (살아 있는) worker 수"""
+        return sum(1 for w in self._workers if w.ready and w.proc.is_alive())
+
+    def backlog(self):
+        """worker에 보내지 않고 대기 중인 job 수"""
+        return self._pending.qsize()
+
+    def submit(self, job):
+        # 대기열이 가득 차면 queue.Full (호출 측에서 HTTP 429로 응답)
+        self._pending.put_nowait(job)
+        self._dispatch()
+
+    def close(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        for w in self._workers:
+            try:
+                w.inbox.send(None)
+            except (OSError, ValueError):
+                pass
+        for w in self._workers:
+            w.proc.join(timeout)
+
+    # ----- 내부 -----
+
+    def _spawn(self, w):
+        inbox_recv, w.inbox = multiprocessing.Pipe(duplex=False)
+        w.outbox, outbox_send = multiprocessing.Pipe(duplex=False)
+        w.ready = False
+        w.running = []
+        w.proc = multiprocessing.Process(
+            target=_worker_main,
+            args=(self._initializer, self._initargs, self._handler, inbox_recv, outbox_send, w.slot,
+                  self._threads_per_worker),
+            name=f"music-worker-{w.slot}",
+            daemon=True,
+        )
+        w.proc.start()
+        # 자식 쪽 끝은 닫아야 자식이 죽었을 때 EOF를 받음
+        inbox_recv.close()
+        outbox_send.close()
+
+    def _dispatch(self):
+        # 대기 중인 job을 여유가 가장 많은 준비된 worker에게
+        with self._lock:
+            while True:
+                free = [w for w in self._workers
+                        if w.ready and w.proc.is_alive() and len(w.running) < self._threads_per_worker]
+                if not free:
+                    return
+                try:
+                    job = self._pending.get_nowait()
+                except queue.Empty:
+                    return
+                w = min(free, key=lambda w: len(w.running))
+                w.running.append(job)
+                try:
+                    w.inbox.send(job)
+                except (OSError, ValueError):
+                    # 보내는 사이에 죽은 worker: monitor가 on_lost로 처리
+                    pass
+
+    def _monitor(self):
+        while not self._stop.is_set():
+            conns = {w.outbox: w for w in self._workers if w.outbox is not None}
+            sentinels = {w.proc.sentinel: w for w in self._workers if w.outbox is not None}
+            for obj in wait(list(conns) + list(sentinels), timeout=0.5):
+                w = conns.get(obj)
+                if w is None:
+                    continue
+                try:
+                    kind, job = w.outbox.recv()
+                except (EOFError, OSError):
+                    continue
+                with self._lock:
+                    if kind == "ready":
+                        w.ready = True
+                    elif job in w.running:
+                        w.running.remove(job)
+            for w in self._workers:
+                if w.outbox is not None and not w.proc.is_alive():
+                    self._lost(w)
+            self._dispatch()
+
+    def _lost(self, w):
+        # 남은 메시지(끝난 job)를 먼저 읽은 뒤 진행 중이던 job을 알림
+        try:
+            while w.outbox.poll():
+                kind, job = w.outbox.recv()
+                if kind == "ready":
+                    w.ready = True
+                elif job in w.running:
+                    w.running.remove(job)
+        except (EOFError, OSError):
+            pass
+        with self._lock:
+            lost, was_ready = w.running, w.ready
+            w.running, w.ready = [], False
+        w.outbox.close()
+        w.inbox.close()
+        w.outbox = None
+        print(f"Worker {w.proc.name} exited (code {w.proc.exitcode}), {len(lost)} running jobs lost")
+        for job in lost:
+            if self._on_lost is not None:
+                try:
+                    self._on_lost(job)
+                except Exception:
+                    traceback.print_exc()
+        if was_ready and not self._stop.is_set():
+            # 모델 로드까지 마쳤던 worker만 다시 띄움 (초기화 실패는 반복해도 실패)
+            self.restarts += 1
+            self._spawn(w)